@@ -57,210 +57,263 @@ ask(Question, Attribute) :-
 
 % ==================== KNOWLEDGE BASE - DIAGNOSIS RULES ====================
 
-% Sleep Apnea - Severe
+% rule(?Diagnosis, ?Confidence, ?Recommendations, +Facts)
+% Facts is a list of Attribute-Value pairs and Recommendations a list of
+% Text-Priority pairs. Rules only read Facts, so they can be evaluated
+% without touching the database.
+%
+% The rule/4 clauses are generated from expert system/rules.json:
+%     python rule_compiler.py --prolog
+
+has(Facts, Attribute, Value) :-
+    memberchk(Attribute-Value, Facts).
+
+% Sleep Apnea: sleep_apnea_severe
+rule('Possible Sleep Apnea (High Risk)', 0.85,
+     ['URGENT: Consult a sleep specialist immediately'-high,
+      'Sleep apnea can be serious and requires medical evaluation'-high],
+     Facts) :-
+    has(Facts, snoring, loud),
+    has(Facts, breathing_pauses, yes),
+    has(Facts, daytime_sleepiness, high).
+
+% Sleep Apnea: sleep_apnea_moderate
+rule('Possible Sleep Apnea (Moderate Risk)', 0.65,
+     ['Consider consulting a sleep specialist'-medium,
+      'Monitor symptoms and keep a sleep diary'-medium],
+     Facts) :-
+    has(Facts, snoring, loud),
+    (has(Facts, breathing_pauses, yes) ; has(Facts, daytime_sleepiness, high)).
+
+% Insomnia: caffeine_insomnia
+rule('Caffeine-Related Onset Insomnia', 0.75,
+     ['Avoid caffeine after 2 PM'-high,
+      'Switch to decaf or herbal tea in afternoon/evening'-medium],
+     Facts) :-
+    has(Facts, sleep_onset, long),
+    has(Facts, caffeine_timing, late).
+
+% Insomnia: screen_insomnia
+rule('Blue Light-Related Onset Insomnia', 0.70,
+     ['Limit screen time 1-2 hours before bed'-high,
+      'Use blue light filters or night mode on devices'-medium,
+      'Try reading a physical book instead'-low],
+     Facts) :-
+    has(Facts, sleep_onset, long),
+    has(Facts, screen_time, high).
+
+% Insomnia: stress_insomnia
+rule('Stress-Related Maintenance Insomnia', 0.80,
+     ['Practice relaxation techniques (deep breathing, meditation)'-high,
+      'Consider cognitive behavioral therapy for insomnia (CBT-I)'-high,
+      'Keep a worry journal - write down concerns before bed'-medium,
+      'Try progressive muscle relaxation'-low],
+     Facts) :-
+    has(Facts, night_awakenings, frequent),
+    has(Facts, racing_thoughts, yes),
+    has(Facts, stress_level, high).
+
+% Insomnia: alcohol_disruption
+rule('Alcohol-Disrupted Sleep', 0.75,
+     ['Avoid alcohol 3-4 hours before bedtime'-high,
+      'Alcohol disrupts REM sleep and causes frequent awakenings'-medium],
+     Facts) :-
+    has(Facts, night_awakenings, frequent),
+    has(Facts, alcohol_consumption, yes).
+
+% Circadian Rhythm: circadian_disruption
+rule('Circadian Rhythm Disruption', 0.70,
+     ['Establish consistent sleep/wake times (even on weekends)'-high,
+      'Get bright light exposure in the morning'-high,
+      'Avoid bright light 2-3 hours before bed'-medium,
+      'Consider light therapy if working shifts'-medium],
+     Facts) :-
+    has(Facts, schedule_consistency, poor),
+    (has(Facts, shift_work, yes) ; has(Facts, irregular_bedtime, yes)).
+
+% Restless Leg Syndrome: restless_leg_syndrome
+rule('Possible Restless Leg Syndrome', 0.80,
+     ['Consult a physician for proper diagnosis'-high,
+      'Check iron and magnesium levels'-high,
+      'Try leg massages or stretching before bed'-medium,
+      'Avoid caffeine which can worsen symptoms'-medium],
+     Facts) :-
+    has(Facts, leg_discomfort, yes),
+    has(Facts, urge_to_move, yes).
+
+% Environmental: temperature_issue
+rule('Environmental Temperature Issue', 0.65,
+     ['Keep bedroom temperature between 60-67°F (15-19°C)'-high,
+      'Use breathable bedding materials'-medium,
+      'Consider a fan or adjust heating/cooling'-medium],
+     Facts) :-
+    (has(Facts, room_temp, too_hot) ; has(Facts, room_temp, too_cold)).
+
+% Environmental: light_pollution
+rule('Light Pollution Affecting Sleep', 0.70,
+     ['Use blackout curtains or eye mask'-high,
+      'Remove or cover LED lights from devices'-medium,
+      'Use dim red lights if nightlight needed'-low],
+     Facts) :-
+    has(Facts, bedroom_light, bright).
+
+% Environmental: noise_disruption
+rule('Noise-Related Sleep Disruption', 0.65,
+     ['Use white noise machine or fan'-high,
+      'Try earplugs designed for sleeping'-medium,
+      'Address noise sources if possible'-medium],
+     Facts) :-
+    has(Facts, bedroom_noise, high).
+
+% Poor Sleep Hygiene: poor_sleep_hygiene
+rule('Poor Sleep Hygiene - Bedroom Association', 0.70,
+     ['Use bedroom only for sleep and intimacy'-high,
+      'Remove TV, work materials from bedroom'-high,
+      'If can\'t sleep after 20 min, leave bedroom until sleepy'-medium],
+     Facts) :-
+    has(Facts, sleep_onset, long),
+    has(Facts, bedroom_activities, multiple).
+
+% Poor Sleep Hygiene: late_exercise
+rule('Exercise-Related Sleep Disruption', 0.60,
+     ['Avoid vigorous exercise 3-4 hours before bed'-high,
+      'Try morning or afternoon exercise instead'-medium,
+      'Gentle stretching or yoga in evening is okay'-low],
+     Facts) :-
+    has(Facts, exercise_timing, late).
+
+% Poor Sleep Hygiene: late_meals
+rule('Meal Timing Affecting Sleep', 0.60,
+     ['Avoid large meals 2-3 hours before bed'-high,
+      'If hungry, try light snack (banana, milk)'-medium,
+      'Avoid spicy or acidic foods in evening'-medium],
+     Facts) :-
+    has(Facts, meal_timing, late).
+
+% Poor Sleep Hygiene: excessive_napping
+rule('Excessive Daytime Napping', 0.65,
+     ['Limit naps to 20-30 minutes'-high,
+      'Avoid napping after 3 PM'-high,
+      'If very sleepy, investigate underlying causes'-medium],
+     Facts) :-
+    has(Facts, napping, excessive).
+
+% General Sleep Deprivation: sleep_deprivation
+rule('Chronic Sleep Deprivation', 0.80,
+     ['Prioritize 7-9 hours of sleep per night'-high,
+      'Gradually adjust bedtime earlier by 15 min increments'-high,
+      'Evaluate and reduce time-wasting activities'-medium],
+     Facts) :-
+    has(Facts, sleep_duration, insufficient),
+    has(Facts, daytime_sleepiness, high).
+
+% Anxiety/Mental Health: anxiety_sleep_issues
+rule('Anxiety-Related Sleep Disturbance', 0.75,
+     ['Consider therapy or counseling for anxiety'-high,
+      'Practice mindfulness meditation'-high,
+      'Try 4-7-8 breathing technique'-medium,
+      'Avoid checking clock during night'-medium],
+     Facts) :-
+    has(Facts, anxiety, high),
+    (has(Facts, sleep_onset, long) ; has(Facts, night_awakenings, frequent)).
+
+% Positive Sleep Patterns: healthy_sleep
+rule('Healthy Sleep Pattern', 0.90,
+     ['Your sleep appears healthy - maintain current habits!'-low,
+      'Continue consistent sleep schedule'-low],
+     Facts) :-
+    has(Facts, sleep_quality, good),
+    has(Facts, sleep_duration, adequate),
+    has(Facts, daytime_sleepiness, low).
+
+% No Clear Diagnosis: insufficient_information
+rule('Insufficient Information', 0.50,
+     ['Keep a detailed sleep diary for 2 weeks'-high,
+      'Track bedtime, wake time, and sleep quality'-high,
+      'Note factors like caffeine, exercise, stress'-medium],
+     Facts) :-
+    \+ has(Facts, sleep_quality, good),
+    \+ has(Facts, sleep_quality, poor).
+
+% ==================== RULE EVALUATION ====================
+
+% diagnose_batch(+Facts, -Diagnoses, -Recommendations)
+% Diagnoses is a list of Diagnosis-Confidence pairs in rule order, each
+% diagnosis at most once, and Recommendations the Text-Priority pairs of
+% those diagnoses. Has no side effects.
+diagnose_batch(Facts, Diagnoses, Recommendations) :-
+    findall(D-C-Recs, rule(D, C, Recs, Facts), Found),
+    list_to_set(Found, Unique),
+    findall(D-C, member(D-C-_, Unique), Diagnoses),
+    findall(R, (member(_-_-Recs, Unique), member(R, Recs)), Recommendations).
+
+% Record the diagnoses for the facts collected from the user
 apply_rules :-
-    fact(snoring, loud),
-    fact(breathing_pauses, yes),
-    fact(daytime_sleepiness, high),
-    \+ diagnosis('Possible Sleep Apnea (High Risk)', _),
-    assert(diagnosis('Possible Sleep Apnea (High Risk)', 0.85)),
-    assert(recommendation('URGENT: Consult a sleep specialist immediately', high)),
-    assert(recommendation('Sleep apnea can be serious and requires medical evaluation', high)),
-    fail.
-
-% Sleep Apnea - Moderate
-apply_rules :-
-    fact(snoring, loud),
-    (fact(breathing_pauses, yes) ; fact(daytime_sleepiness, high)),
-    \+ diagnosis('Possible Sleep Apnea (Moderate Risk)', _),
-    assert(diagnosis('Possible Sleep Apnea (Moderate Risk)', 0.65)),
-    assert(recommendation('Consider consulting a sleep specialist', medium)),
-    assert(recommendation('Monitor symptoms and keep a sleep diary', medium)),
-    fail.
-
-% Caffeine-Related Insomnia
-apply_rules :-
-    fact(sleep_onset, long),
-    fact(caffeine_timing, late),
-    \+ diagnosis('Caffeine-Related Onset Insomnia', _),
-    assert(diagnosis('Caffeine-Related Onset Insomnia', 0.75)),
-    assert(recommendation('Avoid caffeine after 2 PM', high)),
-    assert(recommendation('Switch to decaf or herbal tea in afternoon/evening', medium)),
-    fail.
-
-% Blue Light-Related Insomnia
-apply_rules :-
-    fact(sleep_onset, long),
-    fact(screen_time, high),
-    \+ diagnosis('Blue Light-Related Onset Insomnia', _),
-    assert(diagnosis('Blue Light-Related Onset Insomnia', 0.70)),
-    assert(recommendation('Limit screen time 1-2 hours before bed', high)),
-    assert(recommendation('Use blue light filters or night mode on devices', medium)),
-    assert(recommendation('Try reading a physical book instead', low)),
-    fail.
-
-% Stress-Related Insomnia
-apply_rules :-
-    fact(night_awakenings, frequent),
-    fact(racing_thoughts, yes),
-    fact(stress_level, high),
-    \+ diagnosis('Stress-Related Maintenance Insomnia', _),
-    assert(diagnosis('Stress-Related Maintenance Insomnia', 0.80)),
-    assert(recommendation('Practice relaxation techniques (deep breathing, meditation)', high)),
-    assert(recommendation('Consider cognitive behavioral therapy for insomnia (CBT-I)', high)),
-    assert(recommendation('Keep a worry journal - write down concerns before bed', medium)),
-    assert(recommendation('Try progressive muscle relaxation', low)),
-    fail.
-
-% Alcohol-Disrupted Sleep
-apply_rules :-
-    fact(night_awakenings, frequent),
-    fact(alcohol_consumption, yes),
-    \+ diagnosis('Alcohol-Disrupted Sleep', _),
-    assert(diagnosis('Alcohol-Disrupted Sleep', 0.75)),
-    assert(recommendation('Avoid alcohol 3-4 hours before bedtime', high)),
-    assert(recommendation('Alcohol disrupts REM sleep and causes frequent awakenings', medium)),
-    fail.
-
-% Circadian Rhythm Disruption
-apply_rules :-
-    fact(schedule_consistency, poor),
-    (fact(shift_work, yes) ; fact(irregular_bedtime, yes)),
-    \+ diagnosis('Circadian Rhythm Disruption', _),
-    assert(diagnosis('Circadian Rhythm Disruption', 0.70)),
-    assert(recommendation('Establish consistent sleep/wake times (even on weekends)', high)),
-    assert(recommendation('Get bright light exposure in the morning', high)),
-    assert(recommendation('Avoid bright light 2-3 hours before bed', medium)),
-    assert(recommendation('Consider light therapy if working shifts', medium)),
-    fail.
-
-% Restless Leg Syndrome
-apply_rules :-
-    fact(leg_discomfort, yes),
-    fact(urge_to_move, yes),
-    \+ diagnosis('Possible Restless Leg Syndrome', _),
-    assert(diagnosis('Possible Restless Leg Syndrome', 0.80)),
-    assert(recommendation('Consult a physician for proper diagnosis', high)),
-    assert(recommendation('Check iron and magnesium levels', high)),
-    assert(recommendation('Try leg massages or stretching before bed', medium)),
-    assert(recommendation('Avoid caffeine which can worsen symptoms', medium)),
-    fail.
-
-% Environmental Temperature Issue
-apply_rules :-
-    (fact(room_temp, too_hot) ; fact(room_temp, too_cold)),
-    \+ diagnosis('Environmental Temperature Issue', _),
-    assert(diagnosis('Environmental Temperature Issue', 0.65)),
-    assert(recommendation('Keep bedroom temperature between 60-67°F (15-19°C)', high)),
-    assert(recommendation('Use breathable bedding materials', medium)),
-    assert(recommendation('Consider a fan or adjust heating/cooling', medium)),
-    fail.
-
-% Light Pollution
-apply_rules :-
-    fact(bedroom_light, bright),
-    \+ diagnosis('Light Pollution Affecting Sleep', _),
-    assert(diagnosis('Light Pollution Affecting Sleep', 0.70)),
-    assert(recommendation('Use blackout curtains or eye mask', high)),
-    assert(recommendation('Remove or cover LED lights from devices', medium)),
-    assert(recommendation('Use dim red lights if nightlight needed', low)),
-    fail.
-
-% Noise Disruption
-apply_rules :-
-    fact(bedroom_noise, high),
-    \+ diagnosis('Noise-Related Sleep Disruption', _),
-    assert(diagnosis('Noise-Related Sleep Disruption', 0.65)),
-    assert(recommendation('Use white noise machine or fan', high)),
-    assert(recommendation('Try earplugs designed for sleeping', medium)),
-    assert(recommendation('Address noise sources if possible', medium)),
-    fail.
-
-% Poor Sleep Hygiene
-apply_rules :-
-    fact(sleep_onset, long),
-    fact(bedroom_activities, multiple),
-    \+ diagnosis('Poor Sleep Hygiene - Bedroom Association', _),
-    assert(diagnosis('Poor Sleep Hygiene - Bedroom Association', 0.70)),
-    assert(recommendation('Use bedroom only for sleep and intimacy', high)),
-    assert(recommendation('Remove TV, work materials from bedroom', high)),
-    assert(recommendation('If can\'t sleep after 20 min, leave bedroom until sleepy', medium)),
-    fail.
-
-% Late Exercise
-apply_rules :-
-    fact(exercise_timing, late),
-    \+ diagnosis('Exercise-Related Sleep Disruption', _),
-    assert(diagnosis('Exercise-Related Sleep Disruption', 0.60)),
-    assert(recommendation('Avoid vigorous exercise 3-4 hours before bed', high)),
-    assert(recommendation('Try morning or afternoon exercise instead', medium)),
-    assert(recommendation('Gentle stretching or yoga in evening is okay', low)),
-    fail.
-
-% Late Meals
-apply_rules :-
-    fact(meal_timing, late),
-    \+ diagnosis('Meal Timing Affecting Sleep', _),
-    assert(diagnosis('Meal Timing Affecting Sleep', 0.60)),
-    assert(recommendation('Avoid large meals 2-3 hours before bed', high)),
-    assert(recommendation('If hungry, try light snack (banana, milk)', medium)),
-    assert(recommendation('Avoid spicy or acidic foods in evening', medium)),
-    fail.
-
-% Excessive Napping
-apply_rules :-
-    fact(napping, excessive),
-    \+ diagnosis('Excessive Daytime Napping', _),
-    assert(diagnosis('Excessive Daytime Napping', 0.65)),
-    assert(recommendation('Limit naps to 20-30 minutes', high)),
-    assert(recommendation('Avoid napping after 3 PM', high)),
-    assert(recommendation('If very sleepy, investigate underlying causes', medium)),
-    fail.
-
-% Sleep Deprivation
-apply_rules :-
-    fact(sleep_duration, insufficient),
-    fact(daytime_sleepiness, high),
-    \+ diagnosis('Chronic Sleep Deprivation', _),
-    assert(diagnosis('Chronic Sleep Deprivation', 0.80)),
-    assert(recommendation('Prioritize 7-9 hours of sleep per night', high)),
-    assert(recommendation('Gradually adjust bedtime earlier by 15 min increments', high)),
-    assert(recommendation('Evaluate and reduce time-wasting activities', medium)),
-    fail.
-
-% Anxiety-Related Sleep Issues
-apply_rules :-
-    fact(anxiety, high),
-    (fact(sleep_onset, long) ; fact(night_awakenings, frequent)),
-    \+ diagnosis('Anxiety-Related Sleep Disturbance', _),
-    assert(diagnosis('Anxiety-Related Sleep Disturbance', 0.75)),
-    assert(recommendation('Consider therapy or counseling for anxiety', high)),
-    assert(recommendation('Practice mindfulness meditation', high)),
-    assert(recommendation('Try 4-7-8 breathing technique', medium)),
-    assert(recommendation('Avoid checking clock during night', medium)),
-    fail.
-
-% Healthy Sleep Pattern
-apply_rules :-
-    fact(sleep_quality, good),
-    fact(sleep_duration, adequate),
-    fact(daytime_sleepiness, low),
-    \+ diagnosis('Healthy Sleep Pattern', _),
-    assert(diagnosis('Healthy Sleep Pattern', 0.90)),
-    assert(recommendation('Your sleep appears healthy - maintain current habits!', low)),
-    assert(recommendation('Continue consistent sleep schedule', low)),
-    fail.
-% Insufficient Information
-apply_rules :-
-    \+ fact(sleep_quality, good),
-    \+ fact(sleep_quality, poor),
-    \+ diagnosis('Insufficient Information', _),
-    assert(diagnosis('Insufficient Information', 0.50)),
-    assert(recommendation('Keep a detailed sleep diary for 2 weeks', high)),
-    assert(recommendation('Track bedtime, wake time, and sleep quality', high)),
-    assert(recommendation('Note factors like caffeine, exercise, stress', medium)),
-    fail.
-apply_rules.
+    findall(Attribute-Value, fact(Attribute, Value), Facts),
+    diagnose_batch(Facts, Diagnoses, Recommendations),
+    forall(member(D-C, Diagnoses), assert(diagnosis(D, C))),
+    forall(member(R-P, Recommendations), assert(recommendation(R, P))).
+
+% ==================== BATCH SERVER ====================
+
+% Line protocol for long-lived worker processes (see prolog_bridge.py):
+%
+%     swipl -q -g batch_server -t halt "sleep optimizer.pl"
+%
+% Prints {"ready":true} once, then reads one JSON object of answers per
+% line from standard input and writes one JSON line per request:
+%     {"diagnoses":[{"diagnosis":D,"confidence":C},...],
+%      "recommendations":[[Text,Priority],...]}
+% or {"error":Message}. Stops at end of input.
+
+:- use_module(library(http/json)).
+
+batch_server :-
+    prompt(_, ''),
+    set_stream(user_input, encoding(utf8)),
+    set_stream(user_output, encoding(utf8)),
+    reply(_{ready: true}),
+    serve_requests.
+
+serve_requests :-
+    catch(json_read_dict(user_input, Request, [end_of_file(end_of_file)]), Error, true),
+    (   Request == end_of_file
+    ->  true
+    ;   (   var(Error)
+        ->  catch(serve_request(Request), Failure, reply_error(Failure))
+        ;   reply_error(Error)
+        ),
+        serve_requests
+    ).
+
+serve_request(Answers) :-
+    is_dict(Answers), !,
+    dict_pairs(Answers, _, Pairs),
+    maplist(answer_fact, Pairs, Facts),
+    diagnose_batch(Facts, Diagnoses, Recommendations),
+    findall(_{diagnosis: D, confidence: C}, member(D-C, Diagnoses), DiagnosisList),
+    findall([R, P], member(R-P, Recommendations), RecommendationList),
+    reply(_{diagnoses: DiagnosisList, recommendations: RecommendationList}).
+serve_request(_) :-
+    reply_error('expected a JSON object of answers').
+
+answer_fact(Attribute-Value, Attribute-Answer) :-
+    (   string(Value)
+    ->  atom_string(Answer, Value)
+    ;   Answer = Value
+    ).
+
+reply_error(Error) :-
+    (   atom(Error)
+    ->  Message = Error
+    ;   term_string(Error, Message)
+    ),
+    reply(_{error: Message}).
+
+reply(Dict) :-
+    json_write_dict(user_output, Dict, [width(0)]),
+    nl(user_output),
+    flush_output(user_output).
 
 % ==================== DISPLAY RESULTS ====================
 
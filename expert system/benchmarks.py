@@ -0,0 +1,444 @@
+"""
+Benchmarks for the sleep diagnosis engine.
+
+    python benchmarks.py single-fact --samples 500
+    python benchmarks.py startup --runs 5
+    python benchmarks.py suite --save-baseline baseline.json
+    python benchmarks.py suite --baseline baseline.json --tolerance 0.25
+
+The suite runs on a seeded synthetic workload drawn from the questionnaire
+options and exits with status 1 when a metric is worse than the baseline
+by more than the tolerance. GUI render times need a display (Xvfb works)
+and are skipped without one.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from experta.matchers.rete.token import Token
+from experta.strategies import DepthStrategy
+
+from decision_table import extract_rules, rule_domains
+from knowledge_expert import SleepQualityOptimizer, run_diagnosis, run_diagnosis_batch
+from questionnaire import QUESTIONS
+
+
+# ==================== WORKLOAD ====================
+
+def random_inputs(count, seed=0):
+    """Random questionnaires over the values the rules test, plus unmatched ones"""
+    rng = random.Random(seed)
+    domains = rule_domains(extract_rules())
+    workload = []
+    for _ in range(count):
+        workload.append({attribute: rng.choice(values + ['other'])
+                         for attribute, values in domains.items()})
+    return workload
+
+
+# Option weights by number of options; questionnaire options run roughly
+# from the healthiest answer to the least healthy one
+DISTRIBUTIONS = {
+    'uniform': lambda n: [1] * n,
+    'healthy': lambda n: [n - i for i in range(n)],
+    'unhealthy': lambda n: [i + 1 for i in range(n)],
+}
+
+
+def synthetic_inputs(count, seed=0, distribution='uniform', answer_rate=1.0, weights=None):
+    """
+    Seeded questionnaires answered like the GUI does, from its option lists
+
+    Args:
+        count: Number of questionnaires
+        seed: Random seed; the same arguments always give the same workload
+        distribution: Name in DISTRIBUTIONS giving the option weights
+        answer_rate: Probability that each question is answered
+        weights: Optional attribute -> list of option weights, overriding
+            the distribution for those questions
+
+    Returns:
+        List of dictionaries of logical values
+    """
+    rng = random.Random(seed)
+    questions = []
+    for _, attribute, options in QUESTIONS:
+        option_weights = (weights or {}).get(attribute) or DISTRIBUTIONS[distribution](len(options))
+        if len(option_weights) != len(options):
+            raise ValueError(f"{attribute} has {len(options)} options, got {len(option_weights)} weights")
+        questions.append((attribute, [logical for _, logical in options], option_weights))
+
+    workload = []
+    for _ in range(count):
+        user_inputs = {}
+        for attribute, values, option_weights in questions:
+            if answer_rate >= 1.0 or rng.random() < answer_rate:
+                user_inputs[attribute] = rng.choices(values, option_weights)[0]
+        workload.append(user_inputs)
+    return workload
+
+
+# ==================== ENGINE COUNTERS ====================
+
+class EngineCounters:
+    """Agenda activations and Rete tokens created while counting is enabled"""
+
+    def __init__(self):
+        self.activations = 0
+        self.tokens = 0
+
+
+@contextmanager
+def count_engine_work():
+    """Count agenda activations and Rete token allocations inside the block"""
+    counters = EngineCounters()
+    original_update = DepthStrategy._update_agenda
+    original_new = Token.__new__
+
+    def _update_agenda(self, agenda, added, removed):
+        counters.activations += len(added)
+        return original_update(self, agenda, added, removed)
+
+    def _new(cls, *args, **kwargs):
+        counters.tokens += 1
+        return original_new(cls, *args, **kwargs)
+
+    DepthStrategy._update_agenda = _update_agenda
+    Token.__new__ = _new
+    try:
+        yield counters
+    finally:
+        DepthStrategy._update_agenda = original_update
+        Token.__new__ = original_new
+
+
+def _measure(diagnose, workload):
+    diagnose(workload[0])  # build and warm the engine outside the timing
+    with count_engine_work() as counters:
+        started = time.perf_counter()
+        for user_inputs in workload:
+            diagnose(user_inputs)
+        elapsed = time.perf_counter() - started
+    count = len(workload)
+    return {
+        'activations': counters.activations / count,
+        'tokens': counters.tokens / count,
+        'ms': elapsed / count * 1000,
+    }
+
+
+def bench_single_fact(samples=500, seed=0):
+    """Compare one fact per answer against a single fact holding all answers"""
+    from single_fact import run_diagnosis_single_fact
+
+    workload = random_inputs(samples, seed)
+    return {
+        'multi_fact': _measure(run_diagnosis, workload),
+        'single_fact': _measure(run_diagnosis_single_fact, workload),
+    }
+
+
+def _print_comparison(results):
+    names = list(results)
+    print(f"{'per diagnosis':<16}" + "".join(f"{name:>14}" for name in names))
+    for metric in ('activations', 'tokens', 'ms'):
+        print(f"{metric:<16}" + "".join(f"{results[name][metric]:14.2f}" for name in names))
+
+
+# ==================== STARTUP ====================
+
+# Child processes report seconds elapsed since the wall-clock time passed in
+# argv[1], which the parent takes just before starting them
+_GUI_STARTUP = """
+import json, sys, time
+started = float(sys.argv[1])
+import tkinter as tk
+import gui
+root = tk.Tk()
+app = gui.SleepOptimizerGUI(root)
+root.update()
+first_paint = time.time() - started
+while not app.engine_ready.is_set():
+    root.update()
+    time.sleep(0.005)
+print(json.dumps({'first_paint': first_paint, 'engine_ready': time.time() - started}))
+root.destroy()
+"""
+
+_ENGINE_STARTUP = """
+import json, sys, time
+started = float(sys.argv[1])
+import knowledge_expert
+imported = time.time() - started
+knowledge_expert.get_default_pool().warm_up(1)
+print(json.dumps({'engine_import': imported, 'engine_ready': time.time() - started}))
+"""
+
+
+def _run_child(code, stdin=None):
+    here = os.path.dirname(os.path.abspath(__file__))
+    started = time.time()
+    completed = subprocess.run([sys.executable, '-c', code, repr(started)], cwd=here,
+                               input=stdin, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr else "child failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def bench_startup(runs=5):
+    """Median cold-start times, in seconds, of fresh interpreter processes
+
+    ``gui`` separates time-to-first-paint from time-to-engine-ready and
+    needs a display (Xvfb works); ``engine`` times importing the engine
+    module and building the first engine without any GUI.
+    """
+    results = {}
+    for name, code in (('engine', _ENGINE_STARTUP), ('gui', _GUI_STARTUP)):
+        try:
+            samples = [_run_child(code) for _ in range(runs)]
+        except RuntimeError as e:
+            results[name] = {'error': str(e)}
+            continue
+        results[name] = {metric: statistics.median(s[metric] for s in samples)
+                         for metric in samples[0]}
+    return results
+
+
+# ==================== SUITE ====================
+
+# Child process timing the GUI on the questionnaires read from stdin: every
+# question on a first (building) and a second (cached) visit, then
+# show_results for each questionnaire's result
+_GUI_RENDER = """
+import json, sys, time
+import tkinter as tk
+import gui
+from knowledge_expert import run_diagnosis
+workload = json.load(sys.stdin)
+root = tk.Tk()
+app = gui.SleepOptimizerGUI(root)
+root.update()
+passes = []
+for _ in range(2):
+    app.render_times.clear()
+    for index in range(app.total_questions):
+        app.show_question(index)
+    passes.append(list(app.render_times))
+results = []
+for user_inputs in workload:
+    result = run_diagnosis(user_inputs)
+    started = time.perf_counter()
+    app.show_results(*result)
+    root.update_idletasks()
+    results.append(time.perf_counter() - started)
+    for child in root.winfo_children():
+        if isinstance(child, tk.Toplevel):
+            child.destroy()
+    root.update()
+print(json.dumps({'first': passes[0], 'cached': passes[1], 'results': results}))
+root.destroy()
+"""
+
+# Metrics where a larger value is an improvement; smaller is better for the rest
+HIGHER_IS_BETTER = {'batch_records_per_s'}
+
+
+def _percentiles(name, seconds):
+    ordered = sorted(seconds)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {f'{name}_ms_p50': at(0.50), f'{name}_ms_p95': at(0.95), f'{name}_ms_p99': at(0.99),
+            f'{name}_ms_mean': statistics.fmean(ordered) * 1000}
+
+
+def bench_construction(runs=20):
+    """Time building SleepQualityOptimizer engines"""
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        SleepQualityOptimizer()
+        samples.append(time.perf_counter() - started)
+    return _percentiles('construction', samples)
+
+
+def bench_latency(workload):
+    """Per-call run_diagnosis latency on the shared, warm engine pool"""
+    run_diagnosis(workload[0])
+    samples = []
+    for user_inputs in workload:
+        started = time.perf_counter()
+        run_diagnosis(user_inputs)
+        samples.append(time.perf_counter() - started)
+    return _percentiles('latency', samples)
+
+
+def bench_throughput(workload):
+    """Records per second through run_diagnosis_batch"""
+    started = time.perf_counter()
+    for _ in run_diagnosis_batch(workload):
+        pass
+    return {'batch_records_per_s': len(workload) / (time.perf_counter() - started)}
+
+
+def bench_memory(workload):
+    """Bytes kept per diagnosis result and transient peak per diagnosis"""
+    run_diagnosis(workload[0])
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        peak = 0
+        results = []
+        for user_inputs in workload:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            results.append(run_diagnosis(user_inputs))
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        retained = tracemalloc.get_traced_memory()[0] - base
+    finally:
+        tracemalloc.stop()
+    return {'memory_retained_bytes': retained / len(results), 'memory_peak_bytes': peak}
+
+
+def bench_render(workload):
+    """show_question and show_results render times, in a child process"""
+    timings = _run_child(_GUI_RENDER, json.dumps(workload))
+    metrics = {}
+    metrics.update(_percentiles('show_question_first', timings['first']))
+    metrics.update(_percentiles('show_question', timings['cached']))
+    metrics.update(_percentiles('show_results', timings['results']))
+    return metrics
+
+
+def run_suite(samples=500, seed=0, distribution='uniform', answer_rate=1.0, gui=True, render_samples=20):
+    """
+    Run every benchmark on one synthetic workload
+
+    Returns:
+        Dictionary with the workload parameters, the environment, flat
+        metrics and the reason any benchmark was skipped
+    """
+    workload = synthetic_inputs(samples, seed, distribution, answer_rate)
+    metrics = {}
+    skipped = {}
+    metrics.update(bench_construction())
+    metrics.update(bench_latency(workload))
+    metrics.update(bench_throughput(workload))
+    metrics.update(bench_memory(workload))
+    if gui:
+        try:
+            metrics.update(bench_render(workload[:render_samples]))
+        except RuntimeError as e:
+            skipped['gui'] = str(e)
+    return {
+        'workload': {'samples': samples, 'seed': seed, 'distribution': distribution,
+                     'answer_rate': answer_rate},
+        'environment': {'python': platform.python_version(), 'machine': platform.machine(),
+                        'system': platform.system()},
+        'metrics': metrics,
+        'skipped': skipped,
+    }
+
+
+def save_baseline(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_to_baseline(report, baseline, tolerance=0.2):
+    """
+    Metrics of ``report`` worse than in ``baseline`` by more than ``tolerance``
+
+    Returns:
+        List of (metric, baseline value, current value, relative change)
+    """
+    regressions = []
+    for metric, previous in baseline['metrics'].items():
+        current = report['metrics'].get(metric)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        worse = -change if metric in HIGHER_IS_BETTER else change
+        if worse > tolerance:
+            regressions.append((metric, previous, current, change))
+    return regressions
+
+
+def _print_report(report, baseline=None):
+    previous = baseline['metrics'] if baseline else {}
+    for metric, value in report['metrics'].items():
+        line = f"{metric:<28}{value:14.3f}"
+        if metric in previous and previous[metric]:
+            line += f"   {(value - previous[metric]) / previous[metric]:+8.1%} vs baseline"
+        print(line)
+    for name, reason in report['skipped'].items():
+        print(f"{name} skipped: {reason}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sleep diagnosis benchmarks")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    single = subparsers.add_parser('single-fact', help="one fact per answer vs a single fact")
+    single.add_argument('--samples', type=int, default=500)
+    single.add_argument('--seed', type=int, default=0)
+
+    startup = subparsers.add_parser('startup', help="GUI first paint vs engine ready")
+    startup.add_argument('--runs', type=int, default=5)
+
+    suite = subparsers.add_parser('suite', help="engine and GUI benchmarks with baselines")
+    suite.add_argument('--samples', type=int, default=500)
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--distribution', choices=sorted(DISTRIBUTIONS), default='uniform')
+    suite.add_argument('--answer-rate', type=float, default=1.0)
+    suite.add_argument('--no-gui', action='store_true', help="skip the GUI render benchmarks")
+    suite.add_argument('--baseline', help="JSON baseline to compare against")
+    suite.add_argument('--save-baseline', help="write the results as a JSON baseline")
+    suite.add_argument('--tolerance', type=float, default=0.2,
+                       help="relative change counted as a regression (default 0.2)")
+
+    args = parser.parse_args(argv)
+    if args.benchmark == 'single-fact':
+        _print_comparison(bench_single_fact(args.samples, args.seed))
+    elif args.benchmark == 'startup':
+        for name, metrics in bench_startup(args.runs).items():
+            if 'error' in metrics:
+                print(f"{name:<8} skipped: {metrics['error']}")
+                continue
+            print(f"{name:<8}" + "  ".join(f"{metric} {seconds * 1000:8.1f} ms"
+                                           for metric, seconds in metrics.items()))
+    elif args.benchmark == 'suite':
+        report = run_suite(args.samples, args.seed, args.distribution, args.answer_rate,
+                           gui=not args.no_gui)
+        baseline = load_baseline(args.baseline) if args.baseline else None
+        _print_report(report, baseline)
+        if args.save_baseline:
+            save_baseline(report, args.save_baseline)
+        if baseline:
+            if baseline.get('workload') != report['workload']:
+                print("warning: baseline was recorded on a different workload", file=sys.stderr)
+            regressions = compare_to_baseline(report, baseline, args.tolerance)
+            for metric, previous, current, change in regressions:
+                print(f"REGRESSION {metric}: {previous:.3f} -> {current:.3f} ({change:+.1%})")
+            if regressions:
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
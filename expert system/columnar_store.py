@@ -0,0 +1,272 @@
+"""
+Binary columnar store of encoded questionnaires and their diagnoses.
+
+Parsing CSV or JSON dominates re-scoring and analytics of the same inputs.
+A store keeps one uint8 column per questionnaire attribute and an optional
+uint32 diagnosis bitmask column in a single file that readers map into
+memory; columns come back as read-only NumPy views of the mapping, so any
+number of processes can share one dataset without copying it.
+
+Layout (all integers little-endian):
+
+    8 bytes   magic b'SLEEPCOL'
+    uint32    format version
+    uint32    header length in bytes
+    header    UTF-8 JSON: row count, and per column its name, dtype,
+              byte offset and encoding (attribute values or diagnosis labels)
+    columns   each starting at an 8-byte aligned offset
+
+Attribute codes are those of the questionnaire schema (see input_schema):
+0 for a missing answer or a value outside the questionnaire, then 1, 2, ...
+for the distinct logical values in option order. Bit i of the diagnosis
+column stands for label i, as in VectorizedResult.bits.
+
+    python columnar_store.py answers.jsonl answers.scol
+"""
+import argparse
+import json
+import mmap
+import struct
+import sys
+
+import numpy as np
+
+from input_schema import QuestionnaireSchema, SchemaError, get_default_schema
+
+
+MAGIC = b'SLEEPCOL'
+VERSION = 1
+DIAGNOSES = 'diagnoses'
+
+_PREAMBLE = struct.Struct('<8sII')
+_ALIGNMENT = 8
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+# ==================== WRITER ====================
+
+class StoreWriter:
+    """Encodes questionnaires row by row and writes them as a store
+
+    Each attribute costs one byte per row while rows are being added.
+    Values outside the questionnaire are stored as missing and counted in
+    ``unknown``; attributes outside it are ignored.
+
+    Args:
+        diagnose: Also compute the diagnosis bitmask column when writing
+    """
+
+    def __init__(self, diagnose=True):
+        self.diagnose = diagnose
+        self.schema = get_default_schema()
+        self.values = {attribute: list(values) for attribute, values in self.schema.values.items()}
+        # Encoded rows, one byte per attribute
+        self._rows = bytearray()
+        self.unknown = dict.fromkeys(self.values, 0)
+        self.rows = 0
+
+    def add(self, user_inputs):
+        """Encode one questionnaire"""
+        try:
+            encoded = self.schema.encode(user_inputs)
+        except SchemaError as e:
+            for attribute in e.unknown_values:
+                self.unknown[attribute] += 1
+            encoded = self.schema.encode(user_inputs, strict=False)
+        self._rows += bytes(encoded)
+        self.rows += 1
+
+    def extend(self, records):
+        for user_inputs in records:
+            self.add(user_inputs)
+
+    def columns(self):
+        """The encoded attribute columns as uint8 arrays"""
+        matrix = np.frombuffer(self._rows, dtype=np.uint8).reshape(self.rows, len(self.schema))
+        return {attribute: np.ascontiguousarray(matrix[:, index])
+                for index, attribute in enumerate(self.schema.attributes)}
+
+    def write(self, path):
+        """Write the store to ``path``"""
+        columns = self.columns()
+        specs = [{'name': attribute, 'dtype': '|u1', 'values': self.values[attribute],
+                  'unknown': self.unknown[attribute]}
+                 for attribute in columns]
+        payloads = list(columns.values())
+        if self.diagnose:
+            result = evaluate_columns(columns, self.values, self.rows)
+            specs.append({'name': DIAGNOSES, 'dtype': '<u4', 'labels': list(result.labels)})
+            payloads.append(result.bits.astype('<u4', copy=False))
+
+        # Offsets depend on the header length, which depends on the offsets;
+        # settle them in a couple of passes
+        header_length = 0
+        while True:
+            offset = _aligned(_PREAMBLE.size + header_length)
+            for spec, payload in zip(specs, payloads):
+                spec['offset'] = offset
+                offset = _aligned(offset + payload.nbytes)
+            header = json.dumps({'rows': self.rows, 'columns': specs},
+                                ensure_ascii=False).encode('utf-8')
+            if len(header) == header_length:
+                break
+            header_length = len(header)
+
+        with open(path, 'wb') as f:
+            f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+            f.write(header)
+            for spec, payload in zip(specs, payloads):
+                f.write(b'\0' * (spec['offset'] - f.tell()))
+                f.write(payload.tobytes())
+
+
+def write_store(path, records, diagnose=True):
+    """Encode an iterable of questionnaires into a store at ``path``"""
+    writer = StoreWriter(diagnose)
+    writer.extend(records)
+    writer.write(path)
+    return writer.rows
+
+
+def evaluate_columns(columns, values, rows, evaluator=None):
+    """Run a VectorizedEvaluator over questionnaire-coded columns
+
+    ``values`` gives the logical value of each code, as in a store header.
+    """
+    from vectorized import VectorizedEvaluator
+
+    if evaluator is None:
+        evaluator = VectorizedEvaluator()
+    schema = QuestionnaireSchema.from_values(values)
+    return evaluator.evaluate(evaluator.project_columns(columns, schema), rows)
+
+
+# ==================== READER ====================
+
+class ColumnStore:
+    """Read-only, memory-mapped view of a store file
+
+    Attributes:
+        rows: number of questionnaires
+        columns: attribute -> uint8 NumPy view of its codes
+        values: attribute -> logical values, code i standing for values[i - 1]
+        diagnoses: uint32 NumPy view of the diagnosis bitmasks, or None
+        labels: diagnosis labels of the bitmask bits
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self._file.close()
+            raise
+
+        magic, version, header_length = _PREAMBLE.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a questionnaire store")
+        if version != VERSION:
+            self.close()
+            raise ValueError(f"{path} has unsupported store version {version}")
+        header = json.loads(self._map[_PREAMBLE.size:_PREAMBLE.size + header_length].decode('utf-8'))
+
+        self.rows = header['rows']
+        self.columns = {}
+        self.values = {}
+        self.unknown = {}
+        self.diagnoses = None
+        self.labels = []
+        for spec in header['columns']:
+            view = np.frombuffer(self._map, dtype=np.dtype(spec['dtype']),
+                                 count=self.rows, offset=spec['offset'])
+            if spec['name'] == DIAGNOSES:
+                self.diagnoses = view
+                self.labels = spec['labels']
+            else:
+                self.columns[spec['name']] = view
+                self.values[spec['name']] = spec['values']
+                self.unknown[spec['name']] = spec.get('unknown', 0)
+
+    def __len__(self):
+        return self.rows
+
+    def record(self, row):
+        """Decode one row back into a questionnaire dict"""
+        record = {}
+        for attribute, column in self.columns.items():
+            code = int(column[row])
+            if code:
+                record[attribute] = self.values[attribute][code - 1]
+        return record
+
+    def records(self):
+        for row in range(self.rows):
+            yield self.record(row)
+
+    def evaluate(self, evaluator=None):
+        """Diagnose every row with a VectorizedEvaluator, returning a VectorizedResult"""
+        return evaluate_columns(self.columns, self.values, self.rows, evaluator)
+
+    def close(self):
+        # Views into the mapping keep it alive; drop ours before closing
+        self.columns = {}
+        self.diagnoses = None
+        try:
+            self._map.close()
+        except BufferError:
+            # Callers still hold views; the mapping closes when they go away
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_store(path):
+    """Memory-map the store at ``path``"""
+    return ColumnStore(path)
+
+
+def main(argv=None):
+    from pipeline import READERS, detect_format
+
+    parser = argparse.ArgumentParser(description="Encode questionnaires into a columnar store")
+    parser.add_argument('input', help="CSV or JSONL file of questionnaires ('-' for stdin)")
+    parser.add_argument('output', help="store file to write")
+    parser.add_argument('--format', choices=sorted(READERS),
+                        help="input format (default: from file extension, jsonl for stdin)")
+    parser.add_argument('--no-diagnoses', action='store_true',
+                        help="store the questionnaires only")
+    args = parser.parse_args(argv)
+
+    input_format = args.format or detect_format(args.input)
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8', newline='')
+    try:
+        writer = StoreWriter(diagnose=not args.no_diagnoses)
+        writer.extend(READERS[input_format](source))
+        writer.write(args.output)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    print(f"{writer.rows} questionnaires written to {args.output}", file=sys.stderr)
+    for attribute, count in writer.unknown.items():
+        if count:
+            print(f"  {attribute}: {count} value(s) outside the questionnaire stored as missing",
+                  file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Compact, interned representation of diagnosis results.
+
+A run_diagnosis result is a list of diagnosis strings, a list of
+(text, priority) tuples and a dict: dozens of objects per record. Since
+every diagnosis and recommendation comes from a fixed rule, a result is
+fully described by the sequence of rules that fired. ResultCatalogue
+numbers the rules, diagnoses and recommendations once; a result is then
+stored as a diagnosis bitmask plus one byte per firing:
+
+    catalogue = get_default_catalogue()
+    results = CompactResults(catalogue)
+    for result in run_diagnosis_batch(inputs):
+        results.append(result)
+    diagnoses, recommendations, confidence_scores = results[0].to_tuple()
+
+to_tuple() gives back exactly the original result, in firing order and
+with any repeated firing. Diagnosis bits are numbered like
+VectorizedResult.bits.
+"""
+import threading
+from array import array
+
+from decision_table import extract_rules
+
+
+# Array typecode of an unsigned integer of at least 32 bits
+UINT32 = 'I' if array('I').itemsize >= 4 else 'L'
+
+
+class ResultCatalogue:
+    """Shared numbering of the rules, diagnoses and recommendations
+
+    Attributes:
+        labels: diagnosis labels, bit i of a mask standing for labels[i]
+        confidences: confidence of each label
+        recommendations: interned (text, priority) tuples, indexed by ID
+        rule_labels: label indices each rule adds when it fires
+        rule_recommendations: recommendation IDs each rule adds when it fires
+    """
+
+    def __init__(self, specs=None):
+        if specs is None:
+            specs = extract_rules()
+        if len(specs) > 255:
+            raise ValueError("At most 255 rules fit in a one-byte firing")
+
+        self.labels = []
+        self.recommendations = []
+        self.rule_labels = []
+        self.rule_recommendations = []
+        confidences = {}
+        label_index = {}
+        recommendation_index = {}
+        for spec in specs:
+            indices = []
+            for diagnosis in spec.diagnoses:
+                if diagnosis not in label_index:
+                    label_index[diagnosis] = len(self.labels)
+                    self.labels.append(diagnosis)
+                indices.append(label_index[diagnosis])
+            ids = []
+            for recommendation in spec.recommendations:
+                recommendation = tuple(recommendation)
+                if recommendation not in recommendation_index:
+                    recommendation_index[recommendation] = len(self.recommendations)
+                    self.recommendations.append(recommendation)
+                ids.append(recommendation_index[recommendation])
+            self.rule_labels.append(tuple(indices))
+            self.rule_recommendations.append(tuple(ids))
+            confidences.update(spec.confidence_scores)
+        if len(self.labels) > 32:
+            raise ValueError("At most 32 distinct diagnoses fit in a mask")
+
+        self.labels = tuple(self.labels)
+        self.recommendations = tuple(self.recommendations)
+        self.confidences = tuple(confidences[label] for label in self.labels)
+        self.rule_masks = tuple(sum(1 << i for i in indices) for indices in self.rule_labels)
+
+        # A rule is recognised by the first diagnosis it makes
+        self._rule_by_label = {}
+        for rule, indices in enumerate(self.rule_labels):
+            if indices:
+                self._rule_by_label.setdefault(self.labels[indices[0]], rule)
+
+    def firings(self, result):
+        """Rules that produced a run_diagnosis result, as bytes in firing order"""
+        diagnoses, recommendations, _ = result
+        rules = []
+        position = 0
+        while position < len(diagnoses):
+            rule = self._rule_by_label.get(diagnoses[position])
+            if rule is None:
+                raise ValueError(f"Diagnosis not in the catalogue: {diagnoses[position]!r}")
+            rules.append(rule)
+            position += len(self.rule_labels[rule])
+        firings = bytes(rules)
+        if self._recommendations(firings) != [tuple(r) for r in recommendations]:
+            raise ValueError("Recommendations do not match the rules that fired")
+        return firings
+
+    def rules_of(self, diagnoses):
+        """Indices of the rules that made a list of diagnoses, without checking it"""
+        rule_by_label = self._rule_by_label
+        return [rule_by_label[label] for label in diagnoses if label in rule_by_label]
+
+    def mask(self, firings):
+        mask = 0
+        for rule in firings:
+            mask |= self.rule_masks[rule]
+        return mask
+
+    def encode(self, result):
+        """Compact form of a run_diagnosis result"""
+        firings = self.firings(result)
+        return CompactResult(self.mask(firings), firings, self)
+
+    def to_tuple(self, firings):
+        """(diagnoses, recommendations, confidence_scores) of a firing sequence"""
+        diagnoses = []
+        confidence_scores = {}
+        for rule in firings:
+            for index in self.rule_labels[rule]:
+                label = self.labels[index]
+                diagnoses.append(label)
+                confidence_scores[label] = self.confidences[index]
+        return diagnoses, self._recommendations(firings), confidence_scores
+
+    def _recommendations(self, firings):
+        recommendations = self.recommendations
+        return [recommendations[i] for rule in firings for i in self.rule_recommendations[rule]]
+
+
+class CompactResult:
+    """One diagnosis result as a bitmask and a firing sequence"""
+
+    __slots__ = ('mask', 'firings', 'catalogue')
+
+    def __init__(self, mask, firings, catalogue):
+        self.mask = mask
+        self.firings = firings
+        self.catalogue = catalogue
+
+    def has(self, label):
+        return bool(self.mask >> self.catalogue.labels.index(label) & 1)
+
+    def labels(self):
+        """Distinct diagnoses, in rule definition order"""
+        return [label for i, label in enumerate(self.catalogue.labels) if self.mask >> i & 1]
+
+    def recommendation_ids(self):
+        """Interned recommendation IDs, in the order they were made"""
+        rule_recommendations = self.catalogue.rule_recommendations
+        return [i for rule in self.firings for i in rule_recommendations[rule]]
+
+    def to_tuple(self):
+        """The result in run_diagnosis format"""
+        return self.catalogue.to_tuple(self.firings)
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactResult):
+            return NotImplemented
+        return self.firings == other.firings and self.catalogue is other.catalogue
+
+    def __hash__(self):
+        return hash(self.firings)
+
+    def __repr__(self):
+        return f"CompactResult(mask={self.mask:#x}, firings={list(self.firings)})"
+
+
+class CompactResults:
+    """Append-only array of results for batch jobs
+
+    Masks live in one array and the firings of all results in another,
+    indexed by an offsets array, so each result costs about a dozen bytes.
+    """
+
+    def __init__(self, catalogue=None):
+        self.catalogue = catalogue if catalogue is not None else get_default_catalogue()
+        self.masks = array(UINT32)
+        self.firings = array('B')
+        self.offsets = array(UINT32, [0])
+
+    def append(self, result):
+        """Add a run_diagnosis result or a CompactResult"""
+        if isinstance(result, CompactResult):
+            firings, mask = result.firings, result.mask
+        else:
+            firings = self.catalogue.firings(result)
+            mask = self.catalogue.mask(firings)
+        self.masks.append(mask)
+        self.firings.frombytes(firings)
+        self.offsets.append(len(self.firings))
+
+    def extend(self, results):
+        for result in results:
+            self.append(result)
+
+    def __len__(self):
+        return len(self.masks)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("result index out of range")
+        firings = self.firings[self.offsets[index]:self.offsets[index + 1]].tobytes()
+        return CompactResult(self.masks[index], firings, self.catalogue)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def to_tuples(self):
+        """Iterate over the results in run_diagnosis format"""
+        for result in self:
+            yield result.to_tuple()
+
+    def prevalence(self):
+        """Number of results carrying each diagnosis, keyed by label"""
+        counts = [0] * len(self.catalogue.labels)
+        for mask in self.masks:
+            while mask:
+                low = mask & -mask
+                counts[low.bit_length() - 1] += 1
+                mask ^= low
+        return dict(zip(self.catalogue.labels, counts))
+
+
+_default_catalogue = None
+_default_catalogue_lock = threading.Lock()
+
+
+def get_default_catalogue():
+    """Return the catalogue of the SleepQualityOptimizer rules, building it on first use"""
+    global _default_catalogue
+    with _default_catalogue_lock:
+        if _default_catalogue is None:
+            _default_catalogue = ResultCatalogue()
+        return _default_catalogue
+
+
+def compact_result(result, catalogue=None):
+    """Compact form of a run_diagnosis result"""
+    if catalogue is None:
+        catalogue = get_default_catalogue()
+    return catalogue.encode(result)
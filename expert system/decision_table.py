@@ -0,0 +1,434 @@
+"""
+Precomputed decision table for the SleepQualityOptimizer rules.
+
+The compiler walks the @Rule patterns of the engine class, turns each rule
+into its disjunctive branches and tabulates, for every combination of the
+values that rule reads, which branches fire. A diagnosis then needs one
+dictionary lookup per answered attribute plus one table index per rule,
+with no Rete network involved.
+
+Run as a script to compile the table, verify it against the engine and
+optionally write it to disk:
+
+    python decision_table.py --verify 5000 --output decision_table.json
+"""
+import argparse
+import json
+import random
+import sys
+from collections import namedtuple
+from itertools import product
+from types import SimpleNamespace
+
+from experta import AND, OR, NOT, Fact, Rule
+from experta.fieldconstraint import FieldConstraint
+
+from knowledge_expert import SleepQualityOptimizer, run_diagnosis
+
+
+# A literal is (attribute, value, positive); a branch is a tuple of literals
+RuleSpec = namedtuple('RuleSpec', 'name branches diagnoses recommendations confidence_scores')
+
+# Value standing in for "answered, but with a value no rule matches"
+UNMATCHED = '<unmatched>'
+
+
+# ==================== RULE EXTRACTION ====================
+
+def _pattern_literal(pattern):
+    if not isinstance(pattern, Fact):
+        raise ValueError(f"Unsupported conditional element: {pattern!r}")
+    items = [(k, v) for k, v in pattern.items() if not Fact.is_special(k)]
+    if len(items) != 1 or isinstance(items[0][1], FieldConstraint):
+        raise ValueError(f"Only single-attribute literal patterns are supported: {pattern!r}")
+    return items[0]
+
+
+def rule_branches(element):
+    """Expand a rule or conditional element into a list of conjunctive branches
+
+    Each branch is a tuple of (attribute, value, positive) literals.
+    """
+    if isinstance(element, NOT):
+        attribute, value = _pattern_literal(element[0])
+        return [((attribute, value, False),)]
+    if isinstance(element, OR):
+        return [branch for child in element for branch in rule_branches(child)]
+    if isinstance(element, (AND, Rule)):
+        parts = [rule_branches(child) for child in element]
+        return [sum(combo, ()) for combo in product(*parts)]
+    attribute, value = _pattern_literal(element)
+    return [((attribute, value, True),)]
+
+
+def extract_rules(engine_class=SleepQualityOptimizer):
+    """Return a RuleSpec for every rule of the engine, in definition order
+
+    The right-hand side of each rule is replayed against a scratch object to
+    capture the diagnoses, recommendations and confidences it produces.
+    """
+    specs = []
+    for name, rule in vars(engine_class).items():
+        if not isinstance(rule, Rule):
+            continue
+        probe = SimpleNamespace(diagnoses=[], recommendations=[], confidence_scores={})
+        rule._wrapped(probe)
+        specs.append(RuleSpec(name,
+                              tuple(rule_branches(rule)),
+                              tuple(probe.diagnoses),
+                              tuple(probe.recommendations),
+                              tuple(probe.confidence_scores.items())))
+    return specs
+
+
+def rule_domains(specs):
+    """Map each attribute read by the rules to the values they test, in rule order"""
+    domains = {}
+    for spec in specs:
+        for branch in spec.branches:
+            for attribute, value, _ in branch:
+                values = domains.setdefault(attribute, [])
+                if value not in values:
+                    values.append(value)
+    return domains
+
+
+# ==================== TABLE COMPILATION ====================
+
+def _branch_firing(branch, assignment):
+    """Return the firing descriptor of a branch under an assignment, or None
+
+    ``assignment`` maps attributes to values (missing means not declared).
+    The descriptor lists the attributes whose facts the activation holds and
+    whether experta adds the InitialFact to it.
+    """
+    matched = []
+    for attribute, value, positive in branch:
+        holds = attribute in assignment and assignment[attribute] == value
+        if holds != positive:
+            return None
+        if positive and attribute not in matched:
+            matched.append(attribute)
+    initial = not matched or not branch[0][2]
+    return tuple(matched), initial
+
+
+def _check_ties(specs):
+    """Reject rule sets where two rules could fire on the very same facts
+
+    The engine orders activations by the ids of their facts; two rules that
+    can activate on identical facts would be ordered by Rete internals the
+    table cannot reproduce.
+    """
+    seen = {}
+    for spec in specs:
+        for branch in spec.branches:
+            positives = frozenset((a, v) for a, v, positive in branch if positive)
+            owner = seen.setdefault(positives, spec.name)
+            if owner != spec.name:
+                raise ValueError(f"Rules {owner} and {spec.name} can fire on the same facts; "
+                                 "their relative order is not determined by the facts")
+
+
+class DecisionTable:
+    """Indexable table reproducing run_diagnosis without the Rete network"""
+
+    def __init__(self, specs, domains, rules):
+        self.specs = specs
+        self.domains = domains
+        # value -> code per attribute; 0 means unmatched or not declared
+        self.codes = {attribute: {value: code for code, value in enumerate(values, 1)}
+                      for attribute, values in domains.items()}
+        # per rule: (attributes, strides, cells); cells are indexed by the
+        # mixed-radix encoding of the rule's attribute codes
+        self.rules = rules
+        # (schema, per rule [(position, lut, stride), ...] and cells) for lookup_encoded
+        self._encoded_rules = None
+
+    @classmethod
+    def compile(cls, engine_class=SleepQualityOptimizer):
+        specs = extract_rules(engine_class)
+        _check_ties(specs)
+        domains = rule_domains(specs)
+
+        rules = []
+        for spec in specs:
+            attributes = []
+            for branch in spec.branches:
+                for attribute, _, _ in branch:
+                    if attribute not in attributes:
+                        attributes.append(attribute)
+
+            strides = []
+            stride = 1
+            for attribute in reversed(attributes):
+                strides.insert(0, stride)
+                stride *= len(domains[attribute]) + 1
+
+            cells = []
+            for combo in product(*[range(len(domains[a]) + 1) for a in attributes]):
+                assignment = {a: domains[a][code - 1] for a, code in zip(attributes, combo) if code}
+                firings = [_branch_firing(branch, assignment) for branch in spec.branches]
+                cells.append(tuple(f for f in firings if f is not None))
+            rules.append((tuple(attributes), tuple(strides), cells))
+
+        return cls(specs, domains, rules)
+
+    def lookup(self, user_inputs):
+        """Return (diagnoses, recommendations, confidence_scores) for the inputs"""
+        return self.evaluate(user_inputs, range(len(self.rules)))
+
+    def evaluate(self, user_inputs, rules):
+        """Like lookup, but only considering the rules with the given indices
+
+        Rules left out are treated as not firing.
+        """
+        codes = self.codes
+        positions = {}
+        values = {}
+        # Fact ids follow declaration order; the InitialFact holds id 0
+        for position, (attribute, value) in enumerate(user_inputs.items(), 1):
+            attribute_codes = codes.get(attribute)
+            if attribute_codes is not None:
+                positions[attribute] = position
+                values[attribute] = attribute_codes.get(value, 0)
+
+        firings = []
+        table_rules = self.rules
+        for index in rules:
+            attributes, strides, cells = table_rules[index]
+            cell = 0
+            for attribute, stride in zip(attributes, strides):
+                cell += values.get(attribute, 0) * stride
+            for matched, initial in cells[cell]:
+                key = sorted((positions[a] for a in matched), reverse=True)
+                if initial:
+                    key.append(0)
+                firings.append((key, index))
+
+        return self._result(firings)
+
+    def _schema_rules(self, schema):
+        encoded_rules = self._encoded_rules
+        if encoded_rules is None or encoded_rules[0] is not schema:
+            missing = schema.missing(self.domains)
+            if missing:
+                raise ValueError(f"Rules read attributes outside the questionnaire: {missing}")
+            luts = schema.projection(self.codes)
+            rules = []
+            for attributes, strides, cells in self.rules:
+                terms = [(schema.index[a], luts[schema.index[a]], stride)
+                         for a, stride in zip(attributes, strides)]
+                rules.append((terms, cells))
+            self._encoded_rules = encoded_rules = (schema, rules)
+        return encoded_rules[1]
+
+    def lookup_encoded(self, encoded, schema=None):
+        """
+        lookup() of a questionnaire encoded with a QuestionnaireSchema
+
+        The answers count as given in question order, like
+        lookup(schema.decode(encoded)).
+        """
+        if schema is None:
+            from input_schema import get_default_schema
+            schema = get_default_schema()
+        index = schema.index
+        firings = []
+        for rule_index, (terms, cells) in enumerate(self._schema_rules(schema)):
+            cell = 0
+            for position, lut, stride in terms:
+                cell += lut[encoded[position]] * stride
+            for matched, initial in cells[cell]:
+                key = sorted((index[a] + 1 for a in matched), reverse=True)
+                if initial:
+                    key.append(0)
+                firings.append((key, rule_index))
+        return self._result(firings)
+
+    def _result(self, firings):
+        # Same order as the engine's depth strategy: newest facts first
+        firings.sort(reverse=True)
+
+        diagnoses = []
+        recommendations = []
+        confidence_scores = {}
+        for _, index in firings:
+            spec = self.specs[index]
+            diagnoses.extend(spec.diagnoses)
+            recommendations.extend(spec.recommendations)
+            confidence_scores.update(spec.confidence_scores)
+        return diagnoses, recommendations, confidence_scores
+
+    def to_dict(self):
+        return {
+            'rules': [
+                {'name': spec.name,
+                 'branches': [list(map(list, branch)) for branch in spec.branches],
+                 'diagnoses': list(spec.diagnoses),
+                 'recommendations': [list(r) for r in spec.recommendations],
+                 'confidence_scores': [list(c) for c in spec.confidence_scores],
+                 'attributes': list(attributes),
+                 'strides': list(strides),
+                 'cells': [[[list(matched), initial] for matched, initial in cell] for cell in cells]}
+                for spec, (attributes, strides, cells) in zip(self.specs, self.rules)
+            ],
+            'domains': self.domains,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        specs = []
+        rules = []
+        for rule in data['rules']:
+            specs.append(RuleSpec(rule['name'],
+                                  tuple(tuple(tuple(literal) for literal in branch)
+                                        for branch in rule['branches']),
+                                  tuple(rule['diagnoses']),
+                                  tuple(tuple(r) for r in rule['recommendations']),
+                                  tuple(tuple(c) for c in rule['confidence_scores'])))
+            cells = [tuple((tuple(matched), initial) for matched, initial in cell)
+                     for cell in rule['cells']]
+            rules.append((tuple(rule['attributes']), tuple(rule['strides']), cells))
+        return cls(specs, {a: list(v) for a, v in data['domains'].items()}, rules)
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+
+_default_table = None
+
+
+def get_default_table():
+    """Return the table compiled from SleepQualityOptimizer, compiling it once
+
+    The table is cached on disk next to the rule file (see rule_compiler).
+    """
+    global _default_table
+    if _default_table is None:
+        from rule_compiler import cached_decision_table
+        _default_table = cached_decision_table(SleepQualityOptimizer)
+    return _default_table
+
+
+def run_diagnosis_fast(user_inputs, table=None):
+    """
+    Table-driven equivalent of run_diagnosis
+
+    Args:
+        user_inputs: Dictionary of user responses
+        table: DecisionTable to use (defaults to the compiled engine rules)
+
+    Returns:
+        Tuple of (diagnoses, recommendations, confidence_scores)
+    """
+    if table is None:
+        table = get_default_table()
+    return table.lookup(user_inputs)
+
+
+def run_diagnosis_encoded(encoded, table=None, schema=None):
+    """
+    Table-driven diagnosis of a questionnaire encoded with input_schema
+
+    Args:
+        encoded: Tuple of schema codes, as returned by QuestionnaireSchema.encode
+        table: DecisionTable to use (defaults to the compiled engine rules)
+        schema: QuestionnaireSchema of ``encoded`` (defaults to the questionnaire's)
+
+    Returns:
+        Tuple of (diagnoses, recommendations, confidence_scores) of the
+        answers given in question order
+    """
+    if table is None:
+        table = get_default_table()
+    return table.lookup_encoded(encoded, schema)
+
+
+# ==================== VERIFICATION ====================
+
+def _comparable(result):
+    diagnoses, recommendations, confidence_scores = result
+    return diagnoses, recommendations, list(confidence_scores.items())
+
+
+def _mismatch(table, user_inputs, pool=None):
+    expected = _comparable(run_diagnosis(user_inputs, pool))
+    return expected != _comparable(table.lookup(user_inputs))
+
+
+def verify_decision_table(table=None, samples=1000, seed=0, pool=None):
+    """
+    Check the table against the Rete engine
+
+    Every rule is checked exhaustively over the values of the attributes it
+    reads (including unmatched and missing answers); whole questionnaires
+    are then sampled at random, in random answer order, to cover the
+    interaction between rules.
+
+    Args:
+        pool: EnginePool of the engine the table was compiled from
+            (defaults to the shared SleepQualityOptimizer pool)
+
+    Returns:
+        List of inputs for which the table and the engine disagree
+    """
+    if table is None:
+        table = get_default_table()
+    mismatches = []
+
+    for attributes, _, _ in table.rules:
+        choices = [table.domains[a] + [UNMATCHED, None] for a in attributes]
+        for combo in product(*choices):
+            user_inputs = {a: v for a, v in zip(attributes, combo) if v is not None}
+            if _mismatch(table, user_inputs, pool):
+                mismatches.append(user_inputs)
+
+    rng = random.Random(seed)
+    attributes = list(table.domains)
+    for _ in range(samples):
+        rng.shuffle(attributes)
+        user_inputs = {}
+        for attribute in attributes:
+            value = rng.choice(table.domains[attribute] + [UNMATCHED, None])
+            if value is not None:
+                user_inputs[attribute] = value
+        if _mismatch(table, user_inputs, pool):
+            mismatches.append(user_inputs)
+
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile and verify the sleep diagnosis decision table")
+    parser.add_argument('--output', help="write the compiled table to this JSON file")
+    parser.add_argument('--verify', type=int, metavar='SAMPLES',
+                        help="verify against the engine with this many random questionnaires")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    table = DecisionTable.compile()
+    cells = sum(len(cells) for _, _, cells in table.rules)
+    print(f"Compiled {len(table.rules)} rules over {len(table.domains)} attributes into {cells} cells")
+
+    if args.output:
+        table.save(args.output)
+
+    if args.verify is not None:
+        mismatches = verify_decision_table(table, args.verify, args.seed)
+        print(f"Verification: {len(mismatches)} mismatch(es)")
+        for user_inputs in mismatches[:10]:
+            print(f"  {user_inputs}")
+        if mismatches:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
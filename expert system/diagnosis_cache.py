@@ -0,0 +1,157 @@
+"""
+Memoizing cache in front of run_diagnosis.
+
+The answers are validated and encoded with the questionnaire schema (see
+input_schema), and the key keeps, for the attributes the rules read, the
+index of the rule value each answer matches, or 0 when it is missing or
+matches no rule. The key does not depend on the order of the input
+dictionary, so the many answer combinations the GUI collapses into the
+same logical values share one entry. Answers outside the questionnaire
+raise SchemaError unless the cache is built with strict=False.
+
+On a miss the engine runs on the canonical form of the answers: the
+matched attributes, in questionnaire order. Results are therefore the
+same as run_diagnosis for answers given in question order, as the GUI
+sends them. Cached results are immutable: diagnoses and recommendations
+are tuples, and confidence scores a read-only mapping.
+"""
+import threading
+import time
+from collections import OrderedDict
+from operator import getitem
+from types import MappingProxyType
+
+from decision_table import extract_rules, rule_domains
+from input_schema import get_default_schema
+from knowledge_expert import run_diagnosis
+
+
+DEFAULT_MAXSIZE = 4096
+
+
+class CacheStats:
+    """Counters of a DiagnosisCache"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def as_dict(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expirations': self.expirations}
+
+    def __repr__(self):
+        return "CacheStats(%s)" % ", ".join(f"{k}={v}" for k, v in self.as_dict().items())
+
+
+class DiagnosisCache:
+    """Size-bounded LRU cache of diagnoses with optional time-to-live
+
+    Args:
+        maxsize: Maximum number of cached answer combinations
+        ttl: Seconds an entry stays valid (None keeps entries until evicted)
+        diagnose: Function computing a result on a miss
+        schema: QuestionnaireSchema the answers are checked against
+        strict: Raise SchemaError for answers outside the questionnaire
+            instead of treating them as unanswered
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=None, diagnose=run_diagnosis,
+                 schema=None, strict=True):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.diagnose = diagnose
+        self.schema = schema if schema is not None else get_default_schema()
+        self.strict = strict
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        domains = rule_domains(extract_rules())
+        missing = self.schema.missing(domains)
+        if missing:
+            raise ValueError(f"Rules read attributes outside the questionnaire: {missing}")
+        codes = {a: {v: code for code, v in enumerate(values, 1)} for a, values in domains.items()}
+        # Schema code -> rule value code, per schema attribute
+        self._luts = self.schema.projection(codes)
+        self._values = [domains.get(a) for a in self.schema.attributes]
+
+    def key(self, user_inputs):
+        """Canonical, order-independent key of the answers the rules read"""
+        return tuple(map(getitem, self._luts, self.schema.encode(user_inputs, self.strict)))
+
+    def canonical_inputs(self, key):
+        """Answers equivalent to ``key``, in questionnaire order"""
+        return {attribute: values[code - 1]
+                for attribute, values, code in zip(self.schema.attributes, self._values, key) if code}
+
+    def get(self, user_inputs):
+        """Return the (immutable) result for the answers, computing it on a miss"""
+        key = self.key(user_inputs)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, expires = entry
+                if expires is None or expires > now:
+                    self._entries.move_to_end(key)
+                    self.stats.hits += 1
+                    return result
+                del self._entries[key]
+                self.stats.expirations += 1
+            self.stats.misses += 1
+
+        # Computed outside the lock; concurrent misses on one key may both
+        # run the engine, and the results are identical
+        diagnoses, recommendations, confidence_scores = self.diagnose(self.canonical_inputs(key))
+        result = (tuple(diagnoses), tuple(recommendations),
+                  MappingProxyType(dict(confidence_scores)))
+
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (result, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Return the cache used by cached_run_diagnosis, creating it on first use"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = DiagnosisCache()
+        return _default_cache
+
+
+def cached_run_diagnosis(user_inputs, cache=None):
+    """
+    Cached equivalent of run_diagnosis
+
+    Args:
+        user_inputs: Dictionary of user responses
+        cache: DiagnosisCache to use (defaults to a shared cache)
+
+    Returns:
+        Tuple of (diagnoses, recommendations, confidence_scores), immutable
+    """
+    if cache is None:
+        cache = get_default_cache()
+    return cache.get(user_inputs)
@@ -1,12 +1,30 @@
+import queue
+import threading
+import time
 import tkinter as tk
+from collections import deque
 from tkinter import ttk, messagebox, scrolledtext
-from knowledge_expert import run_diagnosis
+from questionnaire import QUESTIONS
+
+# The engine module (experta and the rule network) is imported lazily so the
+# first question is painted before it has loaded
+_engine_module = None
+
+
+def load_engine():
+    """Import knowledge_expert on first use and return it"""
+    global _engine_module
+    if _engine_module is None:
+        import knowledge_expert
+        _engine_module = knowledge_expert
+    return _engine_module
+
 
 class SleepOptimizerGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Sleep Quality Optimizer - Expert System")
-        self.root.geometry("900x700")
+        self.root.geometry("1160x700")
         self.root.configure(bg='#2c3e50')
         
         # Store user responses
@@ -28,6 +46,24 @@ class SleepOptimizerGUI:
                            bg='#2c3e50', fg='#bdc3c7')
         subtitle.pack(pady=(0, 20))
         
+        # Side panel with provisional findings, updated after every answer
+        live_panel = tk.Frame(main_frame, bg='#34495e', width=240)
+        live_panel.pack(side='right', fill='y', padx=(10, 0))
+        live_panel.pack_propagate(False)
+        tk.Label(live_panel, text="Provisional Findings",
+                 font=('Helvetica', 12, 'bold'), bg='#34495e', fg='#ecf0f1').pack(pady=(12, 8))
+        self.live_label = tk.Label(live_panel, text="Loading expert system...",
+                                   font=('Helvetica', 10), bg='#34495e', fg='#bdc3c7',
+                                   justify='left', anchor='nw', wraplength=215)
+        self.live_label.pack(fill='both', expand=True, padx=10)
+
+        # Live engine session; attached once the engine has loaded
+        self.session = None
+        self._new_session = None
+        # Question planner; until it is attached every question is asked
+        self.planner = None
+        self._new_planner = None
+
         # Create canvas with scrollbar for questions
         canvas_frame = tk.Frame(main_frame, bg='#34495e')
         canvas_frame.pack(fill=tk.BOTH, expand=True)
@@ -63,73 +99,92 @@ class SleepOptimizerGUI:
         self.question_container = tk.Frame(self.questions_frame, bg='#34495e')
         self.question_container.pack(fill='both', expand=True, padx=10, pady=10)
 
+        # Question panes are built on first visit and shown/hidden afterwards
+        self.question_panes = {}
+        # One 'write' trace per response variable: var_name -> trace id
+        self._trace_ids = {}
+        # Seconds taken by recent show_question calls, including layout
+        self.render_times = deque(maxlen=1000)
+
+        # Background analysis: results come back through the queue tagged
+        # with the ticket of the request; cancelling bumps the ticket
+        self._analysis_results = queue.Queue()
+        self._analysis_ticket = 0
+        self._analysis_running = False
+
         # Navigation / action area (prev / next / analyze)
         self.nav_frame = tk.Frame(main_frame, bg='#2c3e50')
         self.nav_frame.pack(fill='x', pady=(10, 0))
+        self.build_navigation()
 
         # Start by showing the first question
         self.show_question(0)
 
+        # Load the engine and build one in the background while the user answers
+        self.engine_ready = threading.Event()
+        self.root.after_idle(self.start_engine_warmup)
+
+    def start_engine_warmup(self):
+        threading.Thread(target=self._warm_up_engine, daemon=True).start()
+        self.root.after(100, self._attach_session)
+
+    def _warm_up_engine(self):
+        """Runs on a worker thread; never touches Tk"""
+        try:
+            engine = load_engine()
+            engine.get_default_pool().warm_up(1)
+            self._new_session = engine.DiagnosisSession()
+            from question_planner import get_default_planner
+            self._new_planner = get_default_planner()
+        finally:
+            # Set even on failure; analyze_sleep will report the error
+            self.engine_ready.set()
+
+    def _attach_session(self):
+        """Adopt the live session built in the background and catch it up"""
+        if not self.engine_ready.is_set():
+            self.root.after(100, self._attach_session)
+            return
+        self.session = self._new_session
+        self.planner = self._new_planner
+        self.update_navigation()
+        if self.session is None:
+            self.live_label.config(text="Live findings unavailable.")
+            return
+        for var_name in self.responses:
+            self.on_answer_changed(var_name, refresh=False)
+        self.update_live_panel()
+
+    def on_answer_changed(self, var_name, refresh=True):
+        """Declare or retract the answer to one question in the live session"""
+        if refresh:
+            # The answer may decide whether later questions still matter
+            self.update_navigation()
+        if self.session is None:
+            return
+        ui_val = self.responses[var_name].get()
+        if ui_val:
+            self.session.set_answer(var_name, self._ui_to_logical.get(ui_val, ui_val))
+        else:
+            self.session.clear_answer(var_name)
+        if refresh:
+            self.update_live_panel()
+
+    def update_live_panel(self):
+        """Show the diagnoses the current answers lead to"""
+        diagnoses, _, confidence_scores = self.session.results()
+        lines = []
+        for diagnosis in dict.fromkeys(diagnoses):
+            lines.append(f"• {diagnosis} ({confidence_scores.get(diagnosis, 0.5)*100:.0f}%)")
+        self.live_label.config(text="\n\n".join(lines) if lines else "No findings yet.")
+
     def build_questions_data(self):
         """Prepare questions as a data list: (text, var_name, options)"""
-        # raw question definitions with logical values (may repeat)
-        raw_questions = [
-            ("1. How would you rate your overall sleep quality?", "sleep_quality",
-             [("Excellent", "excellent"), ("Good", "good"), ("Fair", "fair"), ("Poor", "poor"), ("Very Poor", "very_poor")]),
-            ("2. How long does it typically take you to fall asleep?", "sleep_onset",
-             [("Less than 15 minutes", "normal"), ("15-30 minutes", "normal"), ("30-60 minutes", "long"), ("More than 60 minutes", "long")]),
-            ("3. How many times do you wake up during the night?", "night_awakenings",
-             [("0 times", "none"), ("1-2 times", "occasional"), ("3-4 times", "frequent"), ("5+ times", "frequent")]),
-            ("4. How many hours of sleep do you get per night on average?", "sleep_duration",
-             [("Less than 5 hours", "insufficient"), ("5-6 hours", "insufficient"), ("6-7 hours", "adequate"), ("7-9 hours", "adequate"), ("More than 9 hours", "excessive")]),
-            ("5. Do you feel excessively sleepy during the day?", "daytime_sleepiness",
-             [("Not at all", "low"), ("Occasionally", "medium"), ("Frequently", "high"), ("All the time", "high")]),
-            ("6. Do you snore loudly?", "snoring",
-             [("No", "none"), ("Occasionally", "mild"), ("Yes, frequently", "loud"), ("I don't know", "unknown")]),
-            ("7. Has anyone noticed you stop breathing during sleep?", "breathing_pauses",
-             [("Yes", "yes"), ("No", "no"), ("I sleep alone/Don't know", "unknown")]),
-            ("8. When do you consume your last caffeinated beverage?", "caffeine_timing",
-             [("I don't consume caffeine", "none"), ("Before noon", "early"), ("12 PM - 2 PM", "early"), ("After 2 PM", "late")]),
-            ("9. How much screen time do you have in the hour before bed?", "screen_time",
-             [("None", "low"), ("Less than 30 minutes", "low"), ("30-60 minutes", "medium"), ("More than 60 minutes", "high")]),
-            ("10. Do you experience racing thoughts when trying to sleep?", "racing_thoughts",
-             [("Never", "no"), ("Occasionally", "sometimes"), ("Frequently", "yes"), ("Always", "yes")]),
-            ("11. How would you rate your current stress level?", "stress_level",
-             [("Low", "low"), ("Moderate", "medium"), ("High", "high"), ("Very High", "high")]),
-            ("12. Do you experience anxiety symptoms?", "anxiety",
-             [("No", "low"), ("Mild", "medium"), ("Moderate", "high"), ("Severe", "high")]),
-            ("13. How consistent is your sleep schedule (bedtime and wake time)?", "schedule_consistency",
-             [("Very consistent (within 30 min)", "good"), ("Somewhat consistent (within 1 hour)", "fair"), ("Inconsistent (varies by 1-2 hours)", "poor"), ("Very inconsistent (varies by 2+ hours)", "poor")]),
-            ("14. Do you work shifts or have an irregular work schedule?", "shift_work",
-             [("No, regular schedule", "no"), ("Yes, rotating shifts", "yes"), ("Yes, night shifts", "yes"), ("Yes, irregular hours", "yes")]),
-            ("15. Do you go to bed at different times each night?", "irregular_bedtime",
-             [("No, usually same time", "no"), ("Sometimes varies", "sometimes"), ("Yes, very irregular", "yes")]),
-            ("16. How is your bedroom temperature?", "room_temp",
-             [("Too cold", "too_cold"), ("Comfortable (60-67°F)", "comfortable"), ("Too hot", "too_hot")]),
-            ("17. How dark is your bedroom at night?", "bedroom_light",
-             [("Very dark", "dark"), ("Some light", "dim"), ("Bright/Light pollution", "bright")]),
-            ("18. How noisy is your bedroom environment?", "bedroom_noise",
-             [("Very quiet", "low"), ("Some noise", "medium"), ("Noisy", "high")]),
-            ("19. Do you use your bedroom for activities other than sleep?", "bedroom_activities",
-             [("No, only for sleep", "sleep_only"), ("Yes, occasionally", "some"), ("Yes, frequently (TV, work, etc.)", "multiple")]),
-            ("20. Do you consume alcohol within 3 hours of bedtime?", "alcohol_consumption",
-             [("Never", "no"), ("Occasionally", "sometimes"), ("Frequently", "yes"), ("Daily", "yes")]),
-            ("21. When do you typically exercise?", "exercise_timing",
-             [("I don't exercise regularly", "none"), ("Morning", "early"), ("Afternoon", "early"), ("Within 3 hours of bedtime", "late")]),
-            ("22. When do you eat your last meal?", "meal_timing",
-             [("3+ hours before bed", "early"), ("2-3 hours before bed", "moderate"), ("Within 2 hours of bed", "late"), ("Right before bed", "late")]),
-            ("23. How often do you nap during the day?", "napping",
-             [("Never", "none"), ("Occasionally (< 30 min)", "moderate"), ("Frequently (30+ min)", "excessive"), ("Daily long naps", "excessive")]),
-            ("24. Do you experience leg discomfort or restlessness at night?", "leg_discomfort",
-             [("No", "no"), ("Occasionally", "sometimes"), ("Frequently", "yes"), ("Always", "yes")]),
-            ("25. Do you have an irresistible urge to move your legs when lying down?", "urge_to_move",
-             [("No", "no"), ("Sometimes", "sometimes"), ("Yes", "yes")]),
-        ]
-
         # Build questions with unique UI ids for each option, but keep mapping to logical values
+        # (raw question definitions with logical values live in questionnaire.py)
         self._ui_to_logical = {}
         self.questions = []
-        for q_text, q_name, opts in raw_questions:
+        for q_text, q_name, opts in QUESTIONS:
             ui_opts = []
             for i, (display, logical_val) in enumerate(opts):
                 ui_id = f"{q_name}__opt{i}"
@@ -139,21 +194,75 @@ class SleepOptimizerGUI:
 
         self.total_questions = len(self.questions)
 
-    def clear_question_container(self):
-        for child in self.question_container.winfo_children():
-            child.destroy()
+    def current_answers(self):
+        """Logical values of the questions answered so far"""
+        answers = {}
+        for var_name, var in self.responses.items():
+            ui_val = var.get()
+            if ui_val:
+                answers[var_name] = self._ui_to_logical.get(ui_val, ui_val)
+        return answers
+
+    def question_matters(self, index, answers):
+        """Whether a question can still change the diagnosis"""
+        return self.planner is None or self.planner.matters(self.questions[index][1], answers)
+
+    def next_index(self, index):
+        """Index of the next question worth asking after ``index``, or None"""
+        answers = self.current_answers()
+        for i in range(index + 1, self.total_questions):
+            if self.question_matters(i, answers):
+                return i
+        return None
+
+    def prev_index(self, index):
+        """Index of the closest earlier question worth asking, or None"""
+        answers = self.current_answers()
+        for i in range(index - 1, -1, -1):
+            if self.question_matters(i, answers):
+                return i
+        return None
+
+    def build_navigation(self):
+        """Create the progress label and buttons once; show_question reconfigures them"""
+        # Progress label
+        self.progress_label = tk.Label(self.nav_frame, text="",
+                                       font=('Helvetica', 10), bg='#2c3e50', fg='#bdc3c7')
+        self.progress_label.pack(side='left', padx=10)
+
+        # Previous button
+        self.prev_btn = tk.Button(self.nav_frame, text="◀ Previous", command=self.prev_question,
+                                  font=('Helvetica', 11), bg='#95a5a6', fg='white', relief='flat', padx=12, pady=8, cursor='hand2')
+        self.prev_btn.pack(side='right', padx=6)
+
+        # Next or Analyze button
+        self.next_btn = tk.Button(self.nav_frame, text="Next ▶", command=self.next_question,
+                                  font=('Helvetica', 11), bg='#3498db', fg='white', relief='flat', padx=12, pady=8, cursor='hand2')
+        self.next_btn.pack(side='right', padx=6)
+
+        # Progress indicator and cancel button, packed only while analyzing
+        self.analysis_frame = tk.Frame(self.nav_frame, bg='#2c3e50')
+        self.analysis_progress = ttk.Progressbar(self.analysis_frame, mode='indeterminate', length=140)
+        self.analysis_progress.pack(side='left', padx=6)
+        self.cancel_btn = tk.Button(self.analysis_frame, text="Cancel", command=self.cancel_analysis,
+                                    font=('Helvetica', 10), bg='#e74c3c', fg='white', relief='flat', padx=10, pady=6, cursor='hand2')
+        self.cancel_btn.pack(side='left', padx=6)
 
     def show_question(self, index):
         """Render one question at a time with previous/next controls"""
+        started = time.perf_counter()
+
         # clamp index
         if index < 0:
             index = 0
         if index >= len(self.questions):
             index = len(self.questions) - 1
-        self.current_q = index
 
-        # Clear existing question widgets
-        self.clear_question_container()
+        # Hide the question currently shown
+        current = self.question_panes.get(self.current_q)
+        if current is not None:
+            current.pack_forget()
+        self.current_q = index
 
         q_text, q_name, q_options = self.questions[index]
 
@@ -161,36 +270,31 @@ class SleepOptimizerGUI:
         if q_name not in self.responses:
             self.responses[q_name] = tk.StringVar(self.root)
 
-        # Create the question UI
-        self.create_question_widget(self.question_container, q_text, q_name, q_options)
-
-        # Update navigation frame
-        for child in self.nav_frame.winfo_children():
-            child.destroy()
+        # Create the question UI on first visit, reuse it afterwards
+        pane = self.question_panes.get(index)
+        if pane is None:
+            pane = self.create_question_widget(self.question_container, q_text, q_name, q_options)
+            self.question_panes[index] = pane
+        else:
+            pane.pack(fill='both', expand=False, pady=10)
 
-        # Progress label
-        progress = tk.Label(self.nav_frame, text=f"Question {index+1} of {self.total_questions}",
-                            font=('Helvetica', 10), bg='#2c3e50', fg='#bdc3c7')
-        progress.pack(side='left', padx=10)
+        # Update navigation widgets
+        self.progress_label.config(text=f"Question {index+1} of {self.total_questions}")
+        self.update_navigation()
 
-        # Previous button
-        prev_btn = tk.Button(self.nav_frame, text="◀ Previous", command=self.prev_question,
-                             font=('Helvetica', 11), bg='#95a5a6', fg='white', relief='flat', padx=12, pady=8, cursor='hand2')
-        prev_btn.pack(side='right', padx=6)
-        if index == 0:
-            prev_btn.config(state=tk.DISABLED)
+        self.root.update_idletasks()
+        self.render_times.append(time.perf_counter() - started)
 
-        # Next or Analyze button
-        if index == self.total_questions - 1:
-            next_text = "🔍 Analyze"
-            next_cmd = self.analyze_sleep
+    def update_navigation(self):
+        """Enable Previous and turn Next into Analyze when no question is left to ask"""
+        if self._analysis_running:
+            return
+        index = self.current_q
+        self.prev_btn.config(state=tk.DISABLED if self.prev_index(index) is None else tk.NORMAL)
+        if self.next_index(index) is None:
+            self.next_btn.config(text="🔍 Analyze", command=self.analyze_sleep)
         else:
-            next_text = "Next ▶"
-            next_cmd = self.next_question
-
-        next_btn = tk.Button(self.nav_frame, text=next_text, command=next_cmd,
-                             font=('Helvetica', 11), bg='#3498db', fg='white', relief='flat', padx=12, pady=8, cursor='hand2')
-        next_btn.pack(side='right', padx=6)
+            self.next_btn.config(text="Next ▶", command=self.next_question)
 
     def next_question(self):
         # Ensure current has a selection
@@ -199,17 +303,22 @@ class SleepOptimizerGUI:
         if var is None or not var.get():
             messagebox.showwarning("Select an answer", "Please select an answer before continuing.")
             return
-        # Move to next
-        if self.current_q < self.total_questions - 1:
-            self.show_question(self.current_q + 1)
+        # Move to the next question that can still change the outcome
+        index = self.next_index(self.current_q)
+        if index is not None:
+            self.show_question(index)
 
     def prev_question(self):
-        if self.current_q > 0:
-            self.show_question(self.current_q - 1)
+        index = self.prev_index(self.current_q)
+        if index is not None:
+            self.show_question(index)
 
     
     def create_question_widget(self, parent, question_text, var_name, options):
-        """Create a question widget that shows modern, single-select radio options."""
+        """Create a question widget that shows modern, single-select radio options.
+
+        Returns the outer frame so callers can hide and re-show it.
+        """
         # Centering container: create an inner frame centered in parent
         q_frame = tk.Frame(parent, bg='#34495e')
         q_frame.pack(fill='both', expand=False, pady=10)
@@ -253,7 +362,15 @@ class SleepOptimizerGUI:
                     indicator.delete('all')
                     indicator.create_oval(2, 2, 16, 16, outline='#95a5a6', width=2)
 
-        var.trace_add('write', lambda *a: refresh_styles())
+        # Keep exactly one trace per variable, bound to the latest widgets
+        old_trace = self._trace_ids.get(var_name)
+        if old_trace is not None:
+            var.trace_remove('write', old_trace)
+        def on_write(*args):
+            refresh_styles()
+            self.on_answer_changed(var_name)
+
+        self._trace_ids[var_name] = var.trace_add('write', on_write)
 
         # Create each option as a centered row with a custom indicator
         for display, value in options:
@@ -299,6 +416,7 @@ class SleepOptimizerGUI:
 
         # Initial style refresh
         refresh_styles()
+        return q_frame
     
     def create_questions(self):
         """Create all question widgets"""
@@ -568,10 +686,16 @@ class SleepOptimizerGUI:
     
     def analyze_sleep(self):
         """Analyze sleep patterns and show results"""
-        # Check if all questions are answered
+        # Ignore repeated clicks while an analysis is running
+        if self._analysis_running:
+            return
+
+        # Check if all questions that still matter are answered, collecting
+        # the logical values of the answers
+        user_inputs = self.current_answers()
         unanswered = []
-        for var_name, var in self.responses.items():
-            if not var.get():
+        for index, (_, var_name, _) in enumerate(self.questions):
+            if var_name not in user_inputs and self.question_matters(index, user_inputs):
                 unanswered.append(var_name)
 
         if unanswered:
@@ -580,23 +704,73 @@ class SleepOptimizerGUI:
                                   f"{len(unanswered)} question(s) remaining.")
             return
 
-        # Collect user inputs and translate UI ids back to logical values
-        user_inputs = {}
-        for var_name, var in self.responses.items():
-            ui_val = var.get()
-            # map UI id to logical value if mapping exists
-            logical = self._ui_to_logical.get(ui_val, ui_val)
-            user_inputs[var_name] = logical
-        
-        # Run expert system
-        try:
-            diagnoses, recommendations, confidence_scores = run_diagnosis(user_inputs)
-            
-            # Show results
+        # The live session already tracks every answer: read its results
+        if self.session is not None:
+            for var_name in user_inputs:
+                self.on_answer_changed(var_name, refresh=False)
+            diagnoses, recommendations, confidence_scores = self.session.results()
             self.show_results(diagnoses, recommendations, confidence_scores)
-            
+            return
+
+        # Otherwise run expert system on a worker thread so the window stays responsive
+        self._analysis_ticket += 1
+        self._analysis_running = True
+        self.set_analysis_busy(True)
+        worker = threading.Thread(target=self._analysis_worker,
+                                  args=(self._analysis_ticket, user_inputs), daemon=True)
+        worker.start()
+        self.root.after(50, self._poll_analysis)
+
+    def _analysis_worker(self, ticket, user_inputs):
+        """Runs on the worker thread; never touches Tk"""
+        try:
+            self._analysis_results.put((ticket, load_engine().run_diagnosis(user_inputs), None))
         except Exception as e:
-            messagebox.showerror("Error", f"An error occurred during analysis:\n{str(e)}")
+            self._analysis_results.put((ticket, None, e))
+
+    def _poll_analysis(self):
+        """Check for a finished analysis from the Tk event loop"""
+        while True:
+            try:
+                ticket, result, error = self._analysis_results.get_nowait()
+            except queue.Empty:
+                if self._analysis_running:
+                    self.root.after(50, self._poll_analysis)
+                return
+            # Results of cancelled analyses are dropped
+            if ticket == self._analysis_ticket:
+                break
+
+        self._analysis_running = False
+        self.set_analysis_busy(False)
+        if error is not None:
+            messagebox.showerror("Error", f"An error occurred during analysis:\n{str(error)}")
+            return
+
+        # Show results
+        diagnoses, recommendations, confidence_scores = result
+        self.show_results(diagnoses, recommendations, confidence_scores)
+
+    def cancel_analysis(self):
+        """Abandon the running analysis; its result will be ignored"""
+        if not self._analysis_running:
+            return
+        self._analysis_ticket += 1
+        self._analysis_running = False
+        self.set_analysis_busy(False)
+
+    def set_analysis_busy(self, busy):
+        """Show or hide the progress indicator and lock navigation while analyzing"""
+        if busy:
+            self.analysis_frame.pack(side='left', padx=10)
+            self.analysis_progress.start(12)
+            self.next_btn.config(state=tk.DISABLED)
+            self.prev_btn.config(state=tk.DISABLED)
+        else:
+            self.analysis_progress.stop()
+            self.analysis_frame.pack_forget()
+            self.next_btn.config(state=tk.NORMAL)
+            self.update_navigation()
     
     def show_results(self, diagnoses, recommendations, confidence_scores):
         """Display analysis results in a new window"""
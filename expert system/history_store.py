@@ -0,0 +1,440 @@
+"""
+SQLite history of questionnaires and their diagnoses.
+
+Each diagnosis is saved with the user it belongs to and the time it was
+made, in the compact forms used elsewhere: the answers as one byte per
+question (input_schema codes), the result as its diagnosis bitmask and the
+bytes of the rules that fired (compact_results). A row takes a few dozen
+bytes and decodes back to exactly the original inputs and result.
+
+    records   id, user, taken (Unix seconds), week, answers, mask, firings
+    users     id, name
+    weekly    (label, week) -> count; label -1 counts all records
+
+The store runs in WAL mode, so readers never block the writer. Rows are
+buffered and written in one transaction per batch, and each batch adds its
+per-week diagnosis counts to the weekly table. The two trend queries
+therefore stay index lookups at tens of millions of rows: a user's history
+is a range of the (user, taken) index, and weekly prevalence reads one
+weekly row per week.
+
+    with open_history('history.db') as history:
+        history.add('u1', answers, run_diagnosis(answers))
+        history.history('u1')                         # [HistoryEntry(...), ...]
+        history.weekly_prevalence('Circadian Rhythm Disruption')
+
+A store accepts one writer at a time. Weeks start on Monday (UTC).
+
+    python history_store.py history.db add answers.jsonl --user-field user --time-field date
+    python history_store.py history.db history u1
+    python history_store.py history.db prevalence "Possible Sleep Apnea (Moderate Risk)"
+"""
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from collections import Counter, deque, namedtuple
+from datetime import date, datetime, timedelta, timezone
+
+from compact_results import CompactResult, get_default_catalogue
+from input_schema import get_default_schema
+
+
+SCHEMA_VERSION = 1
+DEFAULT_BATCH_SIZE = 10000
+
+SECONDS_PER_DAY = 86400
+
+# Day 0 (1970-01-01) is a Thursday; shifting by three days starts weeks on Monday
+_WEEK_SHIFT = 3
+_EPOCH = date(1970, 1, 1)
+
+# weekly label counting every record, for prevalence denominators
+ALL_RECORDS = -1
+
+HistoryEntry = namedtuple('HistoryEntry', 'taken inputs result')
+WeeklyPrevalence = namedtuple('WeeklyPrevalence', 'week count total prevalence')
+
+_TABLES = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    user INTEGER NOT NULL,
+    taken INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    answers BLOB NOT NULL,
+    mask INTEGER NOT NULL,
+    firings BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_user ON records (user, taken);
+CREATE TABLE IF NOT EXISTS weekly (
+    label INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (label, week)
+) WITHOUT ROWID;
+"""
+
+
+def timestamp(value=None):
+    """
+    Unix seconds of a time given as a number, datetime, date or ISO string
+
+    Naive times and dates are taken as UTC; None is now.
+    """
+    if value is None:
+        return int(time.time())
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"Expected an ISO date or time, got {value!r}") from None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    if isinstance(value, date):
+        return (value - _EPOCH).days * SECONDS_PER_DAY
+    raise ValueError(f"Expected a time, got {value!r}")
+
+
+def week_of(taken):
+    """Week number of a Unix time, counted in Monday-to-Sunday weeks"""
+    return (taken // SECONDS_PER_DAY + _WEEK_SHIFT) // 7
+
+
+def week_start(week):
+    """Date of the Monday starting a week number"""
+    return _EPOCH + timedelta(days=week * 7 - _WEEK_SHIFT)
+
+
+class HistoryStore:
+    """Diagnosis history of many users in one SQLite file
+
+    Args:
+        path: Database file, created if missing
+        batch_size: Buffered records written per transaction
+        schema: QuestionnaireSchema encoding the answers (defaults to the
+            questionnaire's)
+        catalogue: ResultCatalogue encoding the results (defaults to the
+            SleepQualityOptimizer rules)
+        strict: Raise SchemaError for answers outside the questionnaire
+            instead of storing them as unanswered
+
+    Raises:
+        ValueError: The file was written with a different questionnaire or
+            rule set
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE, schema=None, catalogue=None, strict=True):
+        self.path = path
+        self.batch_size = batch_size
+        self.schema = schema if schema is not None else get_default_schema()
+        self.catalogue = catalogue if catalogue is not None else get_default_catalogue()
+        self.strict = strict
+        self.connection = sqlite3.connect(path)
+        try:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            # WAL keeps the database consistent if the process dies; a power
+            # loss may only drop the last committed batches
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(_TABLES)
+            with self.connection:
+                self._check_meta()
+            self._users = dict(self.connection.execute('SELECT name, id FROM users'))
+            self._next_id = self.connection.execute('SELECT coalesce(max(id), 0) + 1 FROM records').fetchone()[0]
+        except BaseException:
+            self.connection.close()
+            raise
+        self._pending = []
+
+    def _check_meta(self):
+        """Record the encodings in a new file, or check them against an existing one"""
+        catalogue = self.catalogue
+        expected = {
+            'version': str(SCHEMA_VERSION),
+            'questions': json.dumps([[a, list(self.schema.values[a])] for a in self.schema.attributes]),
+            'rules': json.dumps({'labels': catalogue.labels,
+                                 'recommendations': catalogue.recommendations,
+                                 'rule_labels': catalogue.rule_labels,
+                                 'rule_recommendations': catalogue.rule_recommendations}),
+        }
+        stored = dict(self.connection.execute('SELECT key, value FROM meta'))
+        if not stored:
+            self.connection.executemany('INSERT INTO meta VALUES (?, ?)', expected.items())
+            return
+        if stored.get('version') != expected['version']:
+            raise ValueError(f"{self.path}: unsupported history version {stored.get('version')}")
+        for key in ('questions', 'rules'):
+            if stored.get(key) != expected[key]:
+                raise ValueError(f"{self.path}: written with different {key}; use a new history file")
+
+    # ==================== WRITING ====================
+
+    def _user_id(self, user):
+        user = str(user)
+        user_id = self._users.get(user)
+        if user_id is None:
+            cursor = self.connection.execute('INSERT INTO users (name) VALUES (?)', (user,))
+            user_id = self._users[user] = cursor.lastrowid
+        return user_id
+
+    def add(self, user, user_inputs, result, taken=None):
+        """
+        Buffer one diagnosis, writing the batch once it is full
+
+        Args:
+            user: User identifier
+            user_inputs: Dictionary of user responses
+            result: (diagnoses, recommendations, confidence_scores) of the
+                inputs, or a CompactResult
+            taken: Time of the diagnosis (see timestamp; defaults to now)
+
+        Raises:
+            SchemaError: strict is set and the inputs have answers outside
+                the questionnaire
+        """
+        answers = bytes(self.schema.encode(user_inputs, self.strict))
+        if isinstance(result, CompactResult):
+            mask, firings = result.mask, result.firings
+        else:
+            firings = self.catalogue.firings(result)
+            mask = self.catalogue.mask(firings)
+        self._pending.append((str(user), timestamp(taken), answers, mask, firings))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def extend(self, entries):
+        """Buffer (user, user_inputs, result, taken) tuples"""
+        for user, user_inputs, result, taken in entries:
+            self.add(user, user_inputs, result, taken)
+
+    def flush(self):
+        """
+        Write the buffered diagnoses and their weekly counts in one transaction
+
+        If the transaction fails, the buffered diagnoses are discarded.
+        """
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        rows = []
+        masks = Counter()
+        record_id = self._next_id
+        try:
+            with self.connection:
+                for user, taken, answers, mask, firings in pending:
+                    week = week_of(taken)
+                    rows.append((record_id, self._user_id(user), taken, week, answers, mask, firings))
+                    record_id += 1
+                    masks[week, mask] += 1
+                # Few distinct masks recur, so count labels per distinct mask
+                weekly = Counter()
+                for (week, mask), count in masks.items():
+                    weekly[ALL_RECORDS, week] += count
+                    while mask:
+                        low = mask & -mask
+                        weekly[low.bit_length() - 1, week] += count
+                        mask ^= low
+                self.connection.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                self.connection.executemany(
+                    'INSERT INTO weekly VALUES (?, ?, ?) '
+                    'ON CONFLICT (label, week) DO UPDATE SET count = count + excluded.count',
+                    [(label, week, count) for (label, week), count in weekly.items()])
+        except BaseException:
+            # Forget the users added by the rolled back transaction
+            self._users = dict(self.connection.execute('SELECT name, id FROM users'))
+            raise
+        self._next_id = record_id
+
+    # ==================== QUERIES ====================
+
+    def __len__(self):
+        """Number of stored diagnoses, including buffered ones"""
+        stored = self.connection.execute('SELECT coalesce(sum(count), 0) FROM weekly WHERE label = ?',
+                                         (ALL_RECORDS,)).fetchone()[0]
+        return stored + len(self._pending)
+
+    def users(self):
+        return list(self._users)
+
+    def history(self, user, since=None, until=None, limit=None):
+        """
+        Diagnoses of a user, oldest first
+
+        Args:
+            since, until: Only diagnoses taken in [since, until)
+            limit: Only the most recent ``limit`` diagnoses
+
+        Returns:
+            List of HistoryEntry(taken, inputs, result)
+        """
+        self.flush()
+        user_id = self._users.get(str(user))
+        if user_id is None:
+            return []
+        query = 'SELECT taken, answers, firings FROM records WHERE user = ? AND taken >= ? AND taken < ?'
+        params = [user_id,
+                  timestamp(since) if since is not None else -2 ** 63,
+                  timestamp(until) if until is not None else 2 ** 63 - 1]
+        if limit is not None:
+            query = f'SELECT * FROM ({query} ORDER BY taken DESC, id DESC LIMIT ?) ORDER BY taken'
+            params.append(limit)
+        else:
+            query += ' ORDER BY taken, id'
+        return [HistoryEntry(taken, self.schema.decode(answers), self.catalogue.to_tuple(firings))
+                for taken, answers, firings in self.connection.execute(query, params)]
+
+    def weekly_prevalence(self, diagnosis, since=None, until=None):
+        """
+        Share of each week's diagnoses carrying ``diagnosis``
+
+        Args:
+            diagnosis: Diagnosis label
+            since, until: Only weeks containing a time in [since, until)
+
+        Returns:
+            List of WeeklyPrevalence(week, count, total, prevalence), week
+            being the date of its Monday, for every week with records
+        """
+        try:
+            label = self.catalogue.labels.index(diagnosis)
+        except ValueError:
+            raise ValueError(f"Unknown diagnosis: {diagnosis!r}") from None
+        self.flush()
+        first = week_of(timestamp(since)) if since is not None else -2 ** 63
+        last = week_of(timestamp(until) - 1) if until is not None else 2 ** 63 - 1
+        rows = self.connection.execute(
+            'SELECT total.week, coalesce(found.count, 0), total.count '
+            'FROM weekly AS total LEFT JOIN weekly AS found ON found.label = ? AND found.week = total.week '
+            'WHERE total.label = ? AND total.week BETWEEN ? AND ? ORDER BY total.week',
+            (label, ALL_RECORDS, first, last))
+        return [WeeklyPrevalence(week_start(week), count, total, count / total) for week, count, total in rows]
+
+    # ==================== LIFETIME ====================
+
+    def close(self):
+        """Write any buffered diagnoses and close the file"""
+        if self.connection is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_history(path, **options):
+    """Open a HistoryStore, for use as a context manager"""
+    return HistoryStore(path, **options)
+
+
+# ==================== COMMAND LINE ====================
+
+def _add(history, args):
+    from pipeline import READERS, detect_format
+    from parallel_scoring import score_parallel
+
+    # Users and times are taken off each record as it is read and queued
+    # until its result comes back, so the input is streamed
+    metadata = deque()
+
+    def inputs(records):
+        for record in records:
+            record = dict(record)
+            metadata.append((record.pop(args.user_field, None), record.pop(args.time_field, None), record))
+            yield record
+
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8', newline='')
+    try:
+        records = inputs(READERS[args.format or detect_format(args.input)](source))
+        if args.workers:
+            results = score_parallel(records, args.workers)
+        elif args.fast:
+            from decision_table import run_diagnosis_fast
+            results = map(run_diagnosis_fast, records)
+        else:
+            from knowledge_expert import run_diagnosis_batch
+            results = run_diagnosis_batch(records)
+        added = 0
+        for added, result in enumerate(results, 1):
+            user, taken, record = metadata.popleft()
+            if user is None:
+                raise ValueError(f"Record {added}: no {args.user_field!r} field")
+            try:
+                history.add(user, record, result, taken)
+            except ValueError as e:
+                raise ValueError(f"Record {added}: {e}") from None
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    history.flush()
+    print(f"{added} diagnoses added, {len(history)} stored", file=sys.stderr)
+
+
+def _history(history, args):
+    for entry in history.history(args.user, args.since, args.until, args.limit):
+        diagnoses, recommendations, confidence_scores = entry.result
+        taken = datetime.fromtimestamp(entry.taken, timezone.utc).isoformat()
+        output = {'taken': taken, 'inputs': entry.inputs, 'diagnoses': diagnoses,
+                  'recommendations': [list(r) for r in recommendations],
+                  'confidence_scores': confidence_scores}
+        sys.stdout.write(json.dumps(output, ensure_ascii=False) + '\n')
+
+
+def _prevalence(history, args):
+    for week in history.weekly_prevalence(args.diagnosis, args.since, args.until):
+        sys.stdout.write(json.dumps({'week': week.week.isoformat(), 'count': week.count,
+                                     'total': week.total, 'prevalence': week.prevalence}) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Diagnosis history of sleep questionnaires")
+    parser.add_argument('database', help="SQLite history file")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help="diagnose questionnaires and add them to the history")
+    add.add_argument('input', help="CSV or JSONL file ('-' for stdin)")
+    add.add_argument('--format', choices=('jsonl', 'csv'))
+    add.add_argument('--user-field', default='user')
+    add.add_argument('--time-field', default='taken', help="field with the ISO date or Unix time (default: now)")
+    add.add_argument('--workers', type=int, default=0, help="worker processes (0 = score in this process)")
+    add.add_argument('--fast', action='store_true', help="use the precomputed decision table instead of the engine")
+    add.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    add.set_defaults(run=_add)
+
+    history = commands.add_parser('history', help="JSONL diagnoses of one user, oldest first")
+    history.add_argument('user')
+    history.add_argument('--limit', type=int)
+    history.set_defaults(run=_history)
+
+    prevalence = commands.add_parser('prevalence', help="JSONL weekly prevalence of a diagnosis")
+    prevalence.add_argument('diagnosis')
+    prevalence.set_defaults(run=_prevalence)
+
+    for command in (history, prevalence):
+        command.add_argument('--since', help="ISO date or time")
+        command.add_argument('--until', help="ISO date or time (exclusive)")
+    args = parser.parse_args(argv)
+
+    try:
+        with open_history(args.database, batch_size=getattr(args, 'batch_size', DEFAULT_BATCH_SIZE)) as store:
+            args.run(store, args)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+Enum-coded input schema generated from the questionnaire.
+
+Attributes are numbered in question order and the distinct logical values
+of each attribute in option order, starting at 1; 0 stands for an
+unanswered question. An encoded questionnaire is a tuple with one code per
+attribute, in question order, so equal answers give equal tuples whatever
+the order of the input dictionary:
+
+    schema = get_default_schema()
+    encoded = schema.encode({'snoring': 'loud', 'sleep_quality': 'poor'})
+    schema.decode(encoded)    # {'sleep_quality': 'poor', 'snoring': 'loud'}
+
+encode() validates while it encodes, in a single pass that allocates
+nothing but the tuple, and raises SchemaError naming every attribute and
+value outside the questionnaire. With strict=False they are encoded as
+unanswered instead, which is what the engine makes of them.
+
+The codes are the ones of the columnar store and, mapped through
+projection(), give the per-rule codes of the decision table, the vectorized
+evaluator and the diagnosis cache.
+"""
+import threading
+
+from questionnaire import QUESTIONS
+
+
+# Code of a value outside the questionnaire, only seen before validation
+_INVALID = -1
+
+
+class SchemaError(ValueError):
+    """Answers outside the questionnaire
+
+    Attributes:
+        unknown_attributes: attributes the questionnaire does not ask
+        unknown_values: attribute -> value not among its options
+    """
+
+    def __init__(self, unknown_attributes, unknown_values):
+        self.unknown_attributes = unknown_attributes
+        self.unknown_values = unknown_values
+        problems = [f"unknown attribute {attribute!r}" for attribute in unknown_attributes]
+        problems += [f"unknown value {value!r} for {attribute!r}"
+                     for attribute, value in unknown_values.items()]
+        super().__init__("; ".join(problems))
+
+
+class QuestionnaireSchema:
+    """Numbering of the questionnaire's attributes and values
+
+    Attributes:
+        attributes: attribute names, in question order
+        values: attribute -> its distinct logical values, code i standing
+            for values[i - 1]
+        index: attribute -> position in an encoded tuple
+        codes: attribute -> {value: code}
+    """
+
+    def __init__(self, questions=QUESTIONS):
+        self.attributes = tuple(attribute for _, attribute, _ in questions)
+        if len(set(self.attributes)) != len(self.attributes):
+            raise ValueError("An attribute is asked more than once")
+        self.values = {attribute: tuple(dict.fromkeys(value for _, value in options))
+                       for _, attribute, options in questions}
+        if any(len(values) > 255 for values in self.values.values()):
+            raise ValueError("At most 255 values per attribute fit in a one-byte code")
+        self.index = {attribute: i for i, attribute in enumerate(self.attributes)}
+        self.codes = {attribute: {value: code for code, value in enumerate(values, 1)}
+                      for attribute, values in self.values.items()}
+
+        # Per attribute, value -> code with None (unanswered) -> 0
+        self._tables = tuple({None: 0, **self.codes[attribute]} for attribute in self.attributes)
+        self._invalid = (_INVALID,) * len(self.attributes)
+
+    @classmethod
+    def from_values(cls, values):
+        """Schema numbering attribute -> values as given, e.g. from a columnar store header"""
+        return cls([(None, attribute, [(None, value) for value in options])
+                    for attribute, options in values.items()])
+
+    def __len__(self):
+        return len(self.attributes)
+
+    def encode(self, user_inputs, strict=True):
+        """
+        Encode a questionnaire as a tuple of codes in question order
+
+        Args:
+            user_inputs: Dictionary of user responses
+            strict: Raise SchemaError for answers outside the questionnaire
+                instead of encoding them as unanswered
+
+        Raises:
+            SchemaError: strict is set and an attribute or value is unknown
+        """
+        try:
+            encoded = tuple(map(dict.get, self._tables,
+                                map(user_inputs.get, self.attributes), self._invalid))
+        except TypeError:
+            # An unhashable value; certainly not an option
+            encoded = self._invalid
+        # Every answer of a valid questionnaire has a non-zero code
+        if _INVALID not in encoded and len(user_inputs) == len(encoded) - encoded.count(0):
+            return encoded
+        return self._encode_checked(user_inputs, strict)
+
+    def _encode_checked(self, user_inputs, strict):
+        unknown_attributes = []
+        unknown_values = {}
+        for attribute, value in user_inputs.items():
+            codes = self.codes.get(attribute)
+            if codes is None:
+                unknown_attributes.append(attribute)
+            elif value is not None:
+                try:
+                    known = value in codes
+                except TypeError:
+                    known = False
+                if not known:
+                    unknown_values[attribute] = value
+        if strict and (unknown_attributes or unknown_values):
+            raise SchemaError(unknown_attributes, unknown_values)
+        return tuple(0 if attribute in unknown_values else self.codes[attribute].get(user_inputs.get(attribute), 0)
+                     for attribute in self.attributes)
+
+    def validate(self, user_inputs):
+        """
+        Check a questionnaire against the schema
+
+        Returns:
+            The SchemaError describing its unknown answers, or None
+        """
+        try:
+            self.encode(user_inputs)
+        except SchemaError as e:
+            return e
+        return None
+
+    def decode(self, encoded):
+        """Answers of an encoded questionnaire, in question order"""
+        return {attribute: self.values[attribute][code - 1]
+                for attribute, code in zip(self.attributes, encoded) if code}
+
+    def projection(self, codes):
+        """
+        Lookup tables from schema codes to another encoding
+
+        Args:
+            codes: attribute -> {value: code}, like DecisionTable.codes
+
+        Returns:
+            Tuple with, per schema attribute, a tuple whose item i is the
+            code in ``codes`` of the value with schema code i (0 when the
+            attribute or value is not in ``codes``)
+        """
+        luts = []
+        for attribute in self.attributes:
+            target = codes.get(attribute, {})
+            luts.append((0,) + tuple(target.get(value, 0) for value in self.values[attribute]))
+        return tuple(luts)
+
+    def missing(self, attributes):
+        """Attributes among ``attributes`` the schema does not encode"""
+        return [attribute for attribute in attributes if attribute not in self.index]
+
+
+_default_schema = None
+_default_schema_lock = threading.Lock()
+
+
+def get_default_schema():
+    """Return the schema of questionnaire.QUESTIONS, building it on first use"""
+    global _default_schema
+    with _default_schema_lock:
+        if _default_schema is None:
+            _default_schema = QuestionnaireSchema()
+        return _default_schema
+
+
+def encode(user_inputs, strict=True):
+    """Encode a questionnaire with the default schema"""
+    return get_default_schema().encode(user_inputs, strict)
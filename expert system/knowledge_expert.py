@@ -1,253 +1,281 @@
+import os
+import threading
+from contextlib import contextmanager
+
 from experta import *
 
+from profiling import ProfilingDepthStrategy, profiled_run
+from rule_compiler import compile_engine_class, load_rules
+
+
+# Rules of the expert system; see rule_compiler for the format
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules.json')
+
 class SleepFact(Fact):
     """Fact to store sleep-related information"""
     pass
 
-class SleepQualityOptimizer(KnowledgeEngine):
-    """Expert system for diagnosing sleep issues and providing recommendations"""
+class SleepEngine(KnowledgeEngine):
+    """Base of the sleep expert system engines: result lists and optional profiling
+
+    The rules are not written here but compiled from a rule file into a
+    subclass, see load_engine_class.
+    """
     
-    def __init__(self):
+    def __init__(self, profiler=None):
         super().__init__()
         self.diagnoses = []
         self.recommendations = []
         self.confidence_scores = {}
+        self.profiler = profiler
+        if profiler is not None:
+            self._enable_profiling(profiler)
+    
+    def _enable_profiling(self, profiler):
+        """Route agenda updates, declare, reset and run through a RuleProfiler"""
+        self.strategy = ProfilingDepthStrategy(profiler)
+        profiler.register_rules(rule.__name__ for rule in self.get_rules())
+        declare, reset = self.declare, self.reset
+
+        def profiled_declare(*facts):
+            with profiler.phase('declare'):
+                return declare(*facts)
+
+        def profiled_reset(**kwargs):
+            with profiler.phase('reset'):
+                return reset(**kwargs)
+
+        def run(steps=float('inf')):
+            with profiler.phase('run'):
+                return profiled_run(self, profiler, steps)
+
+        # Instance attributes, so unprofiled engines keep the plain methods
+        self.declare = profiled_declare
+        self.reset = profiled_reset
+        self.run = run
     
     def reset_results(self):
         """Reset diagnoses and recommendations"""
         self.diagnoses = []
         self.recommendations = []
         self.confidence_scores = {}
-    
-    # ==================== SLEEP APNEA RULES ====================
-    
-    @Rule(SleepFact(snoring='loud'),
-          SleepFact(breathing_pauses='yes'),
-          SleepFact(daytime_sleepiness='high'))
-    def sleep_apnea_severe(self):
-        diagnosis = "Possible Sleep Apnea (High Risk)"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.85
-        self.recommendations.append(("URGENT: Consult a sleep specialist immediately", "high"))
-        self.recommendations.append(("Sleep apnea can be serious and requires medical evaluation", "high"))
-    
-    @Rule(SleepFact(snoring='loud'),
-          OR(SleepFact(breathing_pauses='yes'),
-             SleepFact(daytime_sleepiness='high')))
-    def sleep_apnea_moderate(self):
-        diagnosis = "Possible Sleep Apnea (Moderate Risk)"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.65
-        self.recommendations.append(("Consider consulting a sleep specialist", "medium"))
-        self.recommendations.append(("Monitor symptoms and keep a sleep diary", "medium"))
-    
-    # ==================== INSOMNIA RULES ====================
-    
-    @Rule(SleepFact(sleep_onset='long'),
-          SleepFact(caffeine_timing='late'))
-    def caffeine_insomnia(self):
-        diagnosis = "Caffeine-Related Onset Insomnia"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.75
-        self.recommendations.append(("Avoid caffeine after 2 PM", "high"))
-        self.recommendations.append(("Switch to decaf or herbal tea in afternoon/evening", "medium"))
-    
-    @Rule(SleepFact(sleep_onset='long'),
-          SleepFact(screen_time='high'))
-    def screen_insomnia(self):
-        diagnosis = "Blue Light-Related Onset Insomnia"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.70
-        self.recommendations.append(("Limit screen time 1-2 hours before bed", "high"))
-        self.recommendations.append(("Use blue light filters or night mode on devices", "medium"))
-        self.recommendations.append(("Try reading a physical book instead", "low"))
-    
-    @Rule(SleepFact(night_awakenings='frequent'),
-          SleepFact(racing_thoughts='yes'),
-          SleepFact(stress_level='high'))
-    def stress_insomnia(self):
-        diagnosis = "Stress-Related Maintenance Insomnia"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.80
-        self.recommendations.append(("Practice relaxation techniques (deep breathing, meditation)", "high"))
-        self.recommendations.append(("Consider cognitive behavioral therapy for insomnia (CBT-I)", "high"))
-        self.recommendations.append(("Keep a worry journal - write down concerns before bed", "medium"))
-        self.recommendations.append(("Try progressive muscle relaxation", "low"))
-    
-    @Rule(SleepFact(night_awakenings='frequent'),
-          SleepFact(alcohol_consumption='yes'))
-    def alcohol_disruption(self):
-        diagnosis = "Alcohol-Disrupted Sleep"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.75
-        self.recommendations.append(("Avoid alcohol 3-4 hours before bedtime", "high"))
-        self.recommendations.append(("Alcohol disrupts REM sleep and causes frequent awakenings", "medium"))
-    
-    # ==================== CIRCADIAN RHYTHM RULES ====================
-    
-    @Rule(SleepFact(schedule_consistency='poor'),
-          OR(SleepFact(shift_work='yes'),
-             SleepFact(irregular_bedtime='yes')))
-    def circadian_disruption(self):
-        diagnosis = "Circadian Rhythm Disruption"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.70
-        self.recommendations.append(("Establish consistent sleep/wake times (even on weekends)", "high"))
-        self.recommendations.append(("Get bright light exposure in the morning", "high"))
-        self.recommendations.append(("Avoid bright light 2-3 hours before bed", "medium"))
-        self.recommendations.append(("Consider light therapy if working shifts", "medium"))
-    
-    # ==================== RESTLESS LEG SYNDROME ====================
-    
-    @Rule(SleepFact(leg_discomfort='yes'),
-          SleepFact(urge_to_move='yes'))
-    def restless_leg_syndrome(self):
-        diagnosis = "Possible Restless Leg Syndrome"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.80
-        self.recommendations.append(("Consult a physician for proper diagnosis", "high"))
-        self.recommendations.append(("Check iron and magnesium levels", "high"))
-        self.recommendations.append(("Try leg massages or stretching before bed", "medium"))
-        self.recommendations.append(("Avoid caffeine which can worsen symptoms", "medium"))
-    
-    # ==================== ENVIRONMENTAL RULES ====================
-    
-    @Rule(OR(SleepFact(room_temp='too_hot'),
-             SleepFact(room_temp='too_cold')))
-    def temperature_issue(self):
-        diagnosis = "Environmental Temperature Issue"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.65
-        self.recommendations.append(("Keep bedroom temperature between 60-67°F (15-19°C)", "high"))
-        self.recommendations.append(("Use breathable bedding materials", "medium"))
-        self.recommendations.append(("Consider a fan or adjust heating/cooling", "medium"))
-    
-    @Rule(SleepFact(bedroom_light='bright'))
-    def light_pollution(self):
-        diagnosis = "Light Pollution Affecting Sleep"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.70
-        self.recommendations.append(("Use blackout curtains or eye mask", "high"))
-        self.recommendations.append(("Remove or cover LED lights from devices", "medium"))
-        self.recommendations.append(("Use dim red lights if nightlight needed", "low"))
-    
-    @Rule(SleepFact(bedroom_noise='high'))
-    def noise_disruption(self):
-        diagnosis = "Noise-Related Sleep Disruption"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.65
-        self.recommendations.append(("Use white noise machine or fan", "high"))
-        self.recommendations.append(("Try earplugs designed for sleeping", "medium"))
-        self.recommendations.append(("Address noise sources if possible", "medium"))
-    
-    # ==================== POOR SLEEP HYGIENE ====================
-    
-    @Rule(SleepFact(sleep_onset='long'),
-          SleepFact(bedroom_activities='multiple'))
-    def poor_sleep_hygiene(self):
-        diagnosis = "Poor Sleep Hygiene - Bedroom Association"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.70
-        self.recommendations.append(("Use bedroom only for sleep and intimacy", "high"))
-        self.recommendations.append(("Remove TV, work materials from bedroom", "high"))
-        self.recommendations.append(("If can't sleep after 20 min, leave bedroom until sleepy", "medium"))
-    
-    @Rule(SleepFact(exercise_timing='late'))
-    def late_exercise(self):
-        diagnosis = "Exercise-Related Sleep Disruption"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.60
-        self.recommendations.append(("Avoid vigorous exercise 3-4 hours before bed", "high"))
-        self.recommendations.append(("Try morning or afternoon exercise instead", "medium"))
-        self.recommendations.append(("Gentle stretching or yoga in evening is okay", "low"))
-    
-    @Rule(SleepFact(meal_timing='late'))
-    def late_meals(self):
-        diagnosis = "Meal Timing Affecting Sleep"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.60
-        self.recommendations.append(("Avoid large meals 2-3 hours before bed", "high"))
-        self.recommendations.append(("If hungry, try light snack (banana, milk)", "medium"))
-        self.recommendations.append(("Avoid spicy or acidic foods in evening", "medium"))
-    
-    @Rule(SleepFact(napping='excessive'))
-    def excessive_napping(self):
-        diagnosis = "Excessive Daytime Napping"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.65
-        self.recommendations.append(("Limit naps to 20-30 minutes", "high"))
-        self.recommendations.append(("Avoid napping after 3 PM", "high"))
-        self.recommendations.append(("If very sleepy, investigate underlying causes", "medium"))
-    
-    # ==================== GENERAL SLEEP DEPRIVATION ====================
-    
-    @Rule(SleepFact(sleep_duration='insufficient'),
-          SleepFact(daytime_sleepiness='high'))
-    def sleep_deprivation(self):
-        diagnosis = "Chronic Sleep Deprivation"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.80
-        self.recommendations.append(("Prioritize 7-9 hours of sleep per night", "high"))
-        self.recommendations.append(("Gradually adjust bedtime earlier by 15 min increments", "high"))
-        self.recommendations.append(("Evaluate and reduce time-wasting activities", "medium"))
-    
-    # ==================== ANXIETY/MENTAL HEALTH ====================
-    
-    @Rule(SleepFact(anxiety='high'),
-          OR(SleepFact(sleep_onset='long'),
-             SleepFact(night_awakenings='frequent')))
-    def anxiety_sleep_issues(self):
-        diagnosis = "Anxiety-Related Sleep Disturbance"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.75
-        self.recommendations.append(("Consider therapy or counseling for anxiety", "high"))
-        self.recommendations.append(("Practice mindfulness meditation", "high"))
-        self.recommendations.append(("Try 4-7-8 breathing technique", "medium"))
-        self.recommendations.append(("Avoid checking clock during night", "medium"))
-    
-    # ==================== POSITIVE SLEEP PATTERNS ====================
-    
-    @Rule(SleepFact(sleep_quality='good'),
-          SleepFact(sleep_duration='adequate'),
-          SleepFact(daytime_sleepiness='low'))
-    def healthy_sleep(self):
-        diagnosis = "Healthy Sleep Pattern"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.90
-        self.recommendations.append(("Your sleep appears healthy - maintain current habits!", "low"))
-        self.recommendations.append(("Continue consistent sleep schedule", "low"))
-    
-    # ==================== NO CLEAR DIAGNOSIS ====================
-    
-    @Rule(AND(~SleepFact(sleep_quality='good'),
-              ~SleepFact(sleep_quality='poor')))
-    def insufficient_information(self):
-        diagnosis = "Insufficient Information"
-        self.diagnoses.append(diagnosis)
-        self.confidence_scores[diagnosis] = 0.50
-        self.recommendations.append(("Keep a detailed sleep diary for 2 weeks", "high"))
-        self.recommendations.append(("Track bedtime, wake time, and sleep quality", "high"))
-        self.recommendations.append(("Note factors like caffeine, exercise, stress", "medium"))
-
-def run_diagnosis(user_inputs):
+
+
+def build_engine_class(definitions, digest=None):
+    """Compile RuleDefinitions into a SleepEngine subclass"""
+    engine_class = compile_engine_class(
+        definitions, SleepEngine, SleepFact, 'SleepQualityOptimizer',
+        doc="Expert system for diagnosing sleep issues and providing recommendations")
+    engine_class.rule_definitions = definitions
+    engine_class.rules_digest = digest
+    engine_class.rules_file = None
+    return engine_class
+
+
+def load_engine_class(path=RULES_FILE):
+    """Compile the rule file at ``path`` into a SleepEngine subclass"""
+    definitions, digest = load_rules(path)
+    engine_class = build_engine_class(definitions, digest)
+    engine_class.rules_file = os.path.abspath(path)
+    return engine_class
+
+
+SleepQualityOptimizer = load_engine_class()
+
+
+# ==================== ENGINE POOL ====================
+
+DEFAULT_POOL_SIZE = 4
+
+
+class EnginePool:
+    """Thread-safe pool of pre-built SleepQualityOptimizer engines
+
+    Building an engine compiles the Rete network for every rule, which costs
+    more than a diagnosis itself. The pool keeps up to ``size`` engines alive
+    and hands them out one caller at a time; each checkout resets the engine
+    so no facts or results leak between diagnoses.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, engine_class=SleepQualityOptimizer):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.size = size
+        self.engine_class = engine_class
+        self._idle = []
+        self._created = 0
+        self._available = threading.Condition(threading.Lock())
+
+    def warm_up(self, count=None):
+        """Build ``count`` engines (default: all) up front instead of on first demand"""
+        if count is None:
+            count = self.size
+        engines = [self.checkout() for _ in range(min(count, self.size))]
+        for engine in engines:
+            self.checkin(engine)
+
+    def checkout(self, timeout=None):
+        """Take an engine out of the pool, building one if the pool is not full
+
+        Blocks until an engine is returned when all ``size`` engines are busy.
+        """
+        with self._available:
+            while not self._idle and self._created >= self.size:
+                if not self._available.wait(timeout):
+                    raise TimeoutError("No engine available in the pool")
+            if self._idle:
+                engine = self._idle.pop()
+            else:
+                engine = None
+                self._created += 1
+
+        if engine is None:
+            try:
+                engine = self.engine_class()
+            except BaseException:
+                with self._available:
+                    self._created -= 1
+                    self._available.notify()
+                raise
+
+        engine.reset()
+        engine.reset_results()
+        return engine
+
+    def checkin(self, engine):
+        """Return an engine obtained from checkout() to the pool"""
+        with self._available:
+            self._idle.append(engine)
+            self._available.notify()
+
+    @contextmanager
+    def engine(self, timeout=None):
+        """Context manager wrapping checkout()/checkin()"""
+        engine = self.checkout(timeout)
+        try:
+            yield engine
+        finally:
+            self.checkin(engine)
+
+
+_default_pool = EnginePool()
+
+
+def get_default_pool():
+    """Return the pool used by run_diagnosis when none is given"""
+    return _default_pool
+
+
+def configure_default_pool(size=DEFAULT_POOL_SIZE):
+    """Replace the shared pool with a new one holding ``size`` engines"""
+    global _default_pool
+    _default_pool = EnginePool(size)
+    return _default_pool
+
+
+def run_diagnosis(user_inputs, pool=None):
     """
     Run the expert system with user inputs
     
     Args:
         user_inputs: Dictionary of user responses
+        pool: EnginePool to borrow an engine from (defaults to the shared pool)
     
     Returns:
         Tuple of (diagnoses, recommendations, confidence_scores)
     """
-    engine = SleepQualityOptimizer()
-    engine.reset()
-    engine.reset_results()
+    if pool is None:
+        pool = _default_pool
+
+    with pool.engine() as engine:
+        return _diagnose(engine, user_inputs)
+
+
+def run_diagnosis_batch(inputs, pool=None):
+    """
+    Run the expert system over many sets of user inputs
+    
+    Inputs are consumed lazily, so memory use does not grow with the
+    number of records. The engine is borrowed per record and back in the
+    pool before each result is yielded, so a caller that stops early or
+    raises never leaves it checked out; the pool hands the same idle engine
+    back for the next record, already reset.
+    
+    Args:
+        inputs: Iterable of user response dictionaries
+        pool: EnginePool to borrow an engine from (defaults to the shared pool)
+    
+    Yields:
+        Tuple of (diagnoses, recommendations, confidence_scores) per record,
+        in input order
+    """
+    if pool is None:
+        pool = _default_pool
+
+    for user_inputs in inputs:
+        with pool.engine() as engine:
+            result = _diagnose(engine, user_inputs)
+        yield result
+
+
+class DiagnosisSession:
+    """Long-lived engine kept in step with answers as they are given
     
-    # Declare facts based on user inputs
-    for key, value in user_inputs.items():
-        engine.declare(SleepFact(**{key: value}))
+    Changing an answer retracts its old SleepFact and declares the new one,
+    so the agenda always holds exactly the activations of the current
+    answers and results are available without resetting the engine.
+    """
+
+    def __init__(self, engine=None):
+        self.engine = engine if engine is not None else SleepQualityOptimizer()
+        self.engine.reset()
+        self.engine.reset_results()
+        # attribute -> declared fact, in declaration order
+        self._facts = {}
+
+    def set_answer(self, attribute, value):
+        """Declare an answer, replacing any previous answer to the same question"""
+        fact = self._facts.get(attribute)
+        if fact is not None and fact[attribute] == value:
+            return
+        self.clear_answer(attribute)
+        self._facts[attribute] = self.engine.declare(SleepFact(**{attribute: value}))
+
+    def clear_answer(self, attribute):
+        """Retract the answer to a question, if any"""
+        fact = self._facts.pop(attribute, None)
+        if fact is not None:
+            self.engine.retract(fact)
+
+    def answers(self):
+        """Current answers, in the order their facts were declared"""
+        return {attribute: fact[attribute] for attribute, fact in self._facts.items()}
+
+    def results(self):
+        """
+        Diagnose the current answers
+        
+        The activations on the agenda are evaluated in the order run() would
+        fire them, without consuming them, so the session keeps tracking
+        further changes.
+        
+        Returns:
+            Tuple of (diagnoses, recommendations, confidence_scores)
+        """
+        engine = self.engine
+        engine.reset_results()
+        for activation in reversed(engine.agenda.activations):
+            activation.rule(engine, **{k: v for k, v in activation.context.items()
+                                       if not k.startswith('__')})
+        return engine.diagnoses, engine.recommendations, engine.confidence_scores
+
+
+def _diagnose(engine, user_inputs):
+    """Declare the inputs on a freshly reset engine and run it"""
+    # Declare all facts at once so the agenda is updated a single time
+    engine.declare(*[SleepFact(**{key: value}) for key, value in user_inputs.items()])
     
     # Run the inference engine
     engine.run()
     
-    return engine.diagnoses, engine.recommendations, engine.confidence_scores
\ No newline at end of file
+    return engine.diagnoses, engine.recommendations, engine.confidence_scores
@@ -0,0 +1,259 @@
+"""
+Multi-process scoring of large questionnaire sets.
+
+Inputs are cut into chunks and spread over a ProcessPoolExecutor whose
+workers each keep one long-lived SleepQualityOptimizer. Only a bounded
+number of chunks is in flight at any time, so memory stays flat however
+large the input is, and results are yielded back in input order.
+
+Command line use (one JSON questionnaire per line):
+
+    python parallel_scoring.py answers.jsonl --workers 8 --output results.jsonl
+    python parallel_scoring.py answers.jsonl --scaling
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from knowledge_expert import EnginePool, SleepQualityOptimizer, build_engine_class, run_diagnosis_batch
+
+
+DEFAULT_CHUNK_SIZE = 256
+
+# Engine pool of the current worker process, built by init_worker
+_worker_pool = None
+
+
+def init_worker(definitions=None, digest=None):
+    """ProcessPoolExecutor initializer building the worker's long-lived engine
+
+    Args:
+        definitions: RuleDefinitions to compile instead of the default rules
+        digest: Digest of the rule file the definitions were read from
+    """
+    global _worker_pool
+    engine_class = SleepQualityOptimizer if definitions is None else build_engine_class(definitions, digest)
+    _worker_pool = EnginePool(size=1, engine_class=engine_class)
+    _worker_pool.warm_up()
+
+
+# Seconds a started worker waits for the others before startup is abandoned
+WORKER_START_TIMEOUT = 300
+
+
+def _init_warm_worker(ready, definitions=None, digest=None):
+    """Build the worker's engine, then wait until every worker has built its own
+
+    No worker is idle before all of them are running, so each task
+    submitted by start_warm_executor starts a process of its own.
+    """
+    init_worker(definitions, digest)
+    ready.wait()
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+def start_warm_executor(workers, definitions=None, digest=None, mp_context=None):
+    """
+    ProcessPoolExecutor with every worker started and its engine built
+
+    Args:
+        workers: Number of worker processes
+        definitions, digest: Rules to compile instead of the default rules
+            (see init_worker)
+        mp_context: multiprocessing context to start the workers with
+            (defaults to the platform's default start method)
+    """
+    if mp_context is None:
+        mp_context = multiprocessing.get_context()
+    ready = mp_context.Barrier(workers, timeout=WORKER_START_TIMEOUT)
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                                   initializer=_init_warm_worker, initargs=(ready, definitions, digest))
+    try:
+        futures = [executor.submit(_worker_ready) for _ in range(workers)]
+        for future in futures:
+            future.result()
+    except BaseException:
+        executor.shutdown(wait=False)
+        raise
+    return executor
+
+
+def score_chunk(chunk):
+    """Diagnose a list of questionnaires with the worker's engine"""
+    return list(run_diagnosis_batch(chunk, pool=_worker_pool))
+
+
+def iter_chunks(inputs, chunk_size):
+    """Lists of up to ``chunk_size`` consecutive inputs, read lazily"""
+    iterator = iter(inputs)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ScoringStats:
+    """Throughput counters filled in by score_parallel"""
+
+    def __init__(self):
+        self.records = 0
+        self.chunks = 0
+        self.elapsed = 0.0
+
+    @property
+    def records_per_second(self):
+        return self.records / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return (f"ScoringStats(records={self.records}, chunks={self.chunks}, "
+                f"elapsed={self.elapsed:.3f}s, rate={self.records_per_second:.0f}/s)")
+
+
+def score_parallel(inputs, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, max_pending=None, stats=None):
+    """
+    Diagnose questionnaires across several worker processes
+
+    Args:
+        inputs: Iterable of user response dictionaries, consumed lazily
+        workers: Number of worker processes (defaults to the CPU count)
+        chunk_size: Number of questionnaires sent to a worker at once
+        max_pending: Maximum number of chunks in flight (defaults to twice
+            the number of workers); bounds memory use
+        stats: Optional ScoringStats updated as results are yielded
+
+    Yields:
+        Tuple of (diagnoses, recommendations, confidence_scores) per record,
+        in input order
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        for results in map_bounded(executor, score_chunk, iter_chunks(inputs, chunk_size), max_pending):
+            if stats is not None:
+                stats.records += len(results)
+                stats.chunks += 1
+                stats.elapsed = time.perf_counter() - started
+            yield from results
+
+
+def map_bounded(executor, function, items, max_pending):
+    """
+    Run ``function`` on each item in an executor, with bounded look-ahead
+
+    Items are consumed lazily and at most ``max_pending`` calls are
+    submitted but not yet yielded, so memory stays flat however many items
+    there are.
+
+    Yields:
+        The return value of each call, in item order
+    """
+    if max_pending < 1:
+        raise ValueError("max_pending must be at least 1")
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def result_record(result):
+    """Convert a run_diagnosis result into a JSON-serialisable dict"""
+    diagnoses, recommendations, confidence_scores = result
+    return {
+        'diagnoses': diagnoses,
+        'recommendations': [list(r) for r in recommendations],
+        'confidence_scores': confidence_scores,
+    }
+
+
+def measure_scaling(inputs, max_workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Score the same inputs with 1..max_workers processes and report throughput
+
+    Workers are started and their engines built before the clock starts,
+    so the rates compare scoring alone and not process startup.
+
+    Returns:
+        List of (workers, records per second, startup seconds)
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    inputs = list(inputs)
+    report = []
+    for workers in range(1, max_workers + 1):
+        started = time.perf_counter()
+        with start_warm_executor(workers) as executor:
+            startup = time.perf_counter() - started
+            started = time.perf_counter()
+            records = 0
+            for results in map_bounded(executor, score_chunk, iter_chunks(inputs, chunk_size), 2 * workers):
+                records += len(results)
+            elapsed = time.perf_counter() - started
+        report.append((workers, records / elapsed if elapsed else 0.0, startup))
+    return report
+
+
+def _read_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score questionnaires in parallel")
+    parser.add_argument('input', help="JSONL file of questionnaires ('-' for stdin)")
+    parser.add_argument('--output', default='-', help="JSONL output file ('-' for stdout)")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--max-pending', type=int, default=None)
+    parser.add_argument('--scaling', action='store_true',
+                        help="report throughput for 1..workers processes instead of scoring")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    try:
+        if args.scaling:
+            report = measure_scaling(_read_jsonl(source), args.workers, args.chunk_size)
+            base = report[0][1]
+            for workers, rate, startup in report:
+                print(f"{workers:3d} worker(s): {rate:10.0f} records/s  speedup {rate / base:5.2f}x"
+                      f"  (startup {startup:.2f}s)")
+            return 0
+
+        stats = ScoringStats()
+        sink = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+        try:
+            for result in score_parallel(_read_jsonl(source), args.workers, args.chunk_size,
+                                         args.max_pending, stats):
+                sink.write(json.dumps(result_record(result), ensure_ascii=False) + '\n')
+        finally:
+            if sink is not sys.stdout:
+                sink.close()
+        print(stats, file=sys.stderr)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Streaming command-line diagnosis pipeline.
+
+Reads questionnaires one at a time from a CSV or JSONL file (or stdin),
+diagnoses them and writes one JSON result per line as soon as it is ready,
+so memory does not grow with the input and the output can be piped into
+the next job while the input is still being read.
+
+    python pipeline.py answers.csv > results.jsonl
+    cat answers.jsonl | python pipeline.py - --format jsonl --id-field user_id
+    python pipeline.py answers.jsonl --workers 8 --output results.jsonl
+    python pipeline.py answers.csv --strict    # reject answers outside the questionnaire
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import deque
+
+from knowledge_expert import run_diagnosis_batch
+from parallel_scoring import DEFAULT_CHUNK_SIZE, result_record, score_parallel
+
+
+# ==================== READERS ====================
+
+def read_jsonl(stream):
+    """Yield one questionnaire dict per non-empty JSON line"""
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Line {number}: invalid JSON ({e})") from None
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {number}: expected a JSON object")
+        yield record
+
+
+def read_csv(stream):
+    """Yield one questionnaire dict per CSV row; empty cells count as unanswered"""
+    for row in csv.DictReader(stream):
+        yield {key: value for key, value in row.items() if key and value not in (None, '')}
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+def detect_format(path):
+    if path.lower().endswith('.csv'):
+        return 'csv'
+    return 'jsonl'
+
+
+# ==================== PIPELINE ====================
+
+def validated(records, id_field=None, schema=None):
+    """Pass records through, raising ValueError at the first one with answers outside the schema"""
+    from input_schema import SchemaError, get_default_schema
+
+    if schema is None:
+        schema = get_default_schema()
+    for number, record in enumerate(records, 1):
+        answers = record
+        if id_field is not None and id_field in record:
+            answers = {key: value for key, value in record.items() if key != id_field}
+        try:
+            schema.encode(answers)
+        except SchemaError as e:
+            raise ValueError(f"Record {number}: {e}") from None
+        yield record
+
+
+def diagnose_stream(records, id_field=None, workers=0, chunk_size=DEFAULT_CHUNK_SIZE, diagnose_batch=None):
+    """
+    Diagnose a stream of questionnaires lazily
+
+    Args:
+        records: Iterable of questionnaire dicts
+        id_field: Name of a field copied to the output instead of being
+            declared as an answer
+        workers: Number of worker processes; 0 scores in this process
+        chunk_size: Records per worker chunk when workers > 0
+        diagnose_batch: Function mapping an iterable of inputs to an
+            iterable of results (defaults to run_diagnosis_batch)
+
+    Yields:
+        Output record dicts, in input order
+    """
+    # Ids are queued as their records are consumed and released with the
+    # matching result, so only the records in flight are held in memory
+    ids = deque()
+
+    def inputs():
+        for record in records:
+            if id_field is not None:
+                record = dict(record)
+                ids.append(record.pop(id_field, None))
+            yield record
+
+    if workers:
+        results = score_parallel(inputs(), workers, chunk_size)
+    elif diagnose_batch is not None:
+        results = diagnose_batch(inputs())
+    else:
+        results = run_diagnosis_batch(inputs())
+
+    for result in results:
+        output = result_record(result)
+        if id_field is not None:
+            output = {id_field: ids.popleft(), **output}
+        yield output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream questionnaires through the sleep diagnosis engine")
+    parser.add_argument('input', nargs='?', default='-', help="CSV or JSONL file ('-' for stdin)")
+    parser.add_argument('--format', choices=sorted(READERS), help="input format (default: from file extension, jsonl for stdin)")
+    parser.add_argument('--output', default='-', help="JSONL output file ('-' for stdout)")
+    parser.add_argument('--id-field', help="field copied through to the output instead of diagnosed")
+    parser.add_argument('--workers', type=int, default=0, help="worker processes (0 = score in this process)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--fast', action='store_true', help="use the precomputed decision table instead of the engine")
+    parser.add_argument('--strict', action='store_true',
+                        help="stop at the first record with an attribute or value outside the questionnaire")
+    args = parser.parse_args(argv)
+
+    input_format = args.format or detect_format(args.input)
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8', newline='')
+    if args.output == '-':
+        sink = sys.stdout
+        # Emit every result as soon as it is written when piped
+        sink.reconfigure(line_buffering=True)
+    else:
+        sink = open(args.output, 'w', encoding='utf-8')
+
+    diagnose_batch = None
+    if args.fast:
+        from decision_table import run_diagnosis_fast
+        diagnose_batch = lambda inputs: map(run_diagnosis_fast, inputs)
+
+    try:
+        records = READERS[input_format](source)
+        if args.strict:
+            records = validated(records, args.id_field)
+        for output in diagnose_stream(records, args.id_field, args.workers, args.chunk_size, diagnose_batch):
+            sink.write(json.dumps(output, ensure_ascii=False) + '\n')
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        # Downstream consumer stopped reading (e.g. `| head`); not an error
+        # Point stdout at devnull so the interpreter's final flush is silent
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sink.fileno())
+        return 0
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,334 @@
+"""
+Streaming population analytics over diagnosis results.
+
+PopulationStats folds results one at a time into running totals: how many
+questionnaires carry each diagnosis, the sum of its confidences, how often
+each recommendation is made per priority and how often two diagnoses occur
+together. Memory grows with the number of distinct diagnoses, pairs and
+recommendations, never with the number of results, and two aggregates
+combine with merge(), so parallel workers can each fold a share of the
+results and send back a partial aggregate:
+
+    stats = PopulationStats()
+    stats.update(run_diagnosis_batch(inputs))
+    stats.merge(PopulationStats.from_dict(partial_from_a_worker))
+    stats.write_json(sys.stdout)
+
+Command line, on the output of pipeline.py or on questionnaires:
+
+    python population_stats.py results.jsonl --format csv
+    python population_stats.py answers.jsonl --kind questionnaires --workers 8
+    python population_stats.py answers.scol --kind store
+    python population_stats.py part1.json part2.json --kind state
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+from parallel_scoring import DEFAULT_CHUNK_SIZE, init_worker, iter_chunks, map_bounded, score_chunk
+
+
+STATE_VERSION = 1
+
+CSV_FIELDS = ('metric', 'subject', 'object', 'value')
+
+
+class PopulationStats:
+    """Mergeable running totals over diagnosis results
+
+    Attributes:
+        records: number of results folded in
+        counts: diagnosis -> number of results carrying it
+        confidence_sums: diagnosis -> sum of its confidence over those results
+        recommendations: priority -> {text: number of times recommended}
+        pairs: (diagnosis, diagnosis) in sorted order -> number of results
+            carrying both
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.counts = {}
+        self.confidence_sums = {}
+        self.recommendations = {}
+        self.pairs = {}
+
+    def add(self, result):
+        """Fold in one (diagnoses, recommendations, confidence_scores) result"""
+        diagnoses, recommendations, confidence_scores = result
+        self.records += 1
+        counts = self.counts
+        confidence_sums = self.confidence_sums
+        distinct = sorted(set(diagnoses))
+        for diagnosis in distinct:
+            counts[diagnosis] = counts.get(diagnosis, 0) + 1
+            confidence_sums[diagnosis] = (confidence_sums.get(diagnosis, 0.0)
+                                          + confidence_scores.get(diagnosis, 0.0))
+        pairs = self.pairs
+        for pair in combinations(distinct, 2):
+            pairs[pair] = pairs.get(pair, 0) + 1
+        for text, priority in recommendations:
+            texts = self.recommendations.get(priority)
+            if texts is None:
+                texts = self.recommendations[priority] = {}
+            texts[text] = texts.get(text, 0) + 1
+
+    def update(self, results):
+        """Fold in an iterable of results"""
+        for result in results:
+            self.add(result)
+        return self
+
+    def update_vectorized(self, result, specs):
+        """
+        Fold in a VectorizedResult without building per-row results
+
+        Args:
+            result: VectorizedResult, e.g. from ColumnStore.evaluate()
+            specs: RuleSpecs of the evaluator that produced it
+        """
+        import numpy as np
+
+        rows = len(result)
+        self.records += rows
+        if not rows:
+            return self
+        shifts = np.arange(len(result.labels), dtype=np.uint32)
+        present = ((result.bits[:, None] >> shifts) & np.uint32(1)).astype(np.int64)
+        together = present.T @ present
+        for i, label in enumerate(result.labels):
+            count = int(together[i, i])
+            if not count:
+                continue
+            self.counts[label] = self.counts.get(label, 0) + count
+            self.confidence_sums[label] = (self.confidence_sums.get(label, 0.0)
+                                           + count * float(result.confidence_values[i]))
+            for j in range(i + 1, len(result.labels)):
+                if together[i, j]:
+                    pair = tuple(sorted((label, result.labels[j])))
+                    self.pairs[pair] = self.pairs.get(pair, 0) + int(together[i, j])
+
+        # A rule makes its recommendations every time it fires
+        firings = result.counts.sum(axis=1, dtype=np.int64)
+        for spec, fired in zip(specs, firings):
+            if fired:
+                for text, priority in spec.recommendations:
+                    texts = self.recommendations.setdefault(priority, {})
+                    texts[text] = texts.get(text, 0) + int(fired)
+        return self
+
+    def merge(self, other):
+        """Add the totals of another PopulationStats to this one"""
+        self.records += other.records
+        for diagnosis, count in other.counts.items():
+            self.counts[diagnosis] = self.counts.get(diagnosis, 0) + count
+        for diagnosis, total in other.confidence_sums.items():
+            self.confidence_sums[diagnosis] = self.confidence_sums.get(diagnosis, 0.0) + total
+        for priority, texts in other.recommendations.items():
+            mine = self.recommendations.setdefault(priority, {})
+            for text, count in texts.items():
+                mine[text] = mine.get(text, 0) + count
+        for pair, count in other.pairs.items():
+            self.pairs[pair] = self.pairs.get(pair, 0) + count
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    # ==================== STATE ====================
+
+    def to_dict(self):
+        """Mergeable state as a JSON-serialisable dict"""
+        return {
+            'version': STATE_VERSION,
+            'records': self.records,
+            'counts': self.counts,
+            'confidence_sums': self.confidence_sums,
+            'recommendations': self.recommendations,
+            'pairs': [[a, b, count] for (a, b), count in self.pairs.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != STATE_VERSION:
+            raise ValueError(f"Unsupported aggregate state version {data.get('version')}")
+        stats = cls()
+        stats.records = data['records']
+        stats.counts = dict(data['counts'])
+        stats.confidence_sums = dict(data['confidence_sums'])
+        stats.recommendations = {priority: dict(texts)
+                                 for priority, texts in data['recommendations'].items()}
+        stats.pairs = {(a, b): count for a, b, count in data['pairs']}
+        return stats
+
+    # ==================== SUMMARY ====================
+
+    def co_occurrence(self):
+        """Symmetric matrix as {diagnosis: {diagnosis: count}}, counts on the diagonal"""
+        matrix = {diagnosis: {diagnosis: count} for diagnosis, count in self.counts.items()}
+        for (a, b), count in self.pairs.items():
+            matrix.setdefault(a, {})[b] = count
+            matrix.setdefault(b, {})[a] = count
+        return {diagnosis: dict(sorted(row.items())) for diagnosis, row in sorted(matrix.items())}
+
+    def summary(self):
+        """Prevalence, mean confidence, recommendation frequency and co-occurrence"""
+        records = self.records
+        diagnoses = {}
+        for diagnosis, count in sorted(self.counts.items(), key=lambda item: (-item[1], item[0])):
+            diagnoses[diagnosis] = {
+                'count': count,
+                'prevalence': count / records if records else 0.0,
+                'mean_confidence': self.confidence_sums[diagnosis] / count,
+            }
+        recommendations = {}
+        for priority, texts in self.recommendations.items():
+            total = sum(texts.values())
+            recommendations[priority] = {
+                'total': total,
+                'per_record': total / records if records else 0.0,
+                'counts': dict(sorted(texts.items(), key=lambda item: (-item[1], item[0]))),
+            }
+        return {
+            'records': records,
+            'diagnoses': diagnoses,
+            'recommendations': recommendations,
+            'co_occurrence': self.co_occurrence(),
+        }
+
+    def rows(self):
+        """Summary as (metric, subject, object, value) rows"""
+        summary = self.summary()
+        yield 'records', '', '', summary['records']
+        for diagnosis, values in summary['diagnoses'].items():
+            for metric in ('count', 'prevalence', 'mean_confidence'):
+                yield metric, diagnosis, '', values[metric]
+        for priority, values in summary['recommendations'].items():
+            yield 'recommendations', priority, '', values['total']
+            for text, count in values['counts'].items():
+                yield 'recommendation', priority, text, count
+        for diagnosis, others in summary['co_occurrence'].items():
+            for other, count in others.items():
+                yield 'co_occurrence', diagnosis, other, count
+
+    def write_json(self, stream):
+        json.dump(self.summary(), stream, ensure_ascii=False, indent=2)
+        stream.write('\n')
+
+    def write_csv(self, stream):
+        writer = csv.writer(stream)
+        writer.writerow(CSV_FIELDS)
+        writer.writerows(self.rows())
+
+
+# ==================== PARALLEL AGGREGATION ====================
+
+def aggregate_chunk(chunk):
+    """Diagnose a list of questionnaires in a worker and return their aggregate state"""
+    return PopulationStats().update(score_chunk(chunk)).to_dict()
+
+
+def aggregate_parallel(inputs, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, max_pending=None):
+    """
+    Diagnose and aggregate questionnaires across worker processes
+
+    Each worker folds its chunks into a partial aggregate, so only the
+    aggregates travel back, not the results.
+
+    Returns:
+        PopulationStats of all the inputs
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * workers
+    stats = PopulationStats()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        for state in map_bounded(executor, aggregate_chunk, iter_chunks(inputs, chunk_size), max_pending):
+            stats.merge(PopulationStats.from_dict(state))
+    return stats
+
+
+# ==================== COMMAND LINE ====================
+
+def _results(records):
+    """run_diagnosis results of pipeline.py output records"""
+    for record in records:
+        yield (record.get('diagnoses', []),
+               [tuple(r) for r in record.get('recommendations', [])],
+               record.get('confidence_scores', {}))
+
+
+def _aggregate_file(path, kind, workers, chunk_size):
+    if kind == 'state':
+        with open(path, encoding='utf-8') as f:
+            return PopulationStats.from_dict(json.load(f))
+    if kind == 'store':
+        from columnar_store import open_store
+        from vectorized import VectorizedEvaluator
+
+        evaluator = VectorizedEvaluator()
+        with open_store(path) as store:
+            return PopulationStats().update_vectorized(store.evaluate(evaluator), evaluator.specs)
+
+    from pipeline import READERS, detect_format
+
+    source = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+    try:
+        records = READERS[detect_format(path)](source)
+        if kind == 'results':
+            return PopulationStats().update(_results(records))
+        if workers:
+            return aggregate_parallel(records, workers, chunk_size)
+        from knowledge_expert import run_diagnosis_batch
+        return PopulationStats().update(run_diagnosis_batch(records))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Population statistics of sleep diagnoses")
+    parser.add_argument('inputs', nargs='+', help="input files ('-' for stdin); their aggregates are merged")
+    parser.add_argument('--kind', choices=('results', 'questionnaires', 'store', 'state'), default='results',
+                        help="pipeline.py results (default), questionnaires to diagnose, "
+                             "a columnar store, or aggregate state written with --state")
+    parser.add_argument('--format', choices=('json', 'csv'), default='json')
+    parser.add_argument('--output', default='-', help="summary file ('-' for stdout)")
+    parser.add_argument('--state', help="also write the mergeable aggregate state to this file")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="worker processes for --kind questionnaires (0 = this process)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    stats = PopulationStats()
+    try:
+        for path in args.inputs:
+            stats.merge(_aggregate_file(path, args.kind, args.workers, args.chunk_size))
+    except (OSError, ValueError, KeyError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    if args.state:
+        with open(args.state, 'w', encoding='utf-8') as f:
+            json.dump(stats.to_dict(), f, ensure_ascii=False)
+    sink = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+    try:
+        if args.format == 'csv':
+            stats.write_csv(sink)
+        else:
+            stats.write_json(sink)
+    except BrokenPipeError:
+        # Downstream consumer stopped reading; see pipeline.main
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sink.fileno())
+    finally:
+        if sink is not sys.stdout:
+            sink.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+Prolog knowledge base as an alternative diagnosis backend.
+
+Keeps a pool of long-lived ``swipl`` processes running the batch server of
+``sleep optimizer.pl`` and streams questionnaires to them as JSON lines
+over stdin/stdout, so the Prolog rules are loaded once per process rather
+than once per diagnosis:
+
+    pool = PrologPool(size=4)
+    diagnoses, recommendations, confidence_scores = run_diagnosis_prolog(user_inputs, pool)
+
+Results have the same shape as run_diagnosis. The Prolog rules report each
+diagnosis once, in rule order, where the engine may list a diagnosis whose
+rule matched on two alternatives twice.
+
+The swipl executable is looked up on PATH unless the SWIPL environment
+variable names it.
+"""
+import json
+import os
+import subprocess
+import threading
+
+from knowledge_expert import EnginePool
+
+
+KNOWLEDGE_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              os.pardir, 'Prolog knowledge base', 'sleep optimizer.pl')
+
+DEFAULT_POOL_SIZE = 4
+
+# Requests written ahead of their responses by diagnose_many; small enough
+# that the responses fit in the pipe buffer while requests are being sent
+DEFAULT_WINDOW = 16
+
+
+class PrologError(RuntimeError):
+    """The Prolog worker rejected a request or stopped responding"""
+
+
+class PrologWorker:
+    """One swipl process serving diagnoses over a line protocol
+
+    Args:
+        executable: swipl executable (defaults to $SWIPL or ``swipl``)
+        knowledge_base: Path of the Prolog knowledge base to load
+    """
+
+    def __init__(self, executable=None, knowledge_base=KNOWLEDGE_BASE):
+        self.executable = executable or os.environ.get('SWIPL', 'swipl')
+        self.knowledge_base = os.path.normpath(knowledge_base)
+        self.process = None
+        self.start()
+
+    def start(self):
+        """Start the swipl process and wait until it is ready for requests"""
+        self.process = subprocess.Popen(
+            [self.executable, '-q', '-g', 'batch_server', '-t', 'halt', self.knowledge_base],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, encoding='utf-8', bufsize=1)
+        # Loading the knowledge base prints a banner before the server starts
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                self.close()
+                raise PrologError(f"{self.executable} exited before the batch server started")
+            if line.strip() == '{"ready":true}':
+                return
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def reset(self):
+        """Restart the process if it died; the server keeps no state between requests"""
+        if not self.alive:
+            self.close()
+            self.start()
+
+    def reset_results(self):
+        pass
+
+    def diagnose(self, user_inputs):
+        """Diagnose one questionnaire"""
+        self._send(user_inputs)
+        return self._receive()
+
+    def diagnose_many(self, inputs, window=DEFAULT_WINDOW):
+        """Diagnose questionnaires in input order, keeping ``window`` requests in flight"""
+        pending = 0
+        try:
+            for user_inputs in inputs:
+                self._send(user_inputs)
+                pending += 1
+                if pending >= window:
+                    pending -= 1
+                    yield self._receive()
+            while pending:
+                pending -= 1
+                yield self._receive()
+        finally:
+            # Read the replies still owed to an abandoned or failed batch so
+            # the next request does not receive them
+            while pending and self.alive:
+                self.process.stdout.readline()
+                pending -= 1
+
+    def _send(self, user_inputs):
+        try:
+            self.process.stdin.write(json.dumps(user_inputs, ensure_ascii=False) + '\n')
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise PrologError(f"Prolog worker is not running: {e}") from e
+
+    def _receive(self):
+        line = self.process.stdout.readline()
+        if not line:
+            raise PrologError("Prolog worker exited unexpectedly")
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise PrologError(reply['error'])
+        diagnoses = [d['diagnosis'] for d in reply['diagnoses']]
+        recommendations = [tuple(r) for r in reply['recommendations']]
+        confidence_scores = {d['diagnosis']: d['confidence'] for d in reply['diagnoses']}
+        return diagnoses, recommendations, confidence_scores
+
+    def close(self, timeout=5):
+        """Stop the process, closing its input so the server halts cleanly"""
+        process, self.process = self.process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+            process.wait(timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+        finally:
+            process.stdout.close()
+
+
+class PrologPool(EnginePool):
+    """EnginePool of PrologWorker processes
+
+    A worker whose process died is restarted when it is next checked out.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, engine_class=PrologWorker):
+        super().__init__(size, engine_class)
+
+    def close(self):
+        """Stop the idle workers; workers checked out at the time are left running"""
+        with self._available:
+            workers, self._idle = self._idle, []
+            self._created -= len(workers)
+        for worker in workers:
+            worker.close()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool():
+    """Return the pool used by run_diagnosis_prolog, creating it on first use"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = PrologPool()
+        return _default_pool
+
+
+def run_diagnosis_prolog(user_inputs, pool=None):
+    """
+    Diagnose user inputs with the Prolog knowledge base
+
+    Args:
+        user_inputs: Dictionary of user responses
+        pool: PrologPool to borrow a worker from (defaults to a shared pool)
+
+    Returns:
+        Tuple of (diagnoses, recommendations, confidence_scores)
+    """
+    if pool is None:
+        pool = get_default_pool()
+
+    with pool.engine() as worker:
+        return worker.diagnose(user_inputs)
+
+
+def run_diagnosis_batch_prolog(inputs, pool=None, window=DEFAULT_WINDOW):
+    """
+    Diagnose many sets of user inputs with one Prolog worker
+
+    Requests are pipelined, up to ``window`` ahead of their results, and
+    inputs are consumed lazily.
+
+    Args:
+        inputs: Iterable of user response dictionaries
+        pool: PrologPool to borrow a worker from (defaults to a shared pool)
+        window: Maximum number of requests awaiting a result
+
+    Yields:
+        Tuple of (diagnoses, recommendations, confidence_scores) per record,
+        in input order
+    """
+    if pool is None:
+        pool = get_default_pool()
+
+    with pool.engine() as worker:
+        yield from worker.diagnose_many(inputs, window)
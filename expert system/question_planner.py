@@ -0,0 +1,150 @@
+"""
+Adaptive questionnaire: ask only the questions that can still change the outcome.
+
+An answer matters while some rule reading it could fire a different number
+of times depending on it, for some answers to the questions not asked yet.
+Once the earlier answers decide or rule out every rule reading an attribute,
+its question is skipped: urge_to_move, for instance, only matters to
+restless_leg_syndrome, and only while leg_discomfort could still be 'yes'.
+
+The planner works on the per-rule cells of a DecisionTable, so each check
+enumerates the values of a handful of attributes and never runs the engine:
+
+    planner = get_default_planner()
+    answers = {}
+    attribute = planner.next_question(answers)
+    while attribute is not None:
+        answers[attribute] = ask(attribute)
+        attribute = planner.next_question(answers)
+    run_diagnosis(answers)
+
+Skipping a question gives the same diagnoses and recommendations as any
+answer to it would. essential_answers() drops the answers of a complete
+questionnaire that made no difference, which shrinks what the engine is
+given without changing its result.
+"""
+from itertools import product
+
+from decision_table import get_default_table
+from questionnaire import ATTRIBUTES
+from rediagnosis import DependencyIndex
+
+
+class QuestionPlanner:
+    """Picks the next question that can still change the diagnosis
+
+    Args:
+        table: DecisionTable of the rules to plan for (defaults to the
+            compiled SleepQualityOptimizer rules)
+        attributes: Attributes in the order they are asked (defaults to
+            questionnaire order)
+    """
+
+    def __init__(self, table=None, attributes=ATTRIBUTES):
+        self.table = table if table is not None else get_default_table()
+        self.attributes = list(attributes)
+        self.index = DependencyIndex(self.table.specs)
+
+    def _code(self, attribute, answers):
+        return self.table.codes[attribute].get(answers[attribute], 0)
+
+    def _rule_depends(self, rule, attribute, answers):
+        """Whether the firings of a rule can depend on ``attribute``"""
+        attributes, strides, cells = self.table.rules[rule]
+        base = 0
+        free = []
+        for other, stride in zip(attributes, strides):
+            if other == attribute:
+                target = stride
+            elif other in answers:
+                base += self._code(other, answers) * stride
+            else:
+                free.append([stride * code for code in range(len(self.table.domains[other]) + 1)])
+
+        values = [target * code for code in range(len(self.table.domains[attribute]) + 1)]
+        for offsets in product(*free):
+            cell = base + sum(offsets)
+            firings = len(cells[cell + values[0]])
+            if any(len(cells[cell + value]) != firings for value in values[1:]):
+                return True
+        return False
+
+    def matters(self, attribute, answers):
+        """
+        Whether the answer to ``attribute`` can still change the outcome
+
+        Any answer already given to ``attribute`` itself is ignored, and
+        unanswered attributes may take any value.
+        """
+        if attribute not in self.table.codes:
+            return False
+        for rule in self.index.affected([attribute]):
+            if self._rule_depends(rule, attribute, answers):
+                return True
+        return False
+
+    def next_question(self, answers, start=0):
+        """
+        First unanswered attribute from position ``start`` on that still matters
+
+        Returns:
+            Attribute name, or None when the answers decide every rule
+        """
+        for attribute in self.attributes[start:]:
+            if attribute not in answers and self.matters(attribute, answers):
+                return attribute
+        return None
+
+    def remaining(self, answers):
+        """Unanswered attributes that still matter, in question order"""
+        return [attribute for attribute in self.attributes
+                if attribute not in answers and self.matters(attribute, answers)]
+
+    def essential_answers(self, answers):
+        """
+        The answers without those that make no difference to the result
+
+        Answers are dropped one at a time, each only if the remaining ones
+        fire every rule the same number of times without it.
+        """
+        table = self.table
+        kept = dict(answers)
+        for attribute in answers:
+            if attribute not in table.codes:
+                del kept[attribute]
+                continue
+            code = self._code(attribute, kept)
+            if not code:
+                del kept[attribute]
+                continue
+            for rule in self.index.affected([attribute]):
+                attributes, strides, cells = table.rules[rule]
+                cell = 0
+                for other, stride in zip(attributes, strides):
+                    if other != attribute and other in kept:
+                        cell += self._code(other, kept) * stride
+                    elif other == attribute:
+                        target = stride
+                if len(cells[cell]) != len(cells[cell + code * target]):
+                    break
+            else:
+                del kept[attribute]
+        return kept
+
+
+_default_planner = None
+
+
+def get_default_planner():
+    """Return the planner of the default decision table, building it on first use"""
+    global _default_planner
+    if _default_planner is None:
+        _default_planner = QuestionPlanner()
+    return _default_planner
+
+
+def next_question(answers, start=0, planner=None):
+    """Next question that can still change the diagnosis of ``answers``, or None"""
+    if planner is None:
+        planner = get_default_planner()
+    return planner.next_question(answers, start)
@@ -0,0 +1,62 @@
+"""
+Questionnaire shown by the GUI: (text, attribute, options) per question.
+
+Each option pairs the text shown to the user with the logical value passed
+to the expert system; several options may share a logical value.
+"""
+
+QUESTIONS = [
+    ("1. How would you rate your overall sleep quality?", "sleep_quality",
+     [("Excellent", "excellent"), ("Good", "good"), ("Fair", "fair"), ("Poor", "poor"), ("Very Poor", "very_poor")]),
+    ("2. How long does it typically take you to fall asleep?", "sleep_onset",
+     [("Less than 15 minutes", "normal"), ("15-30 minutes", "normal"), ("30-60 minutes", "long"), ("More than 60 minutes", "long")]),
+    ("3. How many times do you wake up during the night?", "night_awakenings",
+     [("0 times", "none"), ("1-2 times", "occasional"), ("3-4 times", "frequent"), ("5+ times", "frequent")]),
+    ("4. How many hours of sleep do you get per night on average?", "sleep_duration",
+     [("Less than 5 hours", "insufficient"), ("5-6 hours", "insufficient"), ("6-7 hours", "adequate"), ("7-9 hours", "adequate"), ("More than 9 hours", "excessive")]),
+    ("5. Do you feel excessively sleepy during the day?", "daytime_sleepiness",
+     [("Not at all", "low"), ("Occasionally", "medium"), ("Frequently", "high"), ("All the time", "high")]),
+    ("6. Do you snore loudly?", "snoring",
+     [("No", "none"), ("Occasionally", "mild"), ("Yes, frequently", "loud"), ("I don't know", "unknown")]),
+    ("7. Has anyone noticed you stop breathing during sleep?", "breathing_pauses",
+     [("Yes", "yes"), ("No", "no"), ("I sleep alone/Don't know", "unknown")]),
+    ("8. When do you consume your last caffeinated beverage?", "caffeine_timing",
+     [("I don't consume caffeine", "none"), ("Before noon", "early"), ("12 PM - 2 PM", "early"), ("After 2 PM", "late")]),
+    ("9. How much screen time do you have in the hour before bed?", "screen_time",
+     [("None", "low"), ("Less than 30 minutes", "low"), ("30-60 minutes", "medium"), ("More than 60 minutes", "high")]),
+    ("10. Do you experience racing thoughts when trying to sleep?", "racing_thoughts",
+     [("Never", "no"), ("Occasionally", "sometimes"), ("Frequently", "yes"), ("Always", "yes")]),
+    ("11. How would you rate your current stress level?", "stress_level",
+     [("Low", "low"), ("Moderate", "medium"), ("High", "high"), ("Very High", "high")]),
+    ("12. Do you experience anxiety symptoms?", "anxiety",
+     [("No", "low"), ("Mild", "medium"), ("Moderate", "high"), ("Severe", "high")]),
+    ("13. How consistent is your sleep schedule (bedtime and wake time)?", "schedule_consistency",
+     [("Very consistent (within 30 min)", "good"), ("Somewhat consistent (within 1 hour)", "fair"), ("Inconsistent (varies by 1-2 hours)", "poor"), ("Very inconsistent (varies by 2+ hours)", "poor")]),
+    ("14. Do you work shifts or have an irregular work schedule?", "shift_work",
+     [("No, regular schedule", "no"), ("Yes, rotating shifts", "yes"), ("Yes, night shifts", "yes"), ("Yes, irregular hours", "yes")]),
+    ("15. Do you go to bed at different times each night?", "irregular_bedtime",
+     [("No, usually same time", "no"), ("Sometimes varies", "sometimes"), ("Yes, very irregular", "yes")]),
+    ("16. How is your bedroom temperature?", "room_temp",
+     [("Too cold", "too_cold"), ("Comfortable (60-67°F)", "comfortable"), ("Too hot", "too_hot")]),
+    ("17. How dark is your bedroom at night?", "bedroom_light",
+     [("Very dark", "dark"), ("Some light", "dim"), ("Bright/Light pollution", "bright")]),
+    ("18. How noisy is your bedroom environment?", "bedroom_noise",
+     [("Very quiet", "low"), ("Some noise", "medium"), ("Noisy", "high")]),
+    ("19. Do you use your bedroom for activities other than sleep?", "bedroom_activities",
+     [("No, only for sleep", "sleep_only"), ("Yes, occasionally", "some"), ("Yes, frequently (TV, work, etc.)", "multiple")]),
+    ("20. Do you consume alcohol within 3 hours of bedtime?", "alcohol_consumption",
+     [("Never", "no"), ("Occasionally", "sometimes"), ("Frequently", "yes"), ("Daily", "yes")]),
+    ("21. When do you typically exercise?", "exercise_timing",
+     [("I don't exercise regularly", "none"), ("Morning", "early"), ("Afternoon", "early"), ("Within 3 hours of bedtime", "late")]),
+    ("22. When do you eat your last meal?", "meal_timing",
+     [("3+ hours before bed", "early"), ("2-3 hours before bed", "moderate"), ("Within 2 hours of bed", "late"), ("Right before bed", "late")]),
+    ("23. How often do you nap during the day?", "napping",
+     [("Never", "none"), ("Occasionally (< 30 min)", "moderate"), ("Frequently (30+ min)", "excessive"), ("Daily long naps", "excessive")]),
+    ("24. Do you experience leg discomfort or restlessness at night?", "leg_discomfort",
+     [("No", "no"), ("Occasionally", "sometimes"), ("Frequently", "yes"), ("Always", "yes")]),
+    ("25. Do you have an irresistible urge to move your legs when lying down?", "urge_to_move",
+     [("No", "no"), ("Sometimes", "sometimes"), ("Yes", "yes")]),
+]
+
+# Attribute names in question order
+ATTRIBUTES = [name for _, name, _ in QUESTIONS]
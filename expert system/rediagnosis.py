@@ -0,0 +1,161 @@
+"""
+Delta re-diagnosis of a questionnaire resubmitted with a few answers changed.
+
+A rule can only change its outcome when one of the attributes it reads
+changes. DependencyIndex maps every attribute to the rules whose patterns
+read it, for instance sleep_onset to the four rules testing it. Given the
+previous inputs and result, rediagnose() evaluates only the rules reading a
+changed answer, plus the rules that fired before (their firings are needed
+to order the result), and leaves every other rule alone:
+
+    result = run_diagnosis(answers)
+    changed = dict(answers, caffeine_timing='late')
+    result, diff = rediagnose(answers, result, changed)
+    diff.added      # ['Caffeine-Related Onset Insomnia']
+
+The result is the one run_diagnosis(new_inputs) returns, in the same order.
+"""
+from collections import namedtuple
+
+from compact_results import ResultCatalogue
+from decision_table import get_default_table
+
+
+# Diagnoses gained and lost, each in the order of the result they appear in
+DiagnosisDiff = namedtuple('DiagnosisDiff', 'added removed')
+
+# Marks an answer missing from one of the two questionnaires
+_MISSING = object()
+
+
+class DependencyIndex:
+    """Which rules read which attributes
+
+    Attributes:
+        names: rule names, in definition order
+        rules: attribute -> names of the rules reading it, in definition order
+    """
+
+    def __init__(self, specs):
+        self.names = tuple(spec.name for spec in specs)
+        indices = {}
+        for index, spec in enumerate(specs):
+            for branch in spec.branches:
+                for attribute, _, _ in branch:
+                    readers = indices.setdefault(attribute, [])
+                    if index not in readers:
+                        readers.append(index)
+        self._indices = {attribute: tuple(readers) for attribute, readers in indices.items()}
+        self.rules = {attribute: tuple(self.names[i] for i in readers)
+                      for attribute, readers in self._indices.items()}
+
+    def __getitem__(self, attribute):
+        return self.rules.get(attribute, ())
+
+    def __contains__(self, attribute):
+        return attribute in self.rules
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def affected(self, attributes):
+        """Indices of the rules reading any of the attributes"""
+        indices = set()
+        for attribute in attributes:
+            indices.update(self._indices.get(attribute, ()))
+        return list(indices)
+
+
+def changed_attributes(previous_inputs, new_inputs):
+    """Attributes answered differently, or answered in only one of the inputs"""
+    changed = [attribute for attribute, value in new_inputs.items()
+               if previous_inputs.get(attribute, _MISSING) != value]
+    changed.extend(attribute for attribute in previous_inputs if attribute not in new_inputs)
+    return changed
+
+
+def diagnosis_diff(previous_diagnoses, diagnoses):
+    """DiagnosisDiff between two lists of diagnoses"""
+    before = set(previous_diagnoses)
+    after = set(diagnoses)
+    added = [d for d in dict.fromkeys(diagnoses) if d not in before]
+    removed = [d for d in dict.fromkeys(previous_diagnoses) if d not in after]
+    return DiagnosisDiff(added, removed)
+
+
+class DeltaDiagnoser:
+    """Re-diagnoses changed questionnaires with a DecisionTable
+
+    Args:
+        table: DecisionTable of the engine that produced the previous
+            results (defaults to the compiled SleepQualityOptimizer rules)
+    """
+
+    def __init__(self, table=None):
+        self.table = table if table is not None else get_default_table()
+        self.index = DependencyIndex(self.table.specs)
+        self.catalogue = ResultCatalogue(self.table.specs)
+
+    def rediagnose(self, previous_inputs, previous_result, new_inputs):
+        """
+        Update a result for new inputs
+
+        Args:
+            previous_inputs: Dictionary of user responses the result is for
+            previous_result: (diagnoses, recommendations, confidence_scores)
+                of previous_inputs
+            new_inputs: Dictionary of updated user responses
+
+        Returns:
+            Tuple of (result, DiagnosisDiff)
+        """
+        changed = changed_attributes(previous_inputs, new_inputs)
+        if not changed and list(previous_inputs) == list(new_inputs):
+            diagnoses, recommendations, confidence_scores = previous_result
+            result = list(diagnoses), list(recommendations), dict(confidence_scores)
+            return result, DiagnosisDiff([], [])
+
+        rules = self.index.affected(changed)
+        rules.extend(self.catalogue.rules_of(previous_result[0]))
+        rules = sorted(set(rules))
+        result = self.table.evaluate(new_inputs, rules)
+        return result, diagnosis_diff(previous_result[0], result[0])
+
+
+_default_diagnoser = None
+
+
+def get_default_diagnoser():
+    """Return the DeltaDiagnoser of the default decision table, building it on first use"""
+    global _default_diagnoser
+    if _default_diagnoser is None:
+        _default_diagnoser = DeltaDiagnoser()
+    return _default_diagnoser
+
+
+def dependency_index():
+    """DependencyIndex of the SleepQualityOptimizer rules"""
+    return get_default_diagnoser().index
+
+
+def rediagnose(previous_inputs, previous_result, new_inputs, diagnoser=None):
+    """
+    Re-diagnose a questionnaire after some answers changed
+
+    Only the rules reading a changed answer, and those that fired before,
+    are evaluated.
+
+    Args:
+        previous_inputs: Dictionary of user responses the result is for
+        previous_result: (diagnoses, recommendations, confidence_scores)
+            returned by run_diagnosis for previous_inputs
+        new_inputs: Dictionary of updated user responses
+        diagnoser: DeltaDiagnoser to use (defaults to the shared one)
+
+    Returns:
+        Tuple of (result, DiagnosisDiff) where result is what
+        run_diagnosis(new_inputs) returns
+    """
+    if diagnoser is None:
+        diagnoser = get_default_diagnoser()
+    return diagnoser.rediagnose(previous_inputs, previous_result, new_inputs)
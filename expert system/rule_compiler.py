@@ -0,0 +1,369 @@
+"""
+Data-driven rule definitions for the sleep expert system.
+
+The rules live in rules.json, one object per rule:
+
+    {
+      "name": "caffeine_insomnia",
+      "category": "Insomnia",
+      "when": [{"sleep_onset": "long"}, {"caffeine_timing": "late"}],
+      "diagnosis": "Caffeine-Related Onset Insomnia",
+      "confidence": 0.75,
+      "recommendations": [["Avoid caffeine after 2 PM", "high"], ...]
+    }
+
+"when" lists conditions that must all hold. A condition is an answer,
+{"attribute": "value"}, or one of {"any": [...]}, {"all": [...]} and
+{"not": {"attribute": "value"}}, which map onto experta's OR, AND and NOT.
+
+A rule file compiles into a KnowledgeEngine subclass with one Rule per
+definition (see knowledge_expert.load_engine_class) and into a
+PredicateEvaluator that tests the conditions directly on an answer dict.
+The decision table of a rule file is cached on disk under the SHA-256 of
+the file, so it is only compiled again when the rules change.
+
+    python rule_compiler.py rules.json            validate, compile and verify
+    python rule_compiler.py rules.json --prolog   print rule/4 clauses for sleep optimizer.pl
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from collections import namedtuple
+
+from experta import AND, OR, NOT, Rule
+
+
+RuleDefinition = namedtuple('RuleDefinition', 'name category when diagnosis confidence recommendations')
+
+PRIORITIES = ('high', 'medium', 'low')
+
+CONNECTIVES = ('any', 'all', 'not')
+
+# Bumped whenever the layout of cached artifacts changes
+CACHE_VERSION = 1
+
+
+# ==================== LOADING ====================
+
+def file_digest(path):
+    """SHA-256 of a file's contents"""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _check_condition(condition, where):
+    if not isinstance(condition, dict) or len(condition) != 1:
+        raise ValueError(f"{where}: a condition is an object with exactly one key, got {condition!r}")
+    (key, value), = condition.items()
+    if key in ('any', 'all'):
+        if not isinstance(value, list) or not value:
+            raise ValueError(f"{where}: '{key}' takes a non-empty list of conditions")
+        for child in value:
+            _check_condition(child, where)
+    elif key == 'not':
+        _check_condition(value, where)
+        if next(iter(value)) in CONNECTIVES:
+            raise ValueError(f"{where}: 'not' applies to a single answer")
+    elif not isinstance(value, str):
+        raise ValueError(f"{where}: the value of '{key}' must be a string")
+
+
+def parse_rules(data, source='<rules>'):
+    """Validate decoded rule file contents and return RuleDefinitions"""
+    if not isinstance(data, list) or not data:
+        raise ValueError(f"{source}: expected a non-empty list of rules")
+    definitions = []
+    names = set()
+    for index, rule in enumerate(data):
+        where = f"{source}: rule {index}"
+        if not isinstance(rule, dict):
+            raise ValueError(f"{where}: expected an object")
+        name = rule.get('name')
+        if not isinstance(name, str) or not name.isidentifier() or name.startswith('_'):
+            raise ValueError(f"{where}: 'name' must be a public Python identifier")
+        where = f"{source}: rule {name!r}"
+        if name in names:
+            raise ValueError(f"{where}: duplicate rule name")
+        names.add(name)
+
+        unknown = set(rule) - set(RuleDefinition._fields)
+        if unknown:
+            raise ValueError(f"{where}: unknown keys {sorted(unknown)}")
+        when = rule.get('when')
+        if not isinstance(when, list) or not when:
+            raise ValueError(f"{where}: 'when' must be a non-empty list of conditions")
+        for condition in when:
+            _check_condition(condition, where)
+        diagnosis = rule.get('diagnosis')
+        if not isinstance(diagnosis, str) or not diagnosis:
+            raise ValueError(f"{where}: 'diagnosis' must be a non-empty string")
+        confidence = rule.get('confidence')
+        if isinstance(confidence, bool) or not isinstance(confidence, (int, float)) \
+                or not 0 <= confidence <= 1:
+            raise ValueError(f"{where}: 'confidence' must be a number between 0 and 1")
+        recommendations = []
+        for recommendation in rule.get('recommendations', []):
+            if (not isinstance(recommendation, list) or len(recommendation) != 2
+                    or not isinstance(recommendation[0], str)
+                    or recommendation[1] not in PRIORITIES):
+                raise ValueError(f"{where}: recommendations are [text, priority] pairs "
+                                 f"with a priority in {PRIORITIES}")
+            recommendations.append(tuple(recommendation))
+
+        definitions.append(RuleDefinition(name, rule.get('category', ''), when, diagnosis,
+                                          float(confidence), tuple(recommendations)))
+    return definitions
+
+
+def load_rules(path):
+    """
+    Read and validate a rule file
+
+    Returns:
+        Tuple of (list of RuleDefinition, SHA-256 of the file)
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    try:
+        data = json.loads(content.decode('utf-8'))
+    except ValueError as e:
+        raise ValueError(f"{path}: invalid JSON: {e}") from e
+    return parse_rules(data, path), hashlib.sha256(content).hexdigest()
+
+
+# ==================== ENGINE ====================
+
+def compile_condition(condition, fact_class):
+    """Turn a condition into an experta conditional element"""
+    (key, value), = condition.items()
+    if key == 'any':
+        return OR(*[compile_condition(child, fact_class) for child in value])
+    if key == 'all':
+        return AND(*[compile_condition(child, fact_class) for child in value])
+    if key == 'not':
+        return NOT(compile_condition(value, fact_class))
+    return fact_class(**{key: value})
+
+
+def _consequence(definition):
+    diagnosis = definition.diagnosis
+    confidence = definition.confidence
+    recommendations = list(definition.recommendations)
+
+    def consequence(self):
+        self.diagnoses.append(diagnosis)
+        self.confidence_scores[diagnosis] = confidence
+        self.recommendations.extend(recommendations)
+
+    consequence.__name__ = consequence.__qualname__ = definition.name
+    consequence.__doc__ = diagnosis
+    return consequence
+
+
+def compile_engine_class(definitions, base, fact_class, name, doc=None):
+    """
+    Build a subclass of ``base`` with one Rule per definition
+
+    The right-hand side of every rule appends its diagnosis, confidence and
+    recommendations to the engine's diagnoses, confidence_scores and
+    recommendations.
+    """
+    namespace = {'__doc__': doc or base.__doc__, '__module__': base.__module__}
+    for definition in definitions:
+        if hasattr(base, definition.name):
+            raise ValueError(f"Rule name {definition.name!r} clashes with an engine attribute")
+        conditions = [compile_condition(condition, fact_class) for condition in definition.when]
+        namespace[definition.name] = Rule(*conditions)(_consequence(definition))
+    return type(name, (base,), namespace)
+
+
+# ==================== PREDICATES ====================
+
+def compile_predicate(condition):
+    """Turn a condition into a function of an answer dict"""
+    (key, value), = condition.items()
+    if key in ('any', 'all'):
+        children = [compile_predicate(child) for child in value]
+        combine = any if key == 'any' else all
+        return lambda user_inputs: combine(child(user_inputs) for child in children)
+    if key == 'not':
+        child = compile_predicate(value)
+        return lambda user_inputs: not child(user_inputs)
+    return lambda user_inputs: user_inputs.get(key) == value
+
+
+class PredicateEvaluator:
+    """Tests every rule directly on an answer dict, without a Rete network
+
+    Each matching rule contributes its diagnosis once, in rule order, like
+    the Prolog diagnose_batch/3 and VectorizedEvaluator. run_diagnosis may
+    order diagnoses differently and repeat a rule that matches on two
+    alternatives; DecisionTable reproduces it exactly.
+    """
+
+    def __init__(self, definitions):
+        self.definitions = definitions
+        self._rules = []
+        for definition in definitions:
+            conditions = [compile_predicate(condition) for condition in definition.when]
+            self._rules.append((definition, conditions))
+
+    def matches(self, user_inputs):
+        """Names of the rules whose conditions hold"""
+        return [definition.name for definition, conditions in self._rules
+                if all(condition(user_inputs) for condition in conditions)]
+
+    def diagnose(self, user_inputs):
+        """Return (diagnoses, recommendations, confidence_scores) for the answers"""
+        diagnoses = []
+        recommendations = []
+        confidence_scores = {}
+        for definition, conditions in self._rules:
+            if all(condition(user_inputs) for condition in conditions):
+                if definition.diagnosis not in confidence_scores:
+                    diagnoses.append(definition.diagnosis)
+                confidence_scores[definition.diagnosis] = definition.confidence
+                recommendations.extend(definition.recommendations)
+        return diagnoses, recommendations, confidence_scores
+
+
+# ==================== CACHE ====================
+
+def default_cache_dir(path):
+    """Cache directory kept next to a rule file"""
+    return os.path.join(os.path.dirname(os.path.abspath(path)), '__rulecache__')
+
+
+def cached_decision_table(engine_class, cache_dir=None):
+    """
+    DecisionTable of an engine class compiled by load_engine_class
+
+    The table is stored under the digest of the class's rule file and read
+    back instead of being compiled again while the file is unchanged. The
+    cache is skipped if it cannot be written.
+    """
+    from decision_table import DecisionTable
+
+    digest = getattr(engine_class, 'rules_digest', None)
+    if digest is None:
+        return DecisionTable.compile(engine_class)
+    if cache_dir is None:
+        cache_dir = default_cache_dir(engine_class.rules_file)
+    path = os.path.join(cache_dir, f"{digest}.v{CACHE_VERSION}.table.json")
+
+    try:
+        return DecisionTable.load(path)
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    table = DecisionTable.compile(engine_class)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(table.to_dict(), f, ensure_ascii=False)
+        os.replace(temporary, path)
+    except OSError:
+        pass
+    return table
+
+
+class CompiledRuleset:
+    """A rule file compiled into an engine class, a predicate evaluator and a decision table"""
+
+    def __init__(self, path=None, cache_dir=None):
+        from knowledge_expert import RULES_FILE, load_engine_class
+
+        self.path = os.path.abspath(path or RULES_FILE)
+        self.cache_dir = cache_dir
+        self.engine_class = load_engine_class(self.path)
+        self.digest = self.engine_class.rules_digest
+        self.definitions = self.engine_class.rule_definitions
+        self.evaluator = PredicateEvaluator(self.definitions)
+        self._table = None
+
+    def table(self):
+        """DecisionTable reproducing the engine, from the disk cache when possible"""
+        if self._table is None:
+            self._table = cached_decision_table(self.engine_class, self.cache_dir)
+        return self._table
+
+
+# ==================== PROLOG EXPORT ====================
+
+def _prolog_atom(value):
+    if value.isidentifier() and value[0].islower() and value.isascii():
+        return value
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def _prolog_condition(condition):
+    (key, value), = condition.items()
+    if key == 'any':
+        return '(' + ' ; '.join(_prolog_condition(child) for child in value) + ')'
+    if key == 'all':
+        return '(' + ', '.join(_prolog_condition(child) for child in value) + ')'
+    if key == 'not':
+        return '\\+ ' + _prolog_condition(value)
+    return f'has(Facts, {_prolog_atom(key)}, {_prolog_atom(value)})'
+
+
+def _prolog_goals(condition):
+    """Goals of a rule body, one per top-level conjunct"""
+    (key, value), = condition.items()
+    if key == 'all':
+        return [goal for child in value for goal in _prolog_goals(child)]
+    return [_prolog_condition(condition)]
+
+
+def to_prolog(definitions):
+    """rule/4 clauses for the Prolog knowledge base, one per definition"""
+    clauses = []
+    for definition in definitions:
+        recommendations = ',\n      '.join(f'{_prolog_atom(text)}-{priority}'
+                                           for text, priority in definition.recommendations)
+        body = ',\n    '.join(goal for condition in definition.when for goal in _prolog_goals(condition))
+        clauses.append(f"% {definition.category}: {definition.name}\n"
+                       f"rule({_prolog_atom(definition.diagnosis)}, {definition.confidence:.2f},\n"
+                       f"     [{recommendations}],\n"
+                       f"     Facts) :-\n"
+                       f"    {body}.\n")
+    return '\n'.join(clauses)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate and compile a sleep rule file")
+    parser.add_argument('rules', nargs='?', default=None, help="rule file (default: rules.json)")
+    parser.add_argument('--prolog', action='store_true', help="print the rules as Prolog rule/4 clauses")
+    parser.add_argument('--samples', type=int, default=1000,
+                        help="random questionnaires checked against the engine")
+    args = parser.parse_args(argv)
+
+    try:
+        ruleset = CompiledRuleset(args.rules)
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    if args.prolog:
+        sys.stdout.write(to_prolog(ruleset.definitions))
+        return 0
+
+    from decision_table import verify_decision_table
+    from knowledge_expert import EnginePool
+
+    table = ruleset.table()
+    mismatches = verify_decision_table(table, args.samples,
+                                       pool=EnginePool(size=1, engine_class=ruleset.engine_class))
+    print(f"{len(ruleset.definitions)} rules compiled from {ruleset.path} ({ruleset.digest[:12]})")
+    if mismatches:
+        print(f"{len(mismatches)} questionnaire(s) where the decision table and the engine differ, "
+              f"e.g. {mismatches[0]}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
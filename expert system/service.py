@@ -0,0 +1,381 @@
+"""
+Asyncio HTTP front-end for the diagnosis engine.
+
+Runs a small local HTTP/1.1 server with no external dependencies:
+
+    POST /diagnose   questionnaire JSON object -> diagnoses, recommendations
+                     and confidence scores
+    POST /next       answers so far -> next question that can still change
+                     the diagnosis, or null once the answers decide it
+    GET  /metrics    request counts and latency percentiles of /diagnose and /next
+    GET  /health     liveness check
+
+Diagnoses run on a bounded executor of warm engines: worker processes by
+default, each holding one SleepQualityOptimizer, or threads sharing an
+EnginePool with --threads. Workers are started and their engines built
+before the executor takes requests. Identical questionnaires that arrive while one
+is being diagnosed share its result instead of running the engine again.
+Questionnaires are validated against the questionnaire schema (see
+input_schema); unknown attributes or values are rejected with a 400 that
+lists them.
+Answers that make no difference to the result (see question_planner) are
+dropped before a questionnaire is handed to the engine.
+
+The rule file is checked for changes every --reload-interval seconds. An
+edited ruleset is compiled next to the running one and new requests move
+over to it, while requests already submitted finish on the old engines; a
+ruleset that fails to compile is reported and the old one kept.
+
+    python service.py --port 8080 --workers 4
+    python service.py --rules my_rules.json --reload-interval 5
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from knowledge_expert import RULES_FILE, EnginePool, SleepQualityOptimizer, build_engine_class, run_diagnosis
+from input_schema import SchemaError, get_default_schema
+from parallel_scoring import result_record, score_chunk, start_warm_executor
+from question_planner import QuestionPlanner, get_default_planner
+from questionnaire import QUESTIONS
+from rule_compiler import cached_decision_table, file_digest, load_rules
+
+
+MAX_BODY_SIZE = 64 * 1024
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+# attribute -> (question text, [[option text, value], ...])
+_QUESTIONS = {attribute: (text, [list(option) for option in options])
+              for text, attribute, options in QUESTIONS}
+
+
+def _diagnose_in_worker(user_inputs):
+    return score_chunk([user_inputs])[0]
+
+
+def _worker_context():
+    """Start method for engine processes that does not inherit open client sockets
+
+    Forked workers would keep a copy of every connection open at the time,
+    so clients of a connection that closed never see end of file.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+# Executor, diagnose function and question planner serving one compiled ruleset
+Backend = namedtuple('Backend', 'executor diagnose digest planner')
+
+
+class LatencyMetrics:
+    """Request counters and a window of recent latencies"""
+
+    def __init__(self, window=10000):
+        self.requests = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.recent = deque(maxlen=window)
+
+    def record(self, seconds, error=False):
+        self.requests += 1
+        if error:
+            self.errors += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.recent.append(seconds)
+
+    def percentile(self, fraction):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def as_dict(self):
+        mean = self.total_seconds / self.requests if self.requests else 0.0
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'coalesced': self.coalesced,
+            'latency_ms': {
+                'mean': mean * 1000,
+                'p50': self.percentile(0.50) * 1000,
+                'p95': self.percentile(0.95) * 1000,
+                'p99': self.percentile(0.99) * 1000,
+                'max': self.max_seconds * 1000,
+            },
+        }
+
+
+class DiagnosisService:
+    """Dispatches diagnoses to a bounded executor, coalescing identical requests
+
+    Args:
+        workers: Number of engines (processes or threads)
+        threads: Use threads sharing an EnginePool instead of processes
+        max_pending: Maximum diagnoses queued or running at once
+        rules: Rule file to serve (defaults to the built-in rules.json)
+    """
+
+    def __init__(self, workers=4, threads=False, max_pending=None, rules=None):
+        self.workers = workers
+        self.threads = threads
+        self.rules = rules or RULES_FILE
+        self.max_pending = max_pending or 4 * workers
+        self.metrics = LatencyMetrics()
+        self.schema = get_default_schema()
+        self.reloads = 0
+        self._rejected_digest = None
+        self._backend = self._build_backend(None if rules is None else load_rules(rules))
+        self._slots = None
+        self._in_flight = {}
+
+    def _build_backend(self, loaded=None):
+        """Start engines for ``loaded`` (definitions, digest), or the default rules"""
+        if loaded is None:
+            definitions, digest = None, SleepQualityOptimizer.rules_digest
+            engine_class = SleepQualityOptimizer
+            planner = get_default_planner()
+        else:
+            definitions, digest = loaded
+            engine_class = build_engine_class(definitions, digest)
+            # The decision table cache lives next to the rule file
+            engine_class.rules_file = os.path.abspath(self.rules)
+            planner = QuestionPlanner(cached_decision_table(engine_class))
+        if self.threads:
+            pool = EnginePool(size=self.workers, engine_class=engine_class)
+            pool.warm_up()
+            return Backend(ThreadPoolExecutor(max_workers=self.workers),
+                           partial(run_diagnosis, pool=pool), digest, planner)
+        executor = start_warm_executor(self.workers, definitions, digest, mp_context=_worker_context())
+        return Backend(executor, _diagnose_in_worker, digest, planner)
+
+    async def reload_rules(self):
+        """Compile the rule file again and switch new requests over to it
+
+        Raises:
+            OSError, ValueError: The file cannot be read or compiled; the
+                current rules stay in service
+        """
+        loop = asyncio.get_running_loop()
+        loaded = await loop.run_in_executor(None, load_rules, self.rules)
+        if loaded[1] == self._backend.digest:
+            return False
+        backend = await loop.run_in_executor(None, self._build_backend, loaded)
+        previous, self._backend = self._backend, backend
+        # Work already submitted to the previous executor still completes
+        previous.executor.shutdown(wait=False)
+        self.reloads += 1
+        return True
+
+    async def watch_rules(self, interval=2.0):
+        """Reload the rule file whenever its contents change"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                digest = await asyncio.get_running_loop().run_in_executor(None, file_digest, self.rules)
+            except OSError:
+                continue
+            if digest in (self._backend.digest, self._rejected_digest):
+                continue
+            try:
+                if await self.reload_rules():
+                    print(f"Reloaded rules from {self.rules} ({self._backend.digest[:12]})", file=sys.stderr)
+            except Exception as e:
+                # A broken edit must not stop the watcher; the next change is retried
+                self._rejected_digest = digest
+                print(f"Keeping current rules: {type(e).__name__}: {e}", file=sys.stderr)
+
+    async def diagnose(self, user_inputs, encoded=None):
+        """
+        Diagnose one questionnaire, sharing the work with identical requests
+
+        Raises:
+            SchemaError: The questionnaire has unknown attributes or values
+        """
+        if encoded is None:
+            encoded = self.schema.encode(user_inputs)
+        # Answer order is part of the key since it decides the firing order;
+        # the ruleset is too, so no request joins one from before a reload
+        key = (self._backend.digest, tuple(user_inputs), encoded)
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.metrics.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(self._run(user_inputs))
+        self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _run(self, user_inputs):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            # Read and used without yielding, so a reload cannot shut the
+            # executor down in between
+            backend = self._backend
+            user_inputs = backend.planner.essential_answers(user_inputs)
+            return await loop.run_in_executor(backend.executor, backend.diagnose, user_inputs)
+
+    def next_question(self, answers):
+        """Next question that can still change the diagnosis of ``answers``"""
+        planner = self._backend.planner
+        remaining = planner.remaining(answers)
+        if not remaining:
+            return {'next': None, 'remaining': 0}
+        attribute = remaining[0]
+        text, options = _QUESTIONS.get(attribute, (None, None))
+        return {'next': attribute, 'question': text, 'options': options,
+                'remaining': len(remaining)}
+
+    def close(self):
+        self._backend.executor.shutdown(wait=True)
+
+    # ==================== HTTP ====================
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'malformed request line'}, close=True)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'invalid Content-Length'}, close=True)
+                    break
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, {'error': 'request body too large'}, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                close = (headers.get('connection', '').lower() == 'close'
+                         or version == 'HTTP/1.0')
+                status, payload, extra = await self._dispatch(method, path, body)
+                await self._respond(writer, status, payload, close, extra)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, body):
+        path = path.split('?', 1)[0]
+        if path == '/health':
+            return 200, {'status': 'ok'}, {}
+        if path == '/metrics':
+            metrics = self.metrics.as_dict()
+            metrics['rules'] = {'digest': self._backend.digest, 'reloads': self.reloads}
+            return 200, metrics, {}
+        if path not in ('/diagnose', '/next'):
+            return 404, {'error': 'not found'}, {}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}, {}
+
+        started = time.perf_counter()
+        try:
+            user_inputs = json.loads(body or b'{}')
+            if not isinstance(user_inputs, dict):
+                raise ValueError("expected a JSON object")
+            encoded = self.schema.encode(user_inputs)
+        except SchemaError as e:
+            self.metrics.record(time.perf_counter() - started, error=True)
+            return 400, {'error': f"invalid questionnaire: {e}",
+                         'unknown_attributes': e.unknown_attributes,
+                         'unknown_values': e.unknown_values}, {}
+        except ValueError as e:
+            self.metrics.record(time.perf_counter() - started, error=True)
+            return 400, {'error': f"invalid questionnaire: {e}"}, {}
+
+        try:
+            if path == '/next':
+                payload = self.next_question(user_inputs)
+            else:
+                payload = result_record(await self.diagnose(user_inputs, encoded))
+        except Exception as e:
+            self.metrics.record(time.perf_counter() - started, error=True)
+            return 500, {'error': str(e)}, {}
+
+        elapsed = time.perf_counter() - started
+        self.metrics.record(elapsed)
+        return 200, payload, {'X-Diagnosis-Latency-Ms': f"{elapsed * 1000:.3f}"}
+
+    async def _respond(self, writer, status, payload, close=False, extra=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                "Content-Type: application/json; charset=utf-8",
+                f"Content-Length: {len(body)}",
+                f"Connection: {'close' if close else 'keep-alive'}"]
+        for name, value in (extra or {}).items():
+            head.append(f"{name}: {value}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(host='127.0.0.1', port=8080, workers=4, threads=False, max_pending=None,
+                rules=None, reload_interval=2.0):
+    """Run the diagnosis service until cancelled"""
+    service = DiagnosisService(workers, threads, max_pending, rules)
+    server = await asyncio.start_server(service.handle_client, host, port)
+    addresses = ", ".join(str(s.getsockname()) for s in server.sockets)
+    print(f"Serving diagnoses on {addresses}", file=sys.stderr)
+    watcher = asyncio.ensure_future(service.watch_rules(reload_interval)) if reload_interval else None
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve sleep diagnoses over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', action='store_true', help="use engine threads instead of processes")
+    parser.add_argument('--max-pending', type=int, default=None)
+    parser.add_argument('--rules', default=None, help="rule file to serve (default: rules.json)")
+    parser.add_argument('--reload-interval', type=float, default=2.0,
+                        help="seconds between checks of the rule file for changes (0 disables)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.threads, args.max_pending,
+                          args.rules, args.reload_interval))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Single-fact variant of the SleepQualityOptimizer.
+
+run_diagnosis declares one SleepFact per answer, so every multi-pattern
+rule joins several facts in the Rete beta network. Here all answers go
+into one SleepFact and each rule is rewritten so that its positive
+conditions form a single pattern on that fact; only negated conditions
+remain as separate patterns.
+
+Rules are given a salience following their definition order, so the
+single-fact engine fires them in a fixed order. Its diagnoses,
+recommendations and confidences are the same as run_diagnosis, but the
+order of rule firings may differ from the multi-fact engine, where it
+follows the order in which answers were declared.
+"""
+from experta import AND, OR, NOT, Rule
+
+from decision_table import rule_branches
+from knowledge_expert import EnginePool, SleepFact, SleepQualityOptimizer
+
+
+def _single_fact_rule(rule, salience):
+    """Rewrite a rule so its positive conditions match one fact"""
+    lhs = []
+    for branch in rule_branches(rule):
+        positives = {}
+        for attribute, value, positive in branch:
+            if positive and positives.setdefault(attribute, value) != value:
+                break
+        else:
+            patterns = [SleepFact(**positives)] if positives else []
+            patterns += [NOT(SleepFact(**{a: v})) for a, v, positive in branch if not positive]
+            lhs.append(AND(*patterns) if len(patterns) > 1 else patterns[0])
+        # branches testing one attribute for two values can never fire
+
+    if not lhs:
+        raise ValueError(f"Rule {rule.__name__} can never fire")
+    return Rule(OR(*lhs) if len(lhs) > 1 else lhs[0], salience=salience)(rule._wrapped)
+
+
+def single_fact_engine_class(engine_class=SleepQualityOptimizer):
+    """Build a subclass of ``engine_class`` whose rules match a single fact"""
+    rules = [(name, rule) for name, rule in vars(engine_class).items() if isinstance(rule, Rule)]
+    namespace = {
+        name: _single_fact_rule(rule, salience=len(rules) - index)
+        for index, (name, rule) in enumerate(rules)
+    }
+    namespace['__doc__'] = f"{engine_class.__name__} with all answers held in one SleepFact"
+    return type('SingleFact' + engine_class.__name__, (engine_class,), namespace)
+
+
+SingleFactSleepQualityOptimizer = single_fact_engine_class()
+
+_single_fact_pool = EnginePool(engine_class=SingleFactSleepQualityOptimizer)
+
+
+def run_diagnosis_single_fact(user_inputs, pool=None):
+    """
+    Run the single-fact engine with user inputs
+
+    Args:
+        user_inputs: Dictionary of user responses
+        pool: EnginePool of single-fact engines (defaults to a shared pool)
+
+    Returns:
+        Tuple of (diagnoses, recommendations, confidence_scores)
+    """
+    if pool is None:
+        pool = _single_fact_pool
+
+    with pool.engine() as engine:
+        engine.declare(SleepFact(**user_inputs))
+        engine.run()
+        return engine.diagnoses, engine.recommendations, engine.confidence_scores
@@ -0,0 +1,516 @@
+"""
+Sleep diary ingestion with rolling-window fact derivation.
+
+The questionnaire is a single snapshot; a diary records every night. Each
+user keeps a window over the last ``window`` calendar nights (two weeks by
+default) in which every measure has a running count, sum and sum of
+squares. A new night is added and the nights that fell out of the window
+subtracted, so the window never rescans history. Nights missing from the
+diary are simply absent from the window; nights must arrive in date order,
+and a second entry for the latest night replaces it. Questionnaire answers are derived from the
+window aggregates:
+
+    sleep_duration         mean time asleep (bed to wake, minus sleep onset)
+    sleep_onset            mean minutes to fall asleep
+    night_awakenings       mean awakenings per night
+    schedule_consistency   spread (standard deviation) of bed and wake times
+    irregular_bedtime      spread of bedtimes
+    caffeine_timing        share of caffeine days with caffeine after 2 PM
+    alcohol_consumption    share of nights with alcohol before bed
+    exercise_timing        share of exercise days exercising within 3 hours of bed
+    meal_timing            mean time between the last meal and bed
+    napping                mean nap minutes per day
+    sleep_quality          mean nightly rating, 1 (very poor) to 5 (excellent)
+    daytime_sleepiness     mean daily rating, 1 (low) to 3 (high)
+
+An answer is only derived once the window holds ``min_nights`` nights
+recording it. Answers a diary cannot measure, such as snoring, come from
+the user's profile; derived answers take precedence over the profile.
+
+Each night changes a handful of derived answers, and the user's diagnosis
+is updated with rediagnosis.rediagnose, which only evaluates the rules
+reading them. Adding a night therefore costs the same however long the
+diary is.
+
+A diary entry is a dict; times are "HH:MM", and a null caffeine or
+exercise time means none that day:
+
+    {"user": "u1", "date": "2024-03-01", "bedtime": "23:40", "wake_time": "07:10",
+     "sleep_onset": 25, "awakenings": 1, "caffeine_time": "15:30", "alcohol": false,
+     "exercise_time": null, "last_meal_time": "20:00", "nap_minutes": 0,
+     "quality": 3, "sleepiness": 2}
+
+    python sleep_diary.py diary.jsonl --profiles profiles.jsonl > diagnoses.jsonl
+    python sleep_diary.py --verify
+"""
+import argparse
+import json
+import sys
+from collections import deque, namedtuple
+from datetime import date, timedelta
+
+from decision_table import run_diagnosis_fast
+from input_schema import get_default_schema
+from parallel_scoring import result_record
+from rediagnosis import rediagnose
+
+
+DEFAULT_WINDOW = 14
+DEFAULT_MIN_NIGHTS = 3
+
+MINUTES_PER_DAY = 24 * 60
+
+# Caffeine after 2 PM counts as late; exercise or alcohol within this many
+# minutes of bedtime counts as close to bed
+LATE_CAFFEINE = 14 * 60
+CLOSE_TO_BED = 3 * 60
+
+DiaryEntry = namedtuple(
+    'DiaryEntry',
+    'date bedtime wake_time sleep_onset awakenings caffeine_time alcohol '
+    'exercise_time last_meal_time nap_minutes quality sleepiness',
+    defaults=(None,) * 11)
+DiaryEntry.__doc__ = """One night of a sleep diary
+
+date is a datetime.date and times are minutes after midnight.
+caffeine_time and exercise_time are
+False for a day without caffeine or exercise. Fields left as None were
+not recorded.
+"""
+
+# Measures kept in the rolling window, each an integer per night
+MEASURES = ('asleep', 'onset', 'awakenings', 'bedtime', 'wake_time', 'caffeine', 'caffeine_late',
+            'alcohol', 'exercise', 'exercise_late', 'meal_gap', 'nap', 'quality', 'sleepiness')
+
+_RATINGS = {'quality': (1, 5), 'sleepiness': (1, 3)}
+
+
+# ==================== PARSING ====================
+
+def parse_time(value, field):
+    """Minutes after midnight of an "HH:MM" string"""
+    try:
+        hours, minutes = value.split(':')
+        hours, minutes = int(hours), int(minutes)
+    except (AttributeError, ValueError):
+        raise ValueError(f"{field}: expected a time as HH:MM, got {value!r}") from None
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"{field}: {value!r} is not a time of day")
+    return hours * 60 + minutes
+
+
+def _count(record, field, maximum=None):
+    value = record.get(field)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f"{field}: expected a non-negative integer, got {value!r}")
+    if maximum is not None and value > maximum:
+        raise ValueError(f"{field}: at most {maximum}, got {value!r}")
+    return value
+
+
+def parse_entry(record):
+    """
+    Validate a diary record and convert it into a DiaryEntry
+
+    Raises:
+        ValueError: A field is malformed or the date is missing
+    """
+    try:
+        night = date.fromisoformat(record.get('date'))
+    except (TypeError, ValueError):
+        raise ValueError(f"date: expected an ISO date such as 2024-03-01, got {record.get('date')!r}") from None
+    fields = {'date': night}
+    for field in ('bedtime', 'wake_time', 'last_meal_time'):
+        if record.get(field) is not None:
+            fields[field] = parse_time(record[field], field)
+    for field in ('caffeine_time', 'exercise_time'):
+        if field in record:
+            fields[field] = False if record[field] is None else parse_time(record[field], field)
+    if record.get('alcohol') is not None:
+        if not isinstance(record['alcohol'], bool):
+            raise ValueError(f"alcohol: expected true or false, got {record['alcohol']!r}")
+        fields['alcohol'] = record['alcohol']
+    fields['sleep_onset'] = _count(record, 'sleep_onset', MINUTES_PER_DAY)
+    fields['awakenings'] = _count(record, 'awakenings')
+    fields['nap_minutes'] = _count(record, 'nap_minutes', MINUTES_PER_DAY)
+    for field, (low, high) in _RATINGS.items():
+        value = _count(record, field, high)
+        if value is not None and value < low:
+            raise ValueError(f"{field}: expected a rating from {low} to {high}, got {value!r}")
+        fields[field] = value
+    return DiaryEntry(**fields)
+
+
+def entry_measures(entry):
+    """Tuple of the night's value of each of MEASURES, None where not recorded"""
+    bedtime = entry.bedtime
+    values = dict.fromkeys(MEASURES)
+    if bedtime is not None:
+        # Minutes after noon, so bedtimes either side of midnight stay close
+        values['bedtime'] = (bedtime - MINUTES_PER_DAY // 2) % MINUTES_PER_DAY
+        if entry.wake_time is not None:
+            in_bed = (entry.wake_time - bedtime) % MINUTES_PER_DAY
+            values['asleep'] = max(in_bed - (entry.sleep_onset or 0), 0)
+    values['wake_time'] = entry.wake_time
+    values['onset'] = entry.sleep_onset
+    values['awakenings'] = entry.awakenings
+    if entry.caffeine_time is not None:
+        values['caffeine'] = int(entry.caffeine_time is not False)
+        values['caffeine_late'] = int(entry.caffeine_time is not False
+                                      and entry.caffeine_time >= LATE_CAFFEINE)
+    if entry.alcohol is not None:
+        values['alcohol'] = int(entry.alcohol)
+    if entry.exercise_time is not None and bedtime is not None:
+        exercised = entry.exercise_time is not False
+        values['exercise'] = int(exercised)
+        values['exercise_late'] = int(exercised and
+                                      (bedtime - entry.exercise_time) % MINUTES_PER_DAY < CLOSE_TO_BED)
+    if entry.last_meal_time is not None and bedtime is not None:
+        values['meal_gap'] = (bedtime - entry.last_meal_time) % MINUTES_PER_DAY
+    values['nap'] = entry.nap_minutes
+    values['quality'] = entry.quality
+    values['sleepiness'] = entry.sleepiness
+    return tuple(values[measure] for measure in MEASURES)
+
+
+# ==================== ROLLING WINDOW ====================
+
+class RollingWindow:
+    """Count, sum and sum of squares of each measure over the last ``size`` calendar nights
+
+    Sums are kept as integers, so subtracting an evicted night is exact.
+    Each night is added and evicted once, so pushing costs constant time
+    on average however long the diary is.
+    """
+
+    def __init__(self, size=DEFAULT_WINDOW):
+        if size < 1:
+            raise ValueError("The window must hold at least one night")
+        self.size = size
+        self.span = timedelta(days=size)
+        self.nights = deque()
+        self.counts = [0] * len(MEASURES)
+        self.sums = [0] * len(MEASURES)
+        self.squares = [0] * len(MEASURES)
+
+    def __len__(self):
+        return len(self.nights)
+
+    def _apply(self, measures, sign):
+        counts, sums, squares = self.counts, self.sums, self.squares
+        for i, value in enumerate(measures):
+            if value is not None:
+                counts[i] += sign
+                sums[i] += sign * value
+                squares[i] += sign * value * value
+
+    def push(self, night, measures):
+        """
+        Add a night, evicting the nights ``size`` or more days before it
+
+        Raises:
+            ValueError: The night is not later than the latest one
+        """
+        nights = self.nights
+        if nights and night <= nights[-1][0]:
+            raise ValueError(f"Diary entry for {night} is not later than the latest night ({nights[-1][0]})")
+        oldest = night - self.span
+        while nights and nights[0][0] <= oldest:
+            _, evicted = nights.popleft()
+            self._apply(evicted, -1)
+        nights.append((night, measures))
+        self._apply(measures, 1)
+
+    def replace_last(self, measures):
+        """Replace the measures of the latest night, e.g. when its entry is corrected"""
+        night, previous = self.nights.pop()
+        self._apply(previous, -1)
+        self.nights.append((night, measures))
+        self._apply(measures, 1)
+
+    def last_date(self):
+        return self.nights[-1][0] if self.nights else None
+
+    def count(self, measure):
+        return self.counts[MEASURES.index(measure)]
+
+    def mean(self, measure):
+        i = MEASURES.index(measure)
+        return self.sums[i] / self.counts[i] if self.counts[i] else None
+
+    def std(self, measure):
+        """Population standard deviation, None with fewer than two nights"""
+        i = MEASURES.index(measure)
+        n = self.counts[i]
+        if n < 2:
+            return None
+        variance = (n * self.squares[i] - self.sums[i] ** 2) / (n * n)
+        return max(variance, 0.0) ** 0.5
+
+
+# ==================== FACT DERIVATION ====================
+
+def _band(value, bands, above):
+    """Label of the first (limit, label) band with value < limit, else ``above``"""
+    for limit, label in bands:
+        if value < limit:
+            return label
+    return above
+
+
+def _timing(window, any_measure, late_measure):
+    """'none', 'early' or 'late' from the share of the activity's days on which it was late
+
+    Days without the activity do not dilute the share: caffeine at 4 PM on
+    the four days someone has any is late caffeine.
+    """
+    days = window.sums[MEASURES.index(any_measure)]
+    if not days:
+        return 'none'
+    return 'late' if window.sums[MEASURES.index(late_measure)] / days >= 0.5 else 'early'
+
+
+def derive_facts(window, min_nights=DEFAULT_MIN_NIGHTS):
+    """Questionnaire answers supported by the window, as logical values"""
+    min_nights = max(min_nights, 1)
+
+    def recorded(measure):
+        return window.count(measure) >= min_nights
+
+    facts = {}
+    if recorded('quality'):
+        facts['sleep_quality'] = _band(window.mean('quality'),
+                                       [(1.5, 'very_poor'), (2.5, 'poor'), (3.5, 'fair'), (4.5, 'good')],
+                                       'excellent')
+    if recorded('onset'):
+        facts['sleep_onset'] = 'normal' if window.mean('onset') < 30 else 'long'
+    if recorded('awakenings'):
+        facts['night_awakenings'] = _band(window.mean('awakenings'), [(0.5, 'none'), (3, 'occasional')],
+                                          'frequent')
+    if recorded('asleep'):
+        hours = window.mean('asleep') / 60
+        facts['sleep_duration'] = 'insufficient' if hours < 6 else ('adequate' if hours <= 9 else 'excessive')
+    if recorded('sleepiness'):
+        facts['daytime_sleepiness'] = _band(window.mean('sleepiness'), [(1.5, 'low'), (2.5, 'medium')], 'high')
+    if recorded('caffeine'):
+        facts['caffeine_timing'] = _timing(window, 'caffeine', 'caffeine_late')
+
+    # A spread needs at least two nights
+    if window.count('bedtime') >= max(min_nights, 2):
+        bedtime_spread = window.std('bedtime')
+        spread = bedtime_spread
+        if window.count('wake_time') >= 2:
+            spread = max(spread, window.std('wake_time'))
+        facts['schedule_consistency'] = _band(spread, [(30, 'good'), (60, 'fair')], 'poor')
+        facts['irregular_bedtime'] = _band(bedtime_spread, [(30, 'no'), (60, 'sometimes')], 'yes')
+
+    if recorded('alcohol'):
+        alcohol = window.mean('alcohol')
+        facts['alcohol_consumption'] = 'no' if not alcohol else ('yes' if alcohol >= 0.5 else 'sometimes')
+    if recorded('exercise'):
+        facts['exercise_timing'] = _timing(window, 'exercise', 'exercise_late')
+    if recorded('meal_gap'):
+        facts['meal_timing'] = _band(window.mean('meal_gap'), [(120, 'late'), (180, 'moderate')], 'early')
+    if recorded('nap'):
+        nap = window.mean('nap')
+        facts['napping'] = 'none' if not nap else ('moderate' if nap < 30 else 'excessive')
+    return facts
+
+
+# ==================== USERS ====================
+
+class UserDiary:
+    """One user's rolling window, profile answers and current diagnosis"""
+
+    def __init__(self, window=DEFAULT_WINDOW, min_nights=DEFAULT_MIN_NIGHTS, profile=None):
+        self.window = RollingWindow(window)
+        self.min_nights = min_nights
+        self.profile = dict(profile or {})
+        self.facts = {}
+        self.inputs = {}
+        self.result = run_diagnosis_fast(self.inputs)
+
+    def _inputs(self):
+        """Profile answers overridden by derived facts, in question order"""
+        answers = dict(self.profile, **self.facts)
+        return {attribute: answers[attribute]
+                for attribute in get_default_schema().attributes if attribute in answers}
+
+    def _rediagnose(self):
+        inputs = self._inputs()
+        self.result, diff = rediagnose(self.inputs, self.result, inputs)
+        self.inputs = inputs
+        return diff
+
+    def add_night(self, entry):
+        """
+        Add a DiaryEntry and update the diagnosis
+
+        An entry for the date of the latest night replaces it; earlier
+        dates are rejected, since the window only moves forward.
+
+        Returns:
+            DiagnosisDiff of the diagnoses gained and lost
+
+        Raises:
+            ValueError: The entry is older than the latest night
+        """
+        measures = entry_measures(entry)
+        if entry.date == self.window.last_date():
+            self.window.replace_last(measures)
+        else:
+            self.window.push(entry.date, measures)
+        self.facts = derive_facts(self.window, self.min_nights)
+        return self._rediagnose()
+
+    def set_profile(self, profile):
+        """
+        Replace the answers not derived from the diary
+
+        Raises:
+            SchemaError: The profile has answers outside the questionnaire
+        """
+        get_default_schema().encode(profile)
+        self.profile = dict(profile)
+        return self._rediagnose()
+
+
+class SleepDiary:
+    """Diaries of many users, each updated in constant time per night
+
+    Args:
+        window: Number of most recent calendar nights the facts are derived from
+        min_nights: Nights recording a measure before it yields an answer
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, min_nights=DEFAULT_MIN_NIGHTS):
+        self.window = window
+        self.min_nights = min_nights
+        self.users = {}
+
+    def user(self, user_id):
+        diary = self.users.get(user_id)
+        if diary is None:
+            diary = self.users[user_id] = UserDiary(self.window, self.min_nights)
+        return diary
+
+    def set_profile(self, user_id, profile):
+        return self.user(user_id).set_profile(profile)
+
+    def ingest(self, user_id, record):
+        """
+        Add one diary record (a dict, see parse_entry) for a user
+
+        Returns:
+            Tuple of (result, DiagnosisDiff) with the user's updated
+            (diagnoses, recommendations, confidence_scores)
+        """
+        diary = self.user(user_id)
+        diff = diary.add_night(parse_entry(record))
+        return diary.result, diff
+
+
+# ==================== VERIFICATION ====================
+
+def _diary(nights, caffeine=None, exercise=None):
+    """Window of ``nights`` 23:00-07:00 nights with activities on given nights
+
+    caffeine and exercise map a night number to the activity's time; other
+    nights record none.
+    """
+    window = RollingWindow(nights)
+    start = date(2024, 1, 1)
+    for night in range(nights):
+        record = {'date': (start + timedelta(days=night)).isoformat(), 'bedtime': '23:00',
+                  'wake_time': '07:00', 'caffeine_time': (caffeine or {}).get(night),
+                  'exercise_time': (exercise or {}).get(night)}
+        entry = parse_entry(record)
+        window.push(entry.date, entry_measures(entry))
+    return window
+
+
+def verify_derivation():
+    """
+    Check the derived timing answers on hand-made diaries
+
+    Returns:
+        List of (case, attribute, expected, derived) for every wrong answer
+    """
+    every_few_days = (0, 4, 8, 12)
+    cases = [
+        # Late on every day with the activity, but on few days
+        ('late, low frequency', _diary(14, dict.fromkeys(every_few_days, '16:30'),
+                                       dict.fromkeys(every_few_days, '21:30')),
+         {'caffeine_timing': 'late', 'exercise_timing': 'late'}),
+        ('early, daily', _diary(14, dict.fromkeys(range(14), '08:00'), dict.fromkeys(range(14), '07:00')),
+         {'caffeine_timing': 'early', 'exercise_timing': 'early'}),
+        ('mostly early', _diary(14, {night: '16:30' if night < 4 else '09:00' for night in range(10)},
+                                {night: '21:30' if night < 4 else '12:00' for night in range(10)}),
+         {'caffeine_timing': 'early', 'exercise_timing': 'early'}),
+        ('none', _diary(14), {'caffeine_timing': 'none', 'exercise_timing': 'none'}),
+    ]
+    failures = []
+    for name, window, expected in cases:
+        facts = derive_facts(window)
+        for attribute, value in expected.items():
+            if facts.get(attribute) != value:
+                failures.append((name, attribute, value, facts.get(attribute)))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Diagnose users night by night from their sleep diaries")
+    parser.add_argument('input', nargs='?', default='-',
+                        help="JSONL diary entries with a user field, in date order ('-' for stdin)")
+    parser.add_argument('--profiles', help="JSONL of questionnaire answers with a user field")
+    parser.add_argument('--user-field', default='user')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help="calendar nights per rolling window")
+    parser.add_argument('--min-nights', type=int, default=DEFAULT_MIN_NIGHTS,
+                        help="nights recording a measure before an answer is derived from it")
+    parser.add_argument('--changes-only', action='store_true',
+                        help="only write nights whose diagnoses changed")
+    parser.add_argument('--verify', action='store_true', help="check the fact derivation on sample diaries and exit")
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        failures = verify_derivation()
+        print(f"Verification: {len(failures)} wrong answer(s)")
+        for name, attribute, expected, derived in failures:
+            print(f"  {name}: {attribute} is {derived!r}, expected {expected!r}")
+        return 1 if failures else 0
+
+    from pipeline import read_jsonl
+
+    diaries = SleepDiary(args.window, args.min_nights)
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    try:
+        if args.profiles:
+            with open(args.profiles, encoding='utf-8') as f:
+                for profile in read_jsonl(f):
+                    user_id = profile.pop(args.user_field, None)
+                    diaries.set_profile(user_id, profile)
+        for number, record in enumerate(read_jsonl(source), 1):
+            user_id = record.get(args.user_field)
+            try:
+                result, diff = diaries.ingest(user_id, record)
+            except ValueError as e:
+                raise ValueError(f"Entry {number}: {e}") from None
+            if args.changes_only and not (diff.added or diff.removed):
+                continue
+            output = {args.user_field: user_id, 'date': diaries.user(user_id).window.last_date().isoformat(),
+                      'facts': diaries.user(user_id).facts,
+                      'added': diff.added, 'removed': diff.removed, **result_record(result)}
+            sys.stdout.write(json.dumps(output, ensure_ascii=False) + '\n')
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Vectorized evaluation of the SleepQualityOptimizer rules with NumPy.
+
+Each attribute is dictionary-encoded into a small-int column (0 meaning an
+unmatched or missing answer), every rule literal becomes a comparison on a
+column, and every rule a sum of conjunctive branch masks. A whole dataset
+is diagnosed in one pass over its columns.
+"""
+import numpy as np
+
+from decision_table import extract_rules, rule_domains
+from input_schema import get_default_schema
+
+
+class VectorizedResult:
+    """Per-row outcome of a vectorized evaluation
+
+    Attributes:
+        bits: uint32 array, bit i set when diagnosis i was made for the row
+        counts: uint8 array (rules x rows) with how many times each rule fired
+        labels: diagnosis labels, indexed like the bits
+        confidence_values: float32 array with the confidence of each label
+    """
+
+    def __init__(self, bits, counts, labels, confidence_values):
+        self.bits = bits
+        self.counts = counts
+        self.labels = labels
+        self.confidence_values = confidence_values
+
+    def __len__(self):
+        return len(self.bits)
+
+    def mask(self, label):
+        """Boolean row mask of the rows diagnosed with ``label``"""
+        return (self.bits >> np.uint32(self.labels.index(label))) & np.uint32(1) == 1
+
+    def confidences(self):
+        """float32 matrix (rows x labels) of confidences, 0 where not diagnosed"""
+        shifts = np.arange(len(self.labels), dtype=np.uint32)
+        present = (self.bits[:, None] >> shifts) & np.uint32(1)
+        return present.astype(np.float32) * self.confidence_values
+
+    def prevalence(self):
+        """Number of rows carrying each diagnosis, keyed by label"""
+        return {label: int(np.count_nonzero(self.mask(label))) for label in self.labels}
+
+    def diagnoses(self, row):
+        """Distinct diagnoses of one row, in rule definition order"""
+        bits = int(self.bits[row])
+        return [label for i, label in enumerate(self.labels) if bits >> i & 1]
+
+
+class VectorizedEvaluator:
+    """Evaluates every rule over dictionary-encoded columns at once"""
+
+    def __init__(self, specs=None):
+        if specs is None:
+            specs = extract_rules()
+        self.specs = specs
+        self.domains = rule_domains(specs)
+        self.codes = {attribute: {value: code for code, value in enumerate(values, 1)}
+                      for attribute, values in self.domains.items()}
+
+        self.labels = []
+        confidences = {}
+        self.rule_labels = []
+        for spec in specs:
+            indices = []
+            for diagnosis in spec.diagnoses:
+                if diagnosis not in self.labels:
+                    self.labels.append(diagnosis)
+                indices.append(self.labels.index(diagnosis))
+            self.rule_labels.append(indices)
+            confidences.update(spec.confidence_scores)
+        if len(self.labels) > 32:
+            raise ValueError("At most 32 distinct diagnoses fit in a row bitset")
+        self.confidence_values = np.array([confidences[label] for label in self.labels],
+                                          dtype=np.float32)
+
+        # Each branch as a list of (attribute, code, positive) literals
+        self.branches = [[[(a, self.codes[a][v], positive) for a, v, positive in branch]
+                          for branch in spec.branches]
+                         for spec in specs]
+
+    def encode_column(self, attribute, values):
+        """Encode a sequence of logical values of one attribute as uint8 codes"""
+        codes = self.codes.get(attribute, {})
+        return np.fromiter((codes.get(v, 0) for v in values), dtype=np.uint8, count=len(values))
+
+    def schema_columns(self, matrix, schema=None):
+        """
+        Columns of rule codes from a (rows x attributes) matrix of schema codes
+
+        Args:
+            matrix: uint8 array of questionnaires encoded with ``schema``
+            schema: QuestionnaireSchema of the matrix (defaults to the
+                questionnaire's)
+        """
+        if schema is None:
+            schema = get_default_schema()
+        return self.project_columns({attribute: matrix[:, index] for attribute, index in schema.index.items()},
+                                    schema)
+
+    def project_columns(self, columns, schema=None):
+        """
+        Columns of rule codes from columns of schema codes
+
+        Args:
+            columns: attribute -> uint8 array of ``schema`` codes
+            schema: QuestionnaireSchema of the columns (defaults to the
+                questionnaire's)
+        """
+        if schema is None:
+            schema = get_default_schema()
+        luts = schema.projection(self.codes)
+        projected = {}
+        for attribute in self.codes:
+            index = schema.index.get(attribute)
+            column = columns.get(attribute)
+            if index is not None and column is not None:
+                projected[attribute] = np.asarray(luts[index], dtype=np.uint8)[column]
+        return projected
+
+    def encode_records(self, records, schema=None, strict=False):
+        """
+        Encode a list of user input dictionaries into columns
+
+        Args:
+            records: List of user input dictionaries
+            schema: QuestionnaireSchema to encode with (defaults to the
+                questionnaire's)
+            strict: Raise SchemaError for answers outside the questionnaire
+                instead of treating them as unanswered
+        """
+        if schema is None:
+            schema = get_default_schema()
+        encode = schema.encode
+        matrix = np.frombuffer(b''.join([bytes(encode(r, strict)) for r in records]), dtype=np.uint8)
+        columns = self.schema_columns(matrix.reshape(len(records), len(schema)), schema)
+        # Attributes read by rules but not asked by the questionnaire
+        for attribute in schema.missing(self.codes):
+            codes = self.codes[attribute]
+            columns[attribute] = np.fromiter((codes.get(r.get(attribute), 0) for r in records),
+                                             dtype=np.uint8, count=len(records))
+        return columns
+
+    def evaluate(self, columns, rows=None):
+        """
+        Evaluate all rules over encoded columns
+
+        Args:
+            columns: Mapping of attribute to an integer code array; missing
+                attributes count as unanswered
+            rows: Number of rows (needed only when no column is given)
+
+        Returns:
+            VectorizedResult for the rows
+        """
+        if rows is None:
+            rows = len(next(iter(columns.values())))
+        unanswered = np.zeros(rows, dtype=np.uint8)
+
+        literal_masks = {}
+
+        def literal(attribute, code, positive):
+            key = (attribute, code)
+            mask = literal_masks.get(key)
+            if mask is None:
+                mask = literal_masks[key] = columns.get(attribute, unanswered) == code
+            return mask if positive else ~mask
+
+        counts = np.zeros((len(self.specs), rows), dtype=np.uint8)
+        bits = np.zeros(rows, dtype=np.uint32)
+        for index, branches in enumerate(self.branches):
+            count = counts[index]
+            for branch in branches:
+                mask = np.ones(rows, dtype=bool)
+                for attribute, code, positive in branch:
+                    mask &= literal(attribute, code, positive)
+                count += mask
+            fired = (count > 0).astype(np.uint32)
+            for label_index in self.rule_labels[index]:
+                bits |= fired << np.uint32(label_index)
+
+        return VectorizedResult(bits, counts, self.labels, self.confidence_values)
+
+    def evaluate_records(self, records, strict=False):
+        """Encode and evaluate a list of user input dictionaries"""
+        return self.evaluate(self.encode_records(records, strict=strict), len(records))